@@ -0,0 +1,7 @@
+from .lru import LRUCache
+from .answer_cache import AnswerCache
+from .retrieval_cache import RetrievalCache, ProjectGenerations, project_generations
+from .hashing import content_hash, normalize_text
+from .manifest import SyncManifest, scan_files, file_hash
+from .dedup import Deduplicator, simhash
+from .write_behind import WriteBehindBuffer
@@ -0,0 +1,105 @@
+import time
+import threading
+from typing import Dict, List, Optional
+
+import numpy
+
+
+class _ProjectAnswers:
+    '''Fixed-size ring of (normalized question embedding, answer) for one project.'''
+
+    def __init__(self, max_size: int, dim: int):
+        self.embeddings = numpy.zeros((max_size, dim), dtype=numpy.float32)
+        self.timestamps = numpy.full(max_size, -numpy.inf)
+        self.answers: List[Optional[str]] = [None] * max_size
+        self.next = 0
+
+    def add(self, embedding: numpy.ndarray, answer: str, now: float):
+        slot = self.next % len(self.answers)
+        self.embeddings[slot] = embedding
+        self.timestamps[slot] = now
+        self.answers[slot] = answer
+        self.next += 1
+
+    def match(self, embedding: numpy.ndarray, threshold: float, expire_before: float):
+        scores = self.embeddings @ embedding
+        scores[self.timestamps < expire_before] = -numpy.inf
+        best = int(numpy.argmax(scores))
+        if scores[best] >= threshold:
+            return self.answers[best], float(scores[best])
+        return None, float(scores[best])
+
+
+class AnswerCache:
+    '''Semantic cache of final answers, matching questions by cosine similarity of their embeddings.
+
+    Args:
+        threshold (float): minimum cosine similarity for a cached question to be a hit.
+        ttl (float): seconds an answer stays valid, no expiry if None.
+        max_size (int): maximum number of answers kept per project, oldest are overwritten first.
+    '''
+
+    def __init__(self, threshold: float = 0.95, ttl: Optional[float] = 3600, max_size: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._projects: Dict[str, _ProjectAnswers] = {}
+        self._epochs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def epoch(self, project: str) -> int:
+        '''Invalidation counter of project, pass it to add() to drop answers computed before an invalidation.'''
+        with self._lock:
+            return self._epochs.get(project, 0)
+
+    def lookup(self, project: str, embedding: List[float]) -> Optional[str]:
+        '''Return the cached answer of the most similar question, or None on a miss.'''
+        embedding = self._normalize(embedding)
+        now = time.time()
+        expire_before = now - self.ttl if self.ttl else -numpy.inf
+        with self._lock:
+            entries = self._projects.get(project)
+            answer = None
+            if entries is not None and entries.embeddings.shape[1] == embedding.shape[0]:
+                answer, _ = entries.match(embedding, self.threshold, expire_before)
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def add(self, project: str, embedding: List[float], answer: str, epoch: Optional[int] = None):
+        '''Cache answer, skipped if project has been invalidated since epoch was read.'''
+        embedding = self._normalize(embedding)
+        with self._lock:
+            if epoch is not None and epoch != self._epochs.get(project, 0):
+                return
+            entries = self._projects.get(project)
+            if entries is None or entries.embeddings.shape[1] != embedding.shape[0]:
+                entries = _ProjectAnswers(self.max_size, embedding.shape[0])
+                self._projects[project] = entries
+            entries.add(embedding, answer, time.time())
+
+    def invalidate(self, project: str):
+        '''Remove all answers of project, called when project data changes.'''
+        with self._lock:
+            self._projects.pop(project, None)
+            self._epochs[project] = self._epochs.get(project, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': {p: min(x.next, self.max_size) for p, x in self._projects.items()}
+            }
+
+    @staticmethod
+    def _normalize(embedding) -> numpy.ndarray:
+        embedding = numpy.asarray(embedding, dtype=numpy.float32)
+        norm = numpy.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
@@ -0,0 +1,72 @@
+import hashlib
+from typing import Iterable, List, Optional
+
+import numpy
+
+from .hashing import normalize_text, content_hash
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    '''64-bit SimHash fingerprint of text over shingles of words, similar texts differ in few bits.'''
+    words = normalize_text(text).lower().split(' ')
+    shingles = [' '.join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    digests = numpy.frombuffer(
+        b''.join(hashlib.blake2b(x.encode('utf-8'), digest_size=8).digest() for x in shingles), dtype=numpy.uint8)
+    # Each bit is voted by all shingles, 1 if more shingle hashes have it set
+    votes = numpy.unpackbits(digests.reshape(len(shingles), 8), axis=1).sum(axis=0)
+    return int.from_bytes(numpy.packbits(votes * 2 > len(shingles)).tobytes(), 'big')
+
+
+class Deduplicator:
+    '''Find duplicate doc chunks before they are embedded.
+
+    Exact duplicates are chunks with the same content hash (after normalizing whitespace), also against stored chunks.
+    With near_dup, chunks whose SimHash fingerprints differ in at most max_distance bits are near duplicates.
+    Fingerprints are split in max_distance + 1 bands, so a near duplicate shares at least one band with the chunk kept
+    and is found without comparing all pairs. Fingerprints are not stored, near duplicates are found in a batch only.
+
+    Args:
+        near_dup (bool): whether to detect near duplicates.
+        max_distance (int): maximum number of different bits of near duplicate fingerprints.
+    '''
+
+    def __init__(self, near_dup: bool = False, max_distance: int = 3):
+        assert 0 <= max_distance < 64, f'Invalid SimHash distance: {max_distance}'
+        self.near_dup = near_dup
+        self.max_distance = max_distance
+        num_bands = max_distance + 1
+        width = 64 // num_bands
+        self.bands = [(i * width, 64 if i == num_bands - 1 else (i + 1) * width) for i in range(num_bands)]
+
+    def filter(self, texts: List[str], hashes: Optional[List[str]] = None, stored: Iterable[str] = ()) -> List[int]:
+        '''Indices of texts to keep, the first of each group of duplicates not stored yet.
+
+        Args:
+            texts (List[str]): doc chunks.
+            hashes (List[str]): content hashes of texts, computed if not given.
+            stored (Iterable[str]): content hashes of chunks already stored.
+        '''
+        if hashes is None:
+            hashes = [content_hash(x) for x in texts]
+        seen = set(stored)
+        buckets = {}
+        fingerprints = []
+        keep = []
+        for i, (text, key) in enumerate(zip(texts, hashes)):
+            if key in seen:
+                continue
+            seen.add(key)
+            if self.near_dup:
+                fingerprint = simhash(text)
+                band_keys = self._band_keys(fingerprint)
+                candidates = {j for x in band_keys for j in buckets.get(x, [])}
+                if any(bin(fingerprint ^ fingerprints[j]).count('1') <= self.max_distance for j in candidates):
+                    continue
+                for x in band_keys:
+                    buckets.setdefault(x, []).append(len(fingerprints))
+                fingerprints.append(fingerprint)
+            keep.append(i)
+        return keep
+
+    def _band_keys(self, fingerprint: int) -> List[tuple]:
+        return [(band, fingerprint >> start & ((1 << end - start) - 1)) for band, (start, end) in enumerate(self.bands)]
@@ -0,0 +1,15 @@
+import re
+import hashlib
+
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    '''Collapse whitespace, so chunks differing only in line breaks or indentation are the same content.'''
+    return WHITESPACE.sub(' ', text).strip()
+
+
+def content_hash(text: str) -> str:
+    '''Digest of a normalized doc chunk, stored with the chunk to tell changed or duplicate chunks and to dedup search results.'''
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=16).hexdigest()
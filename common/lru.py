@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    '''Thread-safe bounded mapping with least-recently-used eviction.
+
+    Args:
+        max_size (int): maximum number of entries kept in cache.
+        on_evict (Callable): optional callback called with the value of each entry evicted or invalidated,
+            e.g. to close connections held by the cached object.
+    '''
+
+    def __init__(self, max_size: int = 128, on_evict: Optional[Callable[[Any], None]] = None):
+        assert max_size > 0, 'Cache size must be positive.'
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            old = self._data.pop(key, None)
+            self._data[key] = value
+            evicted = []
+            while len(self._data) > self.max_size:
+                _, x = self._data.popitem(last=False)
+                evicted.append(x)
+        if old is not None and old is not value:
+            evicted.append(old)
+        self._evict(evicted)
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        '''Return cached value, or create it with factory() outside the lock and cache it.
+        If another thread cached the key meanwhile, its value wins and the new one is discarded.
+        '''
+        value = self.get(key)
+        if value is not None:
+            return value
+        value = factory()
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                existing = self._data[key]
+            else:
+                existing = None
+        if existing is not None:
+            self._evict([value])
+            return existing
+        self.put(key, value)
+        return value
+
+    def pop(self, key: Hashable) -> Any:
+        with self._lock:
+            value = self._data.pop(key, None)
+        if value is not None:
+            self._evict([value])
+        return value
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        '''Drop all entries whose key matches predicate, return the number of entries dropped.'''
+        with self._lock:
+            keys = [k for k in self._data if predicate(k)]
+            values = [self._data.pop(k) for k in keys]
+        self._evict(values)
+        return len(values)
+
+    def clear(self):
+        with self._lock:
+            values = list(self._data.values())
+            self._data.clear()
+        self._evict(values)
+
+    def _evict(self, values):
+        if self.on_evict is None:
+            return
+        for value in values:
+            self.on_evict(value)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,87 @@
+import os
+import json
+import glob
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+
+def file_hash(path: str) -> str:
+    '''Digest of file content, read in blocks.'''
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_files(data_dir: str, patterns: List[str]) -> List[str]:
+    '''Sorted paths of files under data_dir (recursively) matching any of the glob patterns.'''
+    files = set()
+    for pattern in patterns:
+        files.update(x for x in glob.glob(os.path.join(data_dir, '**', pattern), recursive=True) if os.path.isfile(x))
+    return sorted(files)
+
+
+class SyncManifest:
+    '''Per-project record of synced files: path -> size, mtime, content hash and content hashes of its chunks.
+
+    A file whose size and mtime did not change is not read again, a file touched without changes is not split again.
+    The manifest is saved to a json file of the project under path.
+
+    Args:
+        project (str): project name.
+        path (str): directory of manifest files.
+    '''
+
+    def __init__(self, project: str, path: str = 'sync_manifest'):
+        self.file = os.path.join(path, f'{project}.json')
+        self.files: Dict[str, dict] = {}
+        if os.path.exists(self.file):
+            with open(self.file, encoding='utf-8') as f:
+                self.files = json.load(f)
+
+    def diff(self, paths: List[str]) -> Tuple[Dict[str, str], List[str]]:
+        '''Compare files on disk with the manifest.
+        Returns new or changed files with their content hashes, and files of the manifest no longer in paths.
+        '''
+        changed = {}
+        for path in paths:
+            stat = os.stat(path)
+            entry = self.files.get(path)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+                continue
+            content = file_hash(path)
+            if entry and entry['hash'] == content:
+                # Touched without changes
+                entry['size'], entry['mtime'] = stat.st_size, stat.st_mtime_ns
+                continue
+            changed[path] = content
+        paths = set(paths)
+        removed = [x for x in self.files if x not in paths]
+        return changed, removed
+
+    def chunks(self, path: str) -> Optional[List[str]]:
+        '''Content hashes of chunks synced for path, None if it was never synced.'''
+        entry = self.files.get(path)
+        return None if entry is None else list(entry['chunks'])
+
+    def update(self, path: str, content: str, chunks: List[str]):
+        stat = os.stat(path)
+        self.files[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': content, 'chunks': list(chunks)}
+
+    def remove(self, path: str):
+        self.files.pop(path, None)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.file) or '.', exist_ok=True)
+        # Write to a temporary file and rename, so a crash never leaves a half-written manifest
+        with open(self.file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.files, f)
+        os.replace(self.file + '.tmp', self.file)
+
+    @classmethod
+    def drop(cls, project: str, path: str = 'sync_manifest'):
+        '''Forget all synced files of project, called when the project is dropped.'''
+        file = os.path.join(path, f'{project}.json')
+        if os.path.exists(file):
+            os.remove(file)
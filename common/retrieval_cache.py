@@ -0,0 +1,97 @@
+import time
+import hashlib
+import threading
+from typing import Dict, Hashable, List, Optional
+
+import numpy
+
+from .lru import LRUCache
+
+
+class ProjectGenerations:
+    '''Per-project counters, bumped by insert and drop whenever project data changes.
+    Counters are kept in process: changes made by other processes (offline tools, other server workers) do not bump them.
+    '''
+
+    def __init__(self):
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, project: str) -> int:
+        with self._lock:
+            return self._generations.get(project, 0)
+
+    def bump(self, project: str) -> int:
+        with self._lock:
+            self._generations[project] = self._generations.get(project, 0) + 1
+            return self._generations[project]
+
+
+# Shared by operations of both options in a process
+project_generations = ProjectGenerations()
+
+
+class RetrievalCache:
+    '''LRU cache of search results keyed by (project, generation, quantized query embedding, top_k, threshold).
+
+    Keys carry the project generation read before searching, so a result is not served after project data was changed
+    by this process, even if the search raced with an insert. Changes made by other processes are not seen,
+    results expire after ttl seconds to bound how long such changes are missed.
+
+    Args:
+        max_size (int): maximum number of search results kept.
+        ttl (float): seconds a result stays valid, no expiry if None.
+        generations (ProjectGenerations): project generation counters, the process-wide ones by default.
+    '''
+
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = 300,
+                 generations: Optional[ProjectGenerations] = None):
+        self.generations = generations or project_generations
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = LRUCache(max_size=max_size)
+        self._lock = threading.Lock()
+
+    def key(self, project: str, embedding: List[float], top_k: int, threshold: float) -> tuple:
+        return (project, self.generations.get(project), self.quantize(embedding), top_k, threshold)
+
+    def get(self, key: Hashable) -> Optional[list]:
+        res = self._cache.get(key)
+        if res is not None and self.ttl and time.monotonic() - res[0] > self.ttl:
+            res = None
+        with self._lock:
+            if res is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if res is None else list(res[1])
+
+    def put(self, key: Hashable, docs: list):
+        self._cache.put(key, (time.monotonic(), list(docs)))
+
+    def invalidate(self, project: str):
+        '''Free cached results of project.
+        Bumping the project generation is enough to never hit them again, this only releases memory early.
+        '''
+        self._cache.invalidate(lambda key: key[0] == project)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._cache)
+            }
+
+    @staticmethod
+    def quantize(embedding) -> str:
+        '''Digest of the normalized embedding rounded to int8, so float noise of the encoder does not miss the cache.'''
+        embedding = numpy.asarray(embedding, dtype=numpy.float32)
+        norm = numpy.linalg.norm(embedding)
+        if norm > 0:
+            embedding = embedding / norm
+        quantized = numpy.round(embedding * 127).astype(numpy.int8)
+        return hashlib.blake2b(quantized.tobytes(), digest_size=16).hexdigest()
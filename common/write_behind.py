@@ -0,0 +1,164 @@
+import time
+import atexit
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    '''Buffer chat turns in process and write them to the memory store in batches in the background.
+
+    Turns of all sessions of a project are written together by one call of write_func, once max_rows turns are
+    buffered or the oldest buffered turn has waited interval seconds. Turns which failed to write stay buffered for
+    the next flush. Buffered turns are flushed at exit, so a graceful shutdown loses nothing.
+    Reads go through read, which appends turns not written yet to those read from the store (read-your-writes),
+    without waiting for a running flush.
+
+    Args:
+        write_func (Callable): writes a batch of a project, called with (project, [(session_id, messages), ...]).
+        interval (float): maximum seconds a turn stays in the buffer.
+        max_rows (int): number of buffered turns which triggers a flush right away.
+    '''
+
+    def __init__(self,
+                 write_func: Callable[[str, List[Tuple[str, list]]], None],
+                 interval: float = 1,
+                 max_rows: int = 100
+                 ):
+        self.write_func = write_func
+        self.interval = interval
+        self.max_rows = max_rows
+        self.stats = {'buffered': 0, 'written': 0, 'batches': 0, 'errors': 0}
+        # Buffered messages by (project, session_id) in order, with the time of the oldest one
+        self._pending: Dict[Tuple[str, str], list] = {}
+        self._since = None
+        self._rows = 0
+        # Messages being written by a flush, read from the buffer until the batch of their project is committed
+        self._writing: Dict[Tuple[str, str], list] = {}
+        self._committed = set()
+        # Bumped by each committed batch, so reads can tell a batch was committed while they read the store
+        self._commits = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='history-write-behind', daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def add(self, project: str, session_id: str, messages: list):
+        '''Buffer messages of a session, to be written by the background flush.'''
+        if len(messages) == 0:
+            return
+        with self._cond:
+            self._pending.setdefault((project, session_id), []).extend(messages)
+            if self._since is None:
+                self._since = time.monotonic()
+            self._rows += len(messages)
+            self.stats['buffered'] += len(messages)
+            if self._rows >= self.max_rows:
+                self._cond.notify_all()
+
+    def read(self, project: str, session_id: str, read_func: Callable[[], list]) -> list:
+        '''Messages of a session: those read from the store by read_func, then those not written yet.
+        A read does not wait for a running flush. It is retried only if a batch was committed while it read
+        the store, as the store may or may not have returned that batch, so no message is missed or returned twice.
+        '''
+        while True:
+            with self._cond:
+                commits = self._commits
+                buffered = self._buffered(project, session_id)
+            stored = read_func()
+            with self._cond:
+                if self._commits == commits:
+                    return list(stored) + buffered
+
+    async def aread(self, project: str, session_id: str, read_func: Callable[[], Awaitable[list]]) -> list:
+        '''Async version of read, with read_func a coroutine function reading the store.'''
+        while True:
+            with self._cond:
+                commits = self._commits
+                buffered = self._buffered(project, session_id)
+            stored = await read_func()
+            with self._cond:
+                if self._commits == commits:
+                    return list(stored) + buffered
+
+    def pending(self, project: Optional[str] = None) -> int:
+        '''Number of messages not written yet, of project if given.'''
+        with self._cond:
+            writing = [(k, v) for k, v in self._writing.items() if k[0] not in self._committed]
+            return sum(len(v) for k, v in list(self._pending.items()) + writing
+                       if project is None or k[0] == project)
+
+    def flush(self):
+        '''Write all buffered messages now, e.g. before deleting history so no buffered turn outlives it.'''
+        with self._flush_lock:
+            with self._cond:
+                if not self._pending:
+                    return
+                self._writing, self._pending = self._pending, {}
+                self._since, self._rows = None, 0
+            failed = {}
+            try:
+                batches = {}
+                for (project, session_id), messages in self._writing.items():
+                    batches.setdefault(project, []).append((session_id, messages))
+                for project, batch in batches.items():
+                    try:
+                        self.write_func(project, batch)
+                        with self._cond:
+                            self._committed.add(project)
+                            self._commits += 1
+                            self.stats['written'] += sum(len(x[1]) for x in batch)
+                            self.stats['batches'] += 1
+                    except Exception as e:  # pylint: disable=W0718
+                        logger.error('Failed to write chat history of project %s, keeping it buffered:\n%s',
+                                     project, e)
+                        self.stats['errors'] += 1
+                        failed.update({(project, session_id): messages for session_id, messages in batch})
+            finally:
+                with self._cond:
+                    # Failed messages go back before those buffered during the flush
+                    for key, messages in failed.items():
+                        self._pending[key] = messages + self._pending.get(key, [])
+                        self._rows += len(messages)
+                    if failed and self._since is None:
+                        self._since = time.monotonic()
+                    self._writing = {}
+                    self._committed = set()
+                    self._cond.notify_all()
+
+    def close(self):
+        '''Stop the background flush and write buffered messages, called at exit.'''
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join()
+        self.flush()
+        lost = self.pending()
+        if lost > 0:
+            logger.error('Failed to write %s buffered chat history messages at exit.', lost)
+
+    def _buffered(self, project: str, session_id: str) -> list:
+        key = (project, session_id)
+        writing = [] if project in self._committed else list(self._writing.get(key, []))
+        return writing + list(self._pending.get(key, []))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if self._since is None:
+                    self._cond.wait(timeout=self.interval)
+                    continue
+                wait = self._since + self.interval - time.monotonic()
+                if self._rows < self.max_rows and wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+            self.flush()
@@ -41,9 +41,9 @@ def clear_memory(project, session):
 
 def add_project(project, data_url: str = None, data_file: object = None):
     if data_file:
-        return insert(data_src=data_file.name, project=project, source_type='file')
+        return insert(data_src=data_file.name, project=project, source_type='file')['inserted']
     if data_url:
-        return insert(data_src=data_url, project=project, source_type='url')
+        return insert(data_src=data_url, project=project, source_type='url')['inserted']
 
 def check_project(project):
     status = check(project)
@@ -1 +1,2 @@
 from .chat_agent import ChatAgent
+from .streaming import FinalAnswerStreamHandler
@@ -0,0 +1,83 @@
+import re
+import json
+import asyncio
+from typing import Any, Optional
+
+from langchain.callbacks.base import AsyncCallbackHandler
+
+
+FINAL_ANSWER_PREFIX = re.compile(r'"action"\s*:\s*"Final Answer"\s*,\s*"action_input"\s*:\s*"')
+
+
+class FinalAnswerStreamHandler(AsyncCallbackHandler):
+    '''Forward tokens of the agent final answer to an asyncio queue while the LLM is generating.
+
+    The agent answers with a json blob, so tokens are buffered until the "Final Answer" action is seen,
+    then the json string value of "action_input" is decoded and pushed token by token.
+    Tool calls (other actions) are never forwarded.
+    '''
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.streamed = False
+        self._buffer = ''
+        self._pos = None
+        self._closed = False
+
+    async def on_llm_start(self, *args: Any, **kwargs: Any) -> None:
+        self._buffer = ''
+        self._pos = None
+        self._closed = False
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self._buffer += token
+        if self._closed:
+            return
+        if self._pos is None:
+            match = FINAL_ANSWER_PREFIX.search(self._buffer)
+            if not match:
+                return
+            self._pos = match.end()
+        text = self._decode()
+        if text:
+            self.streamed = True
+            await self.queue.put(text)
+
+    def _decode(self) -> str:
+        '''Decode the json string from the current position up to the last complete character.'''
+        out = []
+        pos = self._pos
+        buffer = self._buffer
+        while pos < len(buffer):
+            char = buffer[pos]
+            if char == '"':
+                self._closed = True
+                break
+            if char == '\\':
+                escaped = self._decode_escape(buffer, pos)
+                if escaped is None:
+                    # Wait for the rest of the escape sequence
+                    break
+                text, pos = escaped
+                out.append(text)
+                continue
+            out.append(char)
+            pos += 1
+        self._pos = pos
+        return ''.join(out)
+
+    @staticmethod
+    def _decode_escape(buffer: str, pos: int) -> Optional[tuple]:
+        if pos + 1 >= len(buffer):
+            return None
+        if buffer[pos + 1] == 'u':
+            if pos + 6 > len(buffer):
+                return None
+            end = pos + 6
+        else:
+            end = pos + 2
+        try:
+            text = json.loads('"' + buffer[pos:end] + '"')
+        except json.JSONDecodeError:
+            text = buffer[pos + 1:end]
+        return text, end
@@ -1,2 +1,3 @@
 from .data_parser import DataParser
+from .ingest import IngestPipeline
 # from .question_generator import QuestionGenerator
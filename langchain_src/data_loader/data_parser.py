@@ -1,13 +1,15 @@
 import os
 import sys
 
-from typing import List, Optional
+from typing import Iterator, List, Optional
 from langchain.docstore.document import Document
 from langchain.text_splitter import TextSplitter, RecursiveCharacterTextSplitter
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
 from config import DATAPARSER_CONFIG
+from common import content_hash
+from .url_fetcher import URLFetcher
 
 
 CHUNK_SIZE = DATAPARSER_CONFIG.get('chunk_size', 300)
@@ -18,23 +20,50 @@ class DataParser:
 
     def __init__(self,
                  splitter: TextSplitter = RecursiveCharacterTextSplitter(
-                     chunk_size=CHUNK_SIZE)
+                     chunk_size=CHUNK_SIZE),
+                 url_fetcher: Optional[URLFetcher] = None
                  ):
         self.splitter = splitter
+        self._url_fetcher = url_fetcher
+
+    @property
+    def url_fetcher(self) -> URLFetcher:
+        '''Fetcher of url sources, created on first use'''
+        if self._url_fetcher is None:
+            self._url_fetcher = URLFetcher()
+        return self._url_fetcher
 
     def __call__(self, data_src, source_type: str = 'file') -> List[str]:
+        docs = self.load_documents(data_src, source_type=source_type)
+        return [str(doc.page_content) for doc in docs]
+
+    def load_documents(self, data_src, source_type: str = 'file') -> List[Document]:
+        '''Load doc chunks as LangChain Documents, with the source (file path or url) and content hash in metadata'''
+        return [doc for docs in self.iter_documents(data_src, source_type=source_type) for doc in docs]
+
+    def iter_documents(self, data_src, source_type: str = 'file') -> Iterator[List[Document]]:
+        '''Load and split sources one by one, yielding doc chunks of each source like load_documents.
+        Only one unsplit source is held in memory at a time.
+        '''
         if not isinstance(data_src, list):
             data_src = [data_src]
         if source_type == 'file':
-            docs = self.from_files(data_src)
+            loaded = (self.from_files([src]) for src in data_src)
         elif source_type == 'url':
-            docs = self.from_urls(data_src)
+            # Urls are fetched concurrently, a few pages ahead of the one split
+            loaded = self.url_fetcher.iter_fetch(data_src)
         else:
             raise AttributeError(
                 'Invalid source type. Only support "file" or "url".')
 
-        docs = self.splitter.split_documents(docs)
-        return [str(doc.page_content) for doc in docs]
+        for unsplit in loaded:
+            docs = self.splitter.split_documents(unsplit)
+            for doc in docs:
+                doc.metadata = {
+                    'source': str(doc.metadata.get('source', '')),
+                    'content_hash': content_hash(str(doc.page_content))
+                }
+            yield docs
 
     def from_files(self, files: list, encoding: Optional[str] = None) -> List[Document]:
         '''Load documents from path or file-like object, return a list of unsplit LangChain Documents'''
@@ -51,8 +80,5 @@ class DataParser:
         return docs
 
     def from_urls(self, urls: List[str]) -> List[Document]:
-        from langchain.document_loaders import UnstructuredURLLoader  # pylint: disable=C0415
-
-        loader = UnstructuredURLLoader(urls=urls)
-        docs = loader.load()
-        return docs
+        '''Fetch urls concurrently, return a list of unsplit LangChain Documents of pages fetched'''
+        return self.url_fetcher.fetch(urls)
@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import queue
+import inspect
+import logging
+import threading
+from typing import Any, Callable, Iterator, Optional
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from config import DATAPARSER_CONFIG, TEXTENCODER_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+INGEST_CONFIG = DATAPARSER_CONFIG.get('ingest', {})
+BATCH_SIZE = INGEST_CONFIG.get('batch_size', 256)
+MEMORY_BUDGET_MB = INGEST_CONFIG.get('memory_budget_mb', 256)
+PROGRESS_INTERVAL = INGEST_CONFIG.get('progress_interval', 10)
+
+# Marks the end of the stream in a stage queue
+_END = object()
+
+
+class IngestPipeline:
+    '''Streaming ingestion: load & split -> embed -> write, with the stages running concurrently.
+
+    Stages run in their own threads connected by bounded queues of chunk batches, so embedding overlaps
+    with network writes and loading waits when later stages fall behind.
+    Queue sizes are derived from memory_budget_mb: batches of texts, metadatas and float32 embeddings in flight
+    (queued or processed by a stage) are kept under the budget, whatever the corpus size.
+
+    Args:
+        data_parser (DataParser): loads and splits sources, one source at a time.
+        doc_db (DocStore): store to write embeddings and chunks to.
+        embedding_func (Embeddings): text encoder embedding the chunks.
+        deduplicator (Deduplicator): skips duplicate chunks before embedding if given.
+        batch_size (int): number of chunks embedded and written together.
+        memory_budget_mb (float): peak memory of chunk batches in flight.
+        progress (Callable): called with the stats dict after each written batch, progress is logged if not given.
+    '''
+
+    def __init__(self,
+                 data_parser: Any,
+                 doc_db: Any,
+                 embedding_func: Any,
+                 deduplicator: Any = None,
+                 batch_size: int = BATCH_SIZE,
+                 memory_budget_mb: float = MEMORY_BUDGET_MB,
+                 progress: Optional[Callable[[dict], None]] = None
+                 ):
+        assert batch_size > 0, 'Batch size must be positive.'
+        self.data_parser = data_parser
+        self.doc_db = doc_db
+        self.embedding_func = embedding_func
+        self.deduplicator = deduplicator
+        self.batch_size = batch_size
+        self.progress = progress
+        # A batch holds texts and metadatas, about twice the chunk size in bytes, then float32 embeddings
+        chunk_bytes = 2 * DATAPARSER_CONFIG.get('chunk_size', 300) + 4 * TEXTENCODER_CONFIG.get('dim', 768)
+        # Each of the 3 stages may hold one batch besides those queued
+        in_flight = max(2, int(memory_budget_mb * 2 ** 20 // (chunk_bytes * batch_size)) - 3)
+        self.queue_size = max(1, in_flight // 2)
+        self.stats = {}
+        self._last_report = 0
+        self._seen = set()
+
+    def run(self, data_src, source_type: str = 'file') -> dict:
+        '''Ingest data sources, returning numbers of inserted and skipped chunks.'''
+        self.stats = {'sources': 0, 'loaded': 0, 'embedded': 0, 'inserted': 0, 'skipped': 0, 'start': time.monotonic()}
+        self._last_report = self.stats['start']
+        stop = threading.Event()
+        split_queue = queue.Queue(maxsize=self.queue_size)
+        embed_queue = queue.Queue(maxsize=self.queue_size)
+        errors = []
+        self._seen = set()
+        stages = [
+            threading.Thread(target=self._stage, name='ingest-load', daemon=True,
+                             args=(self._load(data_src, source_type), split_queue, stop, errors)),
+            threading.Thread(target=self._stage, name='ingest-embed', daemon=True,
+                             args=(self._embed(split_queue, stop), embed_queue, stop, errors))
+        ]
+        for stage in stages:
+            stage.start()
+        try:
+            # Scalar index refresh is disabled and store counts are checked once for the whole load
+            with self.doc_db.bulk_load():
+                while True:
+                    item = self._get(embed_queue, stop)
+                    if item is _END:
+                        break
+                    texts, metadatas, embeddings = item
+                    self.doc_db.insert_embeddings(
+                        data=embeddings, metadatas=[{**m, 'text': t} for t, m in zip(texts, metadatas)])
+                    self.stats['inserted'] += len(texts)
+                    self._report()
+        except Exception as e:  # pylint: disable=W0718
+            errors.append(e)
+        finally:
+            stop.set()
+            for stage in stages:
+                stage.join()
+        if errors:
+            raise errors[0]
+        self._report(force=True)
+        return {'inserted': self.stats['inserted'], 'skipped': self.stats['skipped']}
+
+    def _load(self, data_src, source_type: str) -> Iterator[tuple]:
+        '''Batches of (texts, metadatas) of chunks, loading a source only when the previous one is batched.'''
+        texts, metadatas = [], []
+        for docs in self.data_parser.iter_documents(data_src, source_type=source_type):
+            self.stats['sources'] += 1
+            self.stats['loaded'] += len(docs)
+            for doc in docs:
+                texts.append(doc.page_content)
+                metadatas.append(doc.metadata)
+                if len(texts) == self.batch_size:
+                    yield texts, metadatas
+                    texts, metadatas = [], []
+        if texts:
+            yield texts, metadatas
+
+    def _embed(self, in_queue: queue.Queue, stop: threading.Event) -> Iterator[tuple]:
+        '''Batches of (texts, metadatas, embeddings), skipping duplicate chunks before embedding them.'''
+        for texts, metadatas in iter(lambda: self._get(in_queue, stop), _END):
+            if self.deduplicator:
+                texts, metadatas, skipped = self.doc_db.dedup(texts, metadatas, self.deduplicator, seen=self._seen)
+                self.stats['skipped'] += skipped
+                if len(texts) == 0:
+                    continue
+            if 'as_array' in inspect.signature(self.embedding_func.embed_documents).parameters:
+                embeddings = self.embedding_func.embed_documents(texts, as_array=True)
+            else:
+                embeddings = self.embedding_func.embed_documents(texts)
+            self.stats['embedded'] += len(texts)
+            yield texts, metadatas, embeddings
+
+    def _stage(self, items: Iterator, out_queue: queue.Queue, stop: threading.Event, errors: list):
+        '''Run a stage in its thread, putting items it generates to out_queue, then the end mark.'''
+        try:
+            for item in items:
+                if not self._put(out_queue, item, stop):
+                    return
+        except Exception as e:  # pylint: disable=W0718
+            logger.error('Failed to ingest data in %s:\n%s', threading.current_thread().name, e)
+            errors.append(e)
+            stop.set()
+            return
+        self._put(out_queue, _END, stop)
+
+    @staticmethod
+    def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+        '''Put item unless the pipeline is stopped, returning whether it was put.'''
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    @staticmethod
+    def _get(q: queue.Queue, stop: threading.Event) -> Any:
+        '''Get next item, or the end mark once the pipeline is stopped.'''
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _report(self, force: bool = False):
+        if self.progress is not None:
+            self.progress(dict(self.stats))
+            return
+        now = time.monotonic()
+        if force or now - self._last_report >= PROGRESS_INTERVAL:
+            self._last_report = now
+            logger.info('Ingested %s sources: %s chunks loaded, %s embedded, %s inserted, %s skipped in %.1fs.',
+                        self.stats['sources'], self.stats['loaded'], self.stats['embedded'], self.stats['inserted'],
+                        self.stats['skipped'], now - self.stats['start'])
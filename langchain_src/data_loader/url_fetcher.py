@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Iterator, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from langchain.docstore.document import Document
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from config import DATAPARSER_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+FETCH_CONFIG = DATAPARSER_CONFIG.get('url_fetch', {})
+
+
+def html_to_text(html: str) -> str:
+    '''Parse html to text the same way as LangChain UnstructuredURLLoader, run in worker processes.'''
+    from unstructured.partition.html import partition_html  # pylint: disable=C0415
+
+    elements = partition_html(text=html)
+    return '\n\n'.join([str(el) for el in elements])
+
+
+class URLCache:
+    '''Parsed text of fetched urls with their ETag and Last-Modified headers, saved under path across runs.'''
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index = {}
+        if os.path.exists(os.path.join(path, self.INDEX_FILE)):
+            with open(os.path.join(path, self.INDEX_FILE), encoding='utf-8') as f:
+                self._index = json.load(f)
+
+    def headers(self, url: str) -> dict:
+        '''Conditional request headers of a cached url.'''
+        with self._lock:
+            entry = self._index.get(url)
+        if entry is None:
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def get(self, url: str) -> Optional[str]:
+        with self._lock:
+            entry = self._index.get(url)
+        if entry is None or not os.path.exists(os.path.join(self.path, entry['file'])):
+            return None
+        with open(os.path.join(self.path, entry['file']), encoding='utf-8') as f:
+            return f.read()
+
+    def put(self, url: str, text: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        if not etag and not last_modified:
+            # The page can not be validated, fetch it again next time
+            return
+        file = hashlib.blake2b(url.encode('utf-8'), digest_size=16).hexdigest() + '.txt'
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, file), 'w', encoding='utf-8') as f:
+            f.write(text)
+        with self._lock:
+            self._index[url] = {'etag': etag, 'last_modified': last_modified, 'file': file}
+
+    def save(self):
+        with self._lock:
+            index = dict(self._index)
+        os.makedirs(self.path, exist_ok=True)
+        # Write to a temporary file and rename, so a crash never leaves a half-written index
+        with open(os.path.join(self.path, self.INDEX_FILE + '.tmp'), 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(os.path.join(self.path, self.INDEX_FILE + '.tmp'), os.path.join(self.path, self.INDEX_FILE))
+
+
+class URLFetcher:
+    '''Fetch urls concurrently and parse them to LangChain Documents, the same as UnstructuredURLLoader gives.
+
+    Pages are fetched by a pool of threads over one keep-alive connection pool, with at most max_per_host requests
+    to the same host at a time. Failed requests (connection errors, 429 & 5xx) are retried with exponential backoff.
+    Pages with ETag or Last-Modified are cached under cache_path, so a later run sends conditional requests and
+    reuses the parsed text of pages not modified. Html is parsed to text in a pool of parse_workers processes.
+    Parse workers are spawned, not forked: a fork of a process running threads (like the API server) may copy locks
+    held by them and deadlock. Spawned workers import the __main__ module of the caller, which must be guarded
+    by `if __name__ == '__main__'`.
+
+    Args:
+        max_workers (int): maximum number of concurrent requests.
+        max_per_host (int): maximum number of concurrent requests to a host.
+        retries (int): maximum number of retries of a request.
+        backoff (float): backoff factor in seconds, retries wait backoff * 2 ** (retry - 1).
+        timeout (float): timeout of a request in seconds.
+        cache_path (str): directory of the conditional request cache, no cache if empty.
+        parse_workers (int): number of processes parsing html, 0 to parse in fetching threads.
+    '''
+
+    def __init__(self,
+                 max_workers: int = FETCH_CONFIG.get('max_workers', 16),
+                 max_per_host: int = FETCH_CONFIG.get('max_per_host', 4),
+                 retries: int = FETCH_CONFIG.get('retries', 3),
+                 backoff: float = FETCH_CONFIG.get('backoff', 0.5),
+                 timeout: float = FETCH_CONFIG.get('timeout', 30),
+                 cache_path: str = FETCH_CONFIG.get('cache_path', 'url_cache'),
+                 parse_workers: int = FETCH_CONFIG.get('parse_workers', 0)
+                 ):
+        assert max_workers > 0 and max_per_host > 0, 'Numbers of concurrent requests must be positive.'
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.parse_workers = parse_workers
+        self.cache = URLCache(cache_path) if cache_path else None
+
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET'], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.stats = {'fetched': 0, 'not_modified': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        self._host_limits = {}
+        self._parse_pool = None
+
+    def iter_fetch(self, urls: List[str]) -> Iterator[List[Document]]:
+        '''Fetch urls, yielding Documents of each url in order (empty for a failed url).
+        At most 2 * max_workers pages are fetched ahead of the one yielded, so memory does not grow with urls.
+        '''
+        urls = iter(urls)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='url-fetcher') as executor:
+            futures = deque()
+            for url in urls:
+                futures.append((url, executor.submit(self._fetch, url)))
+                if len(futures) >= 2 * self.max_workers:
+                    break
+            while futures:
+                url, future = futures.popleft()
+                next_url = next(urls, None)
+                if next_url is not None:
+                    futures.append((next_url, executor.submit(self._fetch, next_url)))
+                try:
+                    text = future.result()
+                except Exception as e:  # pylint: disable=W0718
+                    # Skip failed pages like UnstructuredURLLoader with continue_on_failure
+                    logger.error('Failed to fetch %s, skipping it:\n%s', url, e)
+                    self._count('failed')
+                    yield []
+                    continue
+                yield [Document(page_content=text, metadata={'source': url})]
+        if self.cache:
+            self.cache.save()
+
+    def fetch(self, urls: List[str]) -> List[Document]:
+        '''Fetch urls, returning Documents of all fetched urls.'''
+        return [doc for docs in self.iter_fetch(urls) for doc in docs]
+
+    def close(self):
+        self.session.close()
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+            self._parse_pool = None
+
+    def _fetch(self, url: str) -> str:
+        headers = self.cache.headers(url) if self.cache else {}
+        with self._host_limit(urlparse(url).netloc):
+            res = self.session.get(url, headers=headers, timeout=self.timeout)
+        if res.status_code == 304:
+            text = self.cache.get(url) if self.cache else None
+            if text is not None:
+                self._count('not_modified')
+                return text
+            # Cached text is gone, fetch the page again
+            with self._host_limit(urlparse(url).netloc):
+                res = self.session.get(url, timeout=self.timeout)
+        res.raise_for_status()
+        text = self._parse(res.text)
+        if self.cache:
+            self.cache.put(url, text, etag=res.headers.get('ETag'), last_modified=res.headers.get('Last-Modified'))
+        self._count('fetched')
+        return text
+
+    def _parse(self, html: str) -> str:
+        if self.parse_workers <= 0:
+            return html_to_text(html)
+        with self._lock:
+            if self._parse_pool is None:
+                self._parse_pool = ProcessPoolExecutor(
+                    max_workers=self.parse_workers, mp_context=multiprocessing.get_context('spawn'))
+            pool = self._parse_pool
+        return pool.submit(html_to_text, html).result()
+
+    def _host_limit(self, host: str) -> threading.Semaphore:
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.Semaphore(self.max_per_host)
+            return self._host_limits[host]
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
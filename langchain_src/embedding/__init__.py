@@ -1 +1,15 @@
-from .langchain_huggingface import TextEncoder
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from config import TEXTENCODER_CONFIG
+
+ENCODER_BACKEND = TEXTENCODER_CONFIG.get('backend', 'torch')
+
+if ENCODER_BACKEND == 'torch':
+    from .langchain_huggingface import TextEncoder
+elif ENCODER_BACKEND == 'onnx':
+    from .onnx_encoder import TextEncoder
+else:
+    raise RuntimeError(f'LangChain mode has not supported the encoder backend yet: {ENCODER_BACKEND}.')
@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, List
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from config import TEXTENCODER_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+MICRO_BATCH = TEXTENCODER_CONFIG.get('micro_batch', False)
+MAX_BATCH_SIZE = TEXTENCODER_CONFIG.get('max_batch_size', 32)
+MAX_WAIT_MS = TEXTENCODER_CONFIG.get('max_wait_ms', 5)
+
+
+class EmbeddingBatcher:
+    '''Gather concurrent single-text embedding calls into one batch call of the model.
+
+    A worker thread takes the first waiting text, then waits up to max_wait_ms for more (or until max_batch_size),
+    embeds them with one call of embed_func and hands every caller its own row.
+
+    Args:
+        embed_func (Callable): function embedding a list of texts into a 2-d array, one row per text.
+        max_batch_size (int): maximum number of texts in a batch.
+        max_wait_ms (float): maximum time to wait for more texts after the first one.
+    '''
+
+    def __init__(self, embed_func: Callable[[List[str]], numpy.ndarray],
+                 max_batch_size: int = MAX_BATCH_SIZE, max_wait_ms: float = MAX_WAIT_MS):
+        assert max_batch_size > 0, 'Batch size must be positive.'
+        self.embed_func = embed_func
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._metrics = {'requests': 0, 'batches': 0, 'max_batch_size': 0, 'queue_sec': 0.0, 'max_queue_sec': 0.0}
+        self._worker = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._worker.start()
+
+    def embed(self, text: str) -> numpy.ndarray:
+        '''Embed one text, blocking until the batch it joined is done.'''
+        future = Future()
+        self._queue.put((text, future, time.monotonic()))
+        return future.result()
+
+    def close(self):
+        self._queue.put(None)
+        self._worker.join()
+
+    def stats(self) -> dict:
+        with self._lock:
+            batches = self._metrics['batches']
+            return {
+                'requests': self._metrics['requests'],
+                'batches': batches,
+                'avg_batch_size': self._metrics['requests'] / batches if batches else 0.0,
+                'max_batch_size': self._metrics['max_batch_size'],
+                'avg_queue_ms': self._metrics['queue_sec'] * 1000 / self._metrics['requests'] if batches else 0.0,
+                'max_queue_ms': self._metrics['max_queue_sec'] * 1000
+            }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._process(batch)
+                    return
+                batch.append(item)
+            self._process(batch)
+
+    def _process(self, batch: list):
+        start = time.monotonic()
+        delays = [start - enqueued for _, _, enqueued in batch]
+        with self._lock:
+            self._metrics['requests'] += len(batch)
+            self._metrics['batches'] += 1
+            self._metrics['max_batch_size'] = max(self._metrics['max_batch_size'], len(batch))
+            self._metrics['queue_sec'] += sum(delays)
+            self._metrics['max_queue_sec'] = max(self._metrics['max_queue_sec'], max(delays))
+        try:
+            embeds = self.embed_func([text for text, _, _ in batch])
+        except Exception as e:  # pylint: disable=W0718
+            logger.error('Failed to embed batch of %s texts:\n%s', len(batch), e)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for i, (_, future, _) in enumerate(batch):
+            future.set_result(embeds[i])
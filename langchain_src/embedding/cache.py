@@ -0,0 +1,125 @@
+import os
+import sys
+import atexit
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from config import TEXTENCODER_CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = TEXTENCODER_CONFIG.get('cache_size', 0)
+CACHE_PATH = TEXTENCODER_CONFIG.get('cache_path', None)
+
+
+class EmbeddingCache:
+    '''LRU cache of embeddings stored in a preallocated float32 arena.
+
+    Keys are digests of model name and normalized text, values are rows of one (max_size, dim) numpy array,
+    so memory stays bounded at max_size * dim * 4 bytes.
+
+    Args:
+        max_size (int): maximum number of embeddings kept.
+        path (str): optional .npz file to load the cache from and save it to at exit.
+    '''
+
+    def __init__(self, max_size: int = 10000, path: Optional[str] = None):
+        assert max_size > 0, 'Cache size must be positive.'
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._arena = None
+        self._slots = OrderedDict()  # key -> row in arena, in LRU order
+        self._lock = threading.Lock()
+
+        if self.path:
+            if os.path.exists(self.path):
+                self.load(self.path)
+            atexit.register(self._save_at_exit)
+
+    @staticmethod
+    def key(model: str, text: str, norm: bool = False) -> str:
+        text = ' '.join(unicodedata.normalize('NFC', text).split())
+        return hashlib.blake2b(f'{model}\0{int(norm)}\0{text}'.encode('utf-8'), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> Optional[numpy.ndarray]:
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                self.misses += 1
+                return None
+            self._slots.move_to_end(key)
+            self.hits += 1
+            return self._arena[slot].copy()
+
+    def put(self, key: str, embedding):
+        embedding = numpy.asarray(embedding, dtype=numpy.float32).reshape(-1)
+        with self._lock:
+            if self._arena is None:
+                self._arena = numpy.zeros((self.max_size, embedding.shape[0]), dtype=numpy.float32)
+            elif self._arena.shape[1] != embedding.shape[0]:
+                logger.warning('Skip caching embedding of dim %s in cache of dim %s.',
+                               embedding.shape[0], self._arena.shape[1])
+                return
+            if key in self._slots:
+                slot = self._slots[key]
+                self._slots.move_to_end(key)
+            elif len(self._slots) < self.max_size:
+                slot = len(self._slots)
+                self._slots[key] = slot
+            else:
+                # Reuse the row of the least recently used key
+                _, slot = self._slots.popitem(last=False)
+                self._slots[key] = slot
+            self._arena[slot] = embedding
+
+    def save(self, path: Optional[str] = None):
+        path = path or self.path
+        with self._lock:
+            if self._arena is None:
+                return
+            keys = numpy.array(list(self._slots.keys()), dtype='U32')
+            rows = numpy.array(list(self._slots.values()), dtype=numpy.int64)
+            vectors = self._arena[rows]
+        tmp_path = path + '.tmp.npz'
+        numpy.savez(tmp_path, keys=keys, vectors=vectors)
+        os.replace(tmp_path, path)
+
+    def _save_at_exit(self):
+        try:
+            self.save()
+        except OSError as e:
+            logger.warning('Failed to save embedding cache to %s:\n%s', self.path, e)
+
+    def load(self, path: str):
+        try:
+            data = numpy.load(path)
+            keys, vectors = data['keys'], data['vectors']
+        except Exception as e:  # pylint: disable=W0718
+            logger.warning('Failed to load embedding cache from %s:\n%s', path, e)
+            return
+        # Saved in LRU order, keep the most recent ones if the cache got smaller
+        for key, vector in zip(keys[-self.max_size:], vectors[-self.max_size:]):
+            self.put(str(key), vector)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._slots)}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._slots)
+
+
+# Process-wide cache shared by text encoders, keys include the model name
+EMBEDDING_CACHE = EmbeddingCache(max_size=CACHE_SIZE, path=CACHE_PATH) if CACHE_SIZE > 0 else None
@@ -1,14 +1,17 @@
 import sys
 import os
-from typing import List
+from typing import Any, List, Optional, Union
 import numpy
 
+from pydantic import Field
 from langchain.embeddings.base import Embeddings
 from langchain.embeddings import HuggingFaceEmbeddings
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
 from config import TEXTENCODER_CONFIG
+from .cache import EMBEDDING_CACHE
+from .batcher import EmbeddingBatcher, MICRO_BATCH
 
 MODEL = TEXTENCODER_CONFIG.get('model', 'multi-qa-mpnet-base-cos-v1')
 NORM = TEXTENCODER_CONFIG.get('norm', False)
@@ -17,21 +20,48 @@ NORM = TEXTENCODER_CONFIG.get('norm', False)
 class TextEncoder(HuggingFaceEmbeddings):
     '''Text encoder converts text input(s) into embedding(s)'''
 
+    embedding_cache: Optional[Any] = Field(default_factory=lambda: EMBEDDING_CACHE)
+    micro_batch: bool = MICRO_BATCH
+    embedding_batcher: Optional[Any] = None  #: :meta private:
+
     def __init__(self, *args, **kwargs):
         assert isinstance(
             self, Embeddings), 'Invalid text encoder. Only accept LangChain embeddings.'
         kwargs['model_name'] = kwargs.get('model_name', MODEL)
         super().__init__(*args, **kwargs)
+        if self.micro_batch:
+            self.embedding_batcher = EmbeddingBatcher(
+                lambda texts: self.embed_documents(texts, norm=False, as_array=True))
 
-    def embed_documents(self, texts: List[str], norm: bool = NORM) -> List[List[float]]:
-        embeds = super().embed_documents(texts)
+    def embed_documents(self, texts: List[str], norm: bool = NORM,
+                        as_array: bool = False) -> Union[List[List[float]], numpy.ndarray]:
+        '''Embed texts in one model call.
+        With as_array=True, return a contiguous float32 array of shape (len(texts), dim) instead of nested lists.
+        '''
+        texts = [x.replace('\n', ' ') for x in texts]
+        embeds = self.client.encode(texts, **self.encode_kwargs)
+        embeds = numpy.ascontiguousarray(embeds, dtype=numpy.float32)
         if norm:
-            embeds = [(x / numpy.linalg.norm(x)).tolist() for x in embeds]
-        return embeds
+            embeds /= numpy.linalg.norm(embeds, axis=1, keepdims=True)
+        if as_array:
+            return embeds
+        return embeds.tolist()
 
     def embed_query(self, text: str, norm: bool = NORM) -> List[float]:
-        embed = super().embed_query(text)
+        key = None
+        if self.embedding_cache is not None:
+            key = self.embedding_cache.key(self.model_name, text, norm)
+            cached = self.embedding_cache.get(key)
+            if cached is not None:
+                return cached.tolist()
+
+        if self.embedding_batcher is not None:
+            embed = self.embedding_batcher.embed(text)
+        else:
+            embed = numpy.asarray(super().embed_query(text), dtype=numpy.float32)
         if norm:
             embed /= numpy.linalg.norm(embed)
-            embed = embed.tolist()
-        return embed
+
+        if key is not None:
+            self.embedding_cache.put(key, embed)
+        return embed.tolist()
@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+from typing import Any, List, Optional, Union
+
+import numpy
+import onnxruntime
+from transformers import AutoTokenizer
+from pydantic import BaseModel, Field
+from langchain.embeddings.base import Embeddings
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from config import TEXTENCODER_CONFIG
+from .cache import EMBEDDING_CACHE
+from .batcher import EmbeddingBatcher, MICRO_BATCH
+
+MODEL = TEXTENCODER_CONFIG.get('model', 'multi-qa-mpnet-base-cos-v1')
+NORM = TEXTENCODER_CONFIG.get('norm', False)
+ONNX_PATH = TEXTENCODER_CONFIG.get('onnx_path', 'onnx_model')
+
+# Files written by offline_tools/export_onnx.py next to the tokenizer files
+MODEL_FILE = 'model.onnx'
+ENCODER_CONFIG_FILE = 'encoder_config.json'
+
+
+class TextEncoder(BaseModel, Embeddings):
+    '''Text encoder running an exported (int8 quantized) sentence-transformers model with ONNX Runtime on CPU.
+    Run offline_tools/export_onnx.py once to export the model configured in TEXTENCODER_CONFIG to onnx_path.
+    '''
+
+    model_name: str = MODEL
+    onnx_path: str = ONNX_PATH
+    batch_size: int = 32
+    embedding_cache: Optional[Any] = Field(default_factory=lambda: EMBEDDING_CACHE)
+    micro_batch: bool = MICRO_BATCH
+    embedding_batcher: Optional[Any] = None  #: :meta private:
+    session: Any = None  #: :meta private:
+    tokenizer: Any = None  #: :meta private:
+    encoder_config: dict = {}  #: :meta private:
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        model_path = os.path.join(self.onnx_path, MODEL_FILE)
+        assert os.path.exists(model_path), \
+            f'No onnx model at {model_path}, export it first with offline_tools/export_onnx.py.'
+        with open(os.path.join(self.onnx_path, ENCODER_CONFIG_FILE), encoding='utf-8') as f:
+            self.encoder_config = json.load(f)
+        if self.encoder_config.get('model') != self.model_name:
+            raise RuntimeError(f'Onnx model at {self.onnx_path} is exported from {self.encoder_config.get("model")}, '
+                               f'not {self.model_name}.')
+        self.session = onnxruntime.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        self.tokenizer = AutoTokenizer.from_pretrained(self.onnx_path)
+        if self.micro_batch:
+            self.embedding_batcher = EmbeddingBatcher(
+                lambda texts: self.embed_documents(texts, norm=False, as_array=True))
+
+    def embed_documents(self, texts: List[str], norm: bool = NORM,
+                        as_array: bool = False) -> Union[List[List[float]], numpy.ndarray]:
+        '''Embed texts in batches of batch_size.
+        With as_array=True, return a contiguous float32 array of shape (len(texts), dim) instead of nested lists.
+        '''
+        embeds = self.encode([x.replace('\n', ' ') for x in texts])
+        if norm:
+            embeds /= numpy.linalg.norm(embeds, axis=1, keepdims=True)
+        if as_array:
+            return embeds
+        return embeds.tolist()
+
+    def embed_query(self, text: str, norm: bool = NORM) -> List[float]:
+        # Quantized embeddings differ slightly from the torch ones, so they are cached under their own key
+        key = None
+        if self.embedding_cache is not None:
+            key = self.embedding_cache.key(f'{self.model_name}@onnx', text, norm)
+            cached = self.embedding_cache.get(key)
+            if cached is not None:
+                return cached.tolist()
+
+        if self.embedding_batcher is not None:
+            embed = self.embedding_batcher.embed(text)
+        else:
+            embed = self.embed_documents([text], norm=False, as_array=True)[0]
+        if norm:
+            embed /= numpy.linalg.norm(embed)
+
+        if key is not None:
+            self.embedding_cache.put(key, embed)
+        return embed.tolist()
+
+    def encode(self, texts: List[str]) -> numpy.ndarray:
+        '''Run the onnx model and pool token embeddings the same way as the sentence-transformers model.'''
+        outputs = numpy.zeros((len(texts), self.encoder_config['dim']), dtype=numpy.float32)
+        # Batch texts of similar lengths together to reduce padding
+        order = numpy.argsort([-len(x) for x in texts], kind='stable')
+        input_names = {x.name for x in self.session.get_inputs()}
+        for i in range(0, len(texts), self.batch_size):
+            batch = order[i:i + self.batch_size]
+            features = self.tokenizer(
+                [texts[j] for j in batch],
+                padding=True,
+                truncation=True,
+                max_length=self.encoder_config['max_length'],
+                return_tensors='np'
+            )
+            inputs = {k: v.astype(numpy.int64) for k, v in features.items() if k in input_names}
+            token_embeds = self.session.run(None, inputs)[0]
+            outputs[batch] = self._pool(token_embeds, features['attention_mask'])
+        if self.encoder_config.get('normalize', False):
+            outputs /= numpy.linalg.norm(outputs, axis=1, keepdims=True)
+        return outputs
+
+    def _pool(self, token_embeds: numpy.ndarray, attention_mask: numpy.ndarray) -> numpy.ndarray:
+        pooling = self.encoder_config.get('pooling', 'mean')
+        if pooling == 'cls':
+            return token_embeds[:, 0]
+        if pooling == 'mean':
+            mask = attention_mask[..., None].astype(numpy.float32)
+            return (token_embeds * mask).sum(axis=1) / numpy.clip(mask.sum(axis=1), 1e-9, None)
+        raise RuntimeError(f'Unsupported pooling mode: {pooling}')
@@ -1,13 +1,16 @@
-from typing import List
+from typing import Any, List, Optional, Union
 import sys
 import os
 
+from pydantic import Field
 from langchain.embeddings.base import Embeddings
 from langchain.embeddings import OpenAIEmbeddings
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
 from config import TEXTENCODER_CONFIG
+from .cache import EMBEDDING_CACHE
+from .batcher import EmbeddingBatcher, MICRO_BATCH
 
 
 MODEL = TEXTENCODER_CONFIG.get('model', 'text-embedding-ada-002')
@@ -16,23 +19,55 @@ NORM = TEXTENCODER_CONFIG.get('norm', False)
 
 class TextEncoder(OpenAIEmbeddings):
     '''Text encoder converts text input(s) into embedding(s)'''
+    embedding_cache: Optional[Any] = Field(default_factory=lambda: EMBEDDING_CACHE)
+    micro_batch: bool = MICRO_BATCH
+    embedding_batcher: Optional[Any] = None  #: :meta private:
+
     def __init__(self, *args, **kwargs):
         assert isinstance(
             self, Embeddings), 'Invalid text encoder. Only accept LangChain embeddings.'
         kwargs['model_name'] = kwargs.get('model_name', MODEL)
         super().__init__(*args, **kwargs)
+        if self.micro_batch:
+            # One request to the embedding service for concurrent queries
+            self.embedding_batcher = EmbeddingBatcher(
+                lambda texts: self.embed_documents(texts, norm=False, as_array=True))
 
-    def embed_documents(self, texts: List[str], norm: bool = NORM, chunk_size: int = 1000) -> List[List[float]]:
+    def embed_documents(self, texts: List[str], norm: bool = NORM, chunk_size: int = 1000,
+                        as_array: bool = False) -> Union[List[List[float]], 'numpy.ndarray']:
+        '''Embed texts in chunks of chunk_size per request.
+        With as_array=True, return a contiguous float32 array of shape (len(texts), dim) instead of nested lists.
+        '''
         embeds = super().embed_documents(texts, chunk_size=chunk_size)
+        if not norm and not as_array:
+            return embeds
+        import numpy  # pylint: disable=C0415
+
+        embeds = numpy.asarray(embeds, dtype=numpy.float32)
         if norm:
-            import numpy  # pylint: disable=C0415
-            embeds = [(x / numpy.linalg.norm(x)).tolist() for x in embeds]
-        return embeds
+            embeds /= numpy.linalg.norm(embeds, axis=1, keepdims=True)
+        if as_array:
+            return embeds
+        return embeds.tolist()
 
     def embed_query(self, text: str, norm: bool = NORM) -> List[float]:
-        embed = super().embed_query(text)
+        import numpy  # pylint: disable=C0415
+
+        # A cache hit saves a round-trip to the embedding service
+        key = None
+        if self.embedding_cache is not None:
+            key = self.embedding_cache.key(self.model, text, norm)
+            cached = self.embedding_cache.get(key)
+            if cached is not None:
+                return cached.tolist()
+
+        if self.embedding_batcher is not None:
+            embed = self.embedding_batcher.embed(text)
+        else:
+            embed = numpy.asarray(super().embed_query(text), dtype=numpy.float32)
         if norm:
-            import numpy  # pylint: disable=C0415
             embed /= numpy.linalg.norm(embed)
-            embed = embed.tolist()
-        return embed
+
+        if key is not None:
+            self.embedding_cache.put(key, embed)
+        return embed.tolist()
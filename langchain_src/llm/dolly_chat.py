@@ -1,5 +1,6 @@
 import sys
 import os
+import asyncio
 from typing import Mapping, Any, List
 
 import torch
@@ -30,9 +31,10 @@ class ChatLLM(BaseChatModel):
         resp = self.generate_text(prompt)
         return self._create_chat_result(resp)
 
-    def _agenerate(self, messages: List[BaseMessage]) -> ChatResult:
+    async def _agenerate(self, messages: List[BaseMessage]) -> ChatResult:
         prompt = self._create_prompt(messages)
-        resp = self.generate_text(prompt)
+        # Local model inference is CPU/GPU bound, keep it off the event loop
+        resp = await asyncio.to_thread(self.generate_text, prompt)
         return self._create_chat_result(resp)
 
     def _create_prompt(self, messages: List[BaseMessage]):
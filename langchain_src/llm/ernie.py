@@ -4,6 +4,7 @@ import json
 import os
 import sys
 
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 from langchain.chat_models.base import BaseChatModel
 from langchain.schema import BaseMessage, ChatResult, HumanMessage, AIMessage, SystemMessage, ChatMessage, ChatGeneration
 
@@ -22,8 +23,13 @@ class ChatLLM(BaseChatModel):
     temperature: float = llm_kwargs.get('temperature', 0)
     max_tokens: Optional[int] = llm_kwargs.get('max_tokens', None)
     n: int = llm_kwargs.get('n', 1)
+    streaming: bool = llm_kwargs.get('streaming', False)
 
-    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None) -> ChatResult:
+    def _generate(self,
+                  messages: List[BaseMessage],
+                  stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None
+                  ) -> ChatResult:
         message_dicts, params = self._create_message_dicts(messages, stop)
         params["messages"] = message_dicts
         payload = json.dumps(params)
@@ -32,25 +38,80 @@ class ChatLLM(BaseChatModel):
         }
 
         url = self._create_url()
+        if self.streaming:
+            response = requests.request(
+                "POST", url, headers=headers, data=payload, stream=True)
+            chunks = []
+            for line in response.iter_lines():
+                chunk = self._parse_stream_line(line)
+                if chunk is None:
+                    continue
+                chunks.append(chunk)
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk["result"])
+            return self._create_chat_result(self._merge_stream_chunks(chunks))
         response = requests.request(
             "POST", url, headers=headers, data=payload)
         return self._create_chat_result(response)
 
-    def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None) -> ChatResult:
+    async def _agenerate(self,
+                         messages: List[BaseMessage],
+                         stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None
+                         ) -> ChatResult:
+        import aiohttp  # pylint: disable=C0415
+
         message_dicts, params = self._create_message_dicts(messages, stop)
         params["messages"] = message_dicts
         payload = json.dumps(params)
         headers = {
             "Content-Type": "application/json"
         }
-        url = self._create_url()
-        response = requests.request(
-            "POST", url, headers=headers, data=payload)
-        return self._create_chat_result(response)
+        async with aiohttp.ClientSession() as session:
+            access_token = await self._aget_access_token(
+                session, api_key=self.api_key, secret_key=self.secret_key)
+            url = self._chat_url(access_token)
+            async with session.post(url, headers=headers, data=payload) as response:
+                if self.streaming:
+                    chunks = []
+                    async for line in response.content:
+                        chunk = self._parse_stream_line(line)
+                        if chunk is None:
+                            continue
+                        chunks.append(chunk)
+                        if run_manager:
+                            await run_manager.on_llm_new_token(chunk["result"])
+                    response_json = self._merge_stream_chunks(chunks)
+                else:
+                    response_json = await response.json(content_type=None)
+        return self._create_chat_result(response_json)
+
+    @staticmethod
+    def _parse_stream_line(line: bytes) -> Optional[dict]:
+        '''Parse one server-sent event line of a streaming response, "data: {...}".'''
+        line = line.decode("utf-8").strip() if isinstance(line, bytes) else line.strip()
+        if not line.startswith("data:"):
+            # A non-event line carries an error body
+            if line.startswith("{"):
+                raise RuntimeError(line)
+            return None
+        return json.loads(line[len("data:"):])
+
+    @staticmethod
+    def _merge_stream_chunks(chunks: List[dict]) -> dict:
+        if len(chunks) == 0:
+            return {}
+        merged = dict(chunks[-1])
+        merged["result"] = "".join(x.get("result", "") for x in chunks)
+        return merged
 
     def _create_url(self):
         access_token = self._get_access_token(
             api_key=self.api_key, secret_key=self.secret_key)
+        return self._chat_url(access_token)
+
+    @staticmethod
+    def _chat_url(access_token: str):
         url = 'https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/completions?access_token=' \
             + access_token
         return url
@@ -75,7 +136,8 @@ class ChatLLM(BaseChatModel):
 
     def _create_chat_result(self, response: Mapping[str, Any]) -> ChatResult:
         generations = []
-        response = response.json()
+        if not isinstance(response, Mapping):
+            response = response.json()
         if "result" not in response:
             raise RuntimeError(response)
         message = self._convert_dict_to_message({"role": "assistant", "content": response["result"]})
@@ -121,14 +183,33 @@ class ChatLLM(BaseChatModel):
         }
         return str(requests.post(url, params=params).json().get("access_token"))
 
+    @staticmethod
+    async def _aget_access_token(session, api_key, secret_key):
+        url = "https://aip.baidubce.com/oauth/2.0/token"
+        params = {
+            "grant_type": "client_credentials",
+            "client_id": api_key,
+            "client_secret": secret_key
+        }
+        async with session.post(url, params=params) as response:
+            response_json = await response.json(content_type=None)
+        return str(response_json.get("access_token"))
+
+    @property
+    def _llm_type(self) -> str:
+        return "ernie"
+
     @property
     def _default_params(self) -> Dict[str, Any]:
         """Get the default parameters for calling OpenAI API."""
-        return {
+        params = {
             "max_tokens": self.max_tokens,
             "n": self.n,
             "temperature": self.temperature,
         }
+        if self.streaming:
+            params["stream"] = True
+        return params
 
 
 # if __name__ == '__main__':
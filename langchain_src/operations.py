@@ -1,5 +1,6 @@
 import os
 import sys
+import asyncio
 import logging
 from typing import List
 
@@ -7,62 +8,317 @@ from langchain.agents import Tool, AgentExecutor
 
 sys.path.append(os.path.dirname(__file__))
 
-from data_loader import DataParser  # pylint: disable=C0413
-from store import MemoryStore, DocStore  # pylint: disable=C0413
+from data_loader import DataParser, IngestPipeline  # pylint: disable=C0413
+from store import MemoryStore, DocStore, pool_stats, close_async_clients  # pylint: disable=C0413
 from embedding import TextEncoder  # pylint: disable=C0413
 from llm import ChatLLM  # pylint: disable=C0413
-from agent import ChatAgent  # pylint: disable=C0413
+from agent import ChatAgent, FinalAnswerStreamHandler  # pylint: disable=C0413
+from rerank import Reranker  # pylint: disable=C0413
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from common import LRUCache, AnswerCache, RetrievalCache, SyncManifest, Deduplicator, project_generations, \
+    content_hash, scan_files  # pylint: disable=C0413
+from config import OBJECT_CACHE_CONFIG, ANSWERCACHE_CONFIG, RERANK_CONFIG, RETRIEVALCACHE_CONFIG, \
+    SYNC_CONFIG, DATAPARSER_CONFIG, MEMORYDB_CONFIG  # pylint: disable=C0413
 
 
 logger = logging.getLogger(__name__)
 
+DEDUP_CONFIG = DATAPARSER_CONFIG.get('dedup', {})
+HISTORY_WINDOW = MEMORYDB_CONFIG.get('history_window', 0)
+
 encoder = TextEncoder()
 chat_llm = ChatLLM()
+# Same LLM with token callbacks enabled, used by chat_stream
+stream_llm = chat_llm.copy(update={'streaming': True}) if 'streaming' in chat_llm.__fields__ else chat_llm
 load_data = DataParser()
+# Shared by DocStores of all projects, so the cross-encoder is loaded once
+reranker = Reranker() if RERANK_CONFIG.get('rerank', False) else None
+
+# Per-process caches of store objects and agents, so a request does not rebuild them
+doc_stores = LRUCache(max_size=OBJECT_CACHE_CONFIG.get('max_projects', 64))
+agent_chains = LRUCache(max_size=OBJECT_CACHE_CONFIG.get('max_projects', 64))
+memory_stores = LRUCache(max_size=OBJECT_CACHE_CONFIG.get('max_sessions', 1024),
+                         on_evict=lambda memory_db: memory_db.close())
+
+if ANSWERCACHE_CONFIG.get('enable', False):
+    answer_cache = AnswerCache(
+        threshold=ANSWERCACHE_CONFIG.get('threshold', 0.95),
+        ttl=ANSWERCACHE_CONFIG.get('ttl', 3600),
+        max_size=ANSWERCACHE_CONFIG.get('max_size', 1000)
+    )
+else:
+    answer_cache = None
+
+if DEDUP_CONFIG.get('enable', False):
+    deduplicator = Deduplicator(near_dup=DEDUP_CONFIG.get('near_dup', False),
+                                max_distance=DEDUP_CONFIG.get('max_distance', 3))
+else:
+    deduplicator = None
+
+if RETRIEVALCACHE_CONFIG.get('enable', False):
+    retrieval_cache = RetrievalCache(max_size=RETRIEVALCACHE_CONFIG.get('max_size', 10000),
+                                     ttl=RETRIEVALCACHE_CONFIG.get('ttl', 300))
+else:
+    retrieval_cache = None
 
 
 def chat(session_id, project, question):
     '''Chat API'''
-    doc_db = DocStore(
-        table_name=project,
-        embedding_func=encoder,
+    async def _chat():
+        try:
+            return await chat_async(session_id=session_id, project=project, question=question)
+        finally:
+            # Each asyncio.run has a new event loop, clients bound to this one are closed with it
+            await close_async_clients()
+
+    return asyncio.run(_chat())
+
+
+async def chat_async(session_id, project, question):
+    '''Async chat API: history, search and LLM calls all run without holding a worker thread.'''
+    memory_db = get_memory_store(project, session_id)
+    agent_chain = get_agent_chain(project, chat_llm)
+    try:
+        chat_history = await memory_db.aget_messages(limit=HISTORY_WINDOW)
+        cache_key, final_answer = await _lookup_answer(project, question, chat_history)
+        if final_answer is None:
+            final_answer = await agent_chain.arun(input=question, chat_history=chat_history)
+            _cache_answer(project, cache_key, final_answer)
+        await memory_db.aadd_history([{'question': question, 'answer': final_answer}])
+        return final_answer
+    except Exception:
+        return 'Something went wrong. Please clear history and try again!'
+
+
+async def chat_stream(session_id, project, question):
+    '''Streaming chat API, yielding pieces of the final answer as the LLM generates them.
+    The turn is saved to memory only after the whole answer has been streamed.
+    '''
+    memory_db = get_memory_store(project, session_id)
+    agent_chain = get_agent_chain(project, stream_llm)
+    handler = FinalAnswerStreamHandler()
+
+    chat_history = await memory_db.aget_messages(limit=HISTORY_WINDOW)
+    cache_key, final_answer = await _lookup_answer(project, question, chat_history)
+    if final_answer is not None:
+        yield final_answer
+        await memory_db.aadd_history([{'question': question, 'answer': final_answer}])
+        return
+
+    task = asyncio.create_task(
+        agent_chain.arun(input=question, chat_history=chat_history, callbacks=[handler]))
+    try:
+        while not task.done() or not handler.queue.empty():
+            token = asyncio.create_task(handler.queue.get())
+            done, _ = await asyncio.wait({token, task}, return_when=asyncio.FIRST_COMPLETED)
+            if token in done:
+                yield token.result()
+            else:
+                token.cancel()
+        final_answer = task.result()
+    finally:
+        # Stop generating if the client went away before the end of the stream
+        if not task.done():
+            task.cancel()
+    if not handler.streamed:
+        # The LLM did not stream or answered without the json format
+        yield final_answer
+    _cache_answer(project, cache_key, final_answer)
+    await memory_db.aadd_history([{'question': question, 'answer': final_answer}])
+
+
+async def _lookup_answer(project, question, chat_history):
+    '''Look up answer cache for the first question of a session, later ones depend on the conversation.
+    Returns the key to cache a new answer (None if not cacheable) and the cached answer (None on miss).
+    '''
+    if answer_cache is None or len(chat_history) > 0:
+        return None, None
+    epoch = answer_cache.epoch(project)
+    embedding = await asyncio.to_thread(encoder.embed_query, question)
+    return (embedding, epoch), answer_cache.lookup(project, embedding)
+
+
+def _cache_answer(project, cache_key, answer):
+    if cache_key is not None:
+        embedding, epoch = cache_key
+        answer_cache.add(project, embedding, answer, epoch=epoch)
+
+
+def cache_stats():
+    '''Hit/miss counters of answer cache, with those of retrieval cache under 'retrieval'.'''
+    stats = {'enable': False} if answer_cache is None else {'enable': True, **answer_cache.stats()}
+    stats['retrieval'] = {'enable': False} if retrieval_cache is None else {'enable': True, **retrieval_cache.stats()}
+    return stats
+
+
+def encoder_stats():
+    '''Query embedding cache and micro-batching metrics of text encoder.'''
+    embedding_cache = getattr(encoder, 'embedding_cache', None)
+    embedding_batcher = getattr(encoder, 'embedding_batcher', None)
+    return {
+        'cache': embedding_cache.stats() if embedding_cache else {'enable': False},
+        'batcher': embedding_batcher.stats() if embedding_batcher else {'enable': False}
+    }
+
+
+def memory_stats():
+    '''Size and wait metrics of the connection pool shared by memory stores.'''
+    return {'pool': pool_stats()}
+
+
+def get_doc_store(project: str) -> DocStore:
+    '''Get the cached DocStore of project.'''
+    doc_db = doc_stores.get(project)
+    # A store created before its collection existed is rebuilt until the collection shows up
+    if doc_db is None or doc_db.vector_db.col is None:
+        doc_db = DocStore(table_name=project, embedding_func=encoder, reranker=reranker,
+                          retrieval_cache=retrieval_cache)
+        doc_stores.put(project, doc_db)
+    return doc_db
+
+
+def get_memory_store(project: str, session_id: str) -> MemoryStore:
+    '''Get the cached MemoryStore of a session in project.'''
+    return memory_stores.get_or_create(
+        (project, session_id),
+        lambda: MemoryStore(table_name=project, session_id=session_id)
         )
-    memory_db = MemoryStore(table_name=project, session_id=session_id)
 
+
+def get_agent_chain(project: str, llm: ChatLLM) -> AgentExecutor:
+    '''Get the cached agent of project for the given LLM, rebuilt when its DocStore changes.'''
+    doc_db = get_doc_store(project)
+    key = (project, id(llm))
+    cached = agent_chains.get(key)
+    if cached is None or cached[0] is not doc_db:
+        cached = (doc_db, _create_agent_chain(doc_db, llm))
+        agent_chains.put(key, cached)
+    return cached[1]
+
+
+def project_changed(project: str):
+    '''Bump project generation and drop cached answers & search results of project, called when its data changes.'''
+    project_generations.bump(project)
+    if retrieval_cache:
+        retrieval_cache.invalidate(project)
+    if answer_cache:
+        answer_cache.invalidate(project)
+
+
+def invalidate_project(project: str):
+    '''Drop cached objects of project.'''
+    doc_stores.pop(project)
+    agent_chains.invalidate(lambda key: key[0] == project)
+    memory_stores.invalidate(lambda key: key[0] == project)
+
+
+def _create_agent_chain(doc_db: DocStore, llm: ChatLLM):
     tools = [
         Tool(
             name='Search',
             func=doc_db.search,
+            coroutine=doc_db.asearch,
             description='Search through Milvus.'
         )
     ]
-    agent = ChatAgent.from_llm_and_tools(llm=chat_llm, tools=tools)
+    agent = ChatAgent.from_llm_and_tools(llm=llm, tools=tools)
     agent_chain = AgentExecutor.from_agent_and_tools(
         agent=agent,
         tools=tools,
-        memory=memory_db.memory,
         verbose=False
     )
-    try:
-        final_answer = agent_chain.run(input=question)
-        return final_answer
-    except Exception:
-        return 'Something went wrong. Please clear history and try again!'
+    return agent_chain
 
 
 def insert(data_src, project, source_type: str = 'file'):
     '''Load project docs will load docs from data source and then insert doc embeddings into the project table in the vector store.
     If there is no project table, it will create one.
     '''
-    doc_db = DocStore(table_name=project,
-                      embedding_func=encoder)
-    docs = load_data(data_src=data_src, source_type=source_type)
-    num = doc_db.insert(docs)
+    doc_db = get_doc_store(project)
+    # Sources are streamed through load, embed and write stages instead of loading all of them first
+    pipeline = IngestPipeline(load_data, doc_db, encoder, deduplicator=deduplicator)
+    try:
+        res = pipeline.run(data_src, source_type=source_type)
+    finally:
+        project_changed(project)
+    return res
+
+
+def _insert_chunks(doc_db, project, data, metadatas):
+    '''Insert doc chunks, skipping duplicates before embedding them if dedup is enabled.'''
+    skipped = 0
+    if deduplicator:
+        data, metadatas, skipped = doc_db.dedup(data, metadatas, deduplicator)
+    num = doc_db.insert(data=data, metadatas=metadatas) if data else 0
+    project_changed(project)
+    return {'inserted': num, 'skipped': skipped}
+
+
+def upsert_source(project, source, source_type: str = 'file'):
+    '''Update chunks of one source (file path or url) in the project: only chunks changed since the last load are
+    deleted or embedded and inserted, chunks of other sources are untouched.
+    '''
+    doc_db = get_doc_store(project)
+    docs = load_data.load_documents(data_src=source, source_type=source_type)
+    try:
+        res = doc_db.upsert_source(source, docs)
+    finally:
+        project_changed(project)
+    return res
+
+
+def sync(project, data_dir, patterns: List[str] = None):
+    '''Sync files under data_dir to the project, working on the diff since the last sync only.
+    A manifest of the project records content hashes of synced files and their chunks: unchanged files are skipped,
+    only new or changed chunks of changed files are embedded and chunks of changed or removed files are deleted.
+    '''
+    manifest = SyncManifest(project, path=SYNC_CONFIG.get('manifest_path', 'sync_manifest'))
+    files = scan_files(data_dir, patterns or SYNC_CONFIG.get('patterns', ['*.md']))
+    changed, removed = manifest.diff(files)
+    doc_db = get_doc_store(project)
+    res = {'inserted': 0, 'deleted': 0, 'unchanged': 0,
+           'files_changed': len(changed), 'files_removed': len(removed), 'files_unchanged': len(files) - len(changed)}
+    try:
+        for path, content in changed.items():
+            docs = load_data.load_documents(data_src=path, source_type='file')
+            counts = doc_db.upsert_source(path, docs, stored=manifest.chunks(path))
+            for k, v in counts.items():
+                res[k] += v
+            manifest.update(path, content, [doc.metadata['content_hash'] for doc in docs])
+        for path in removed:
+            res['deleted'] += doc_db.delete_source(path)
+            manifest.remove(path)
+    finally:
+        # Keep progress of synced files if a later one failed
+        manifest.save()
+        if changed or removed:
+            project_changed(project)
+    return res
+
+
+def delete_source(project, source):
+    '''Delete chunks of one source (file path or url) from the project.'''
+    doc_db = get_doc_store(project)
+    try:
+        num = doc_db.delete_source(source)
+    finally:
+        project_changed(project)
     return num
 
 
+def count(project):
+    '''Number of doc chunks in the project vector store.'''
+    assert DocStore.has_project(project), f'No project store: {project}'
+    return len(get_doc_store(project).vector_db)
+
+
 def drop(project):
     '''Drop project will clean both vector and memory stores.'''
+    invalidate_project(project)
+    project_changed(project)
+    SyncManifest.drop(project, path=SYNC_CONFIG.get('manifest_path', 'sync_manifest'))
     # Clear vector db
     try:
         DocStore.drop(project)
@@ -97,7 +353,7 @@ def check(project):
 def get_history(project, session_id):
     '''Get conversation history from memory store.'''
     try:
-        memory_db = MemoryStore(table_name=project, session_id=session_id)
+        memory_db = get_memory_store(project, session_id)
         messages = memory_db.get_history()
         return messages
     except Exception as e:
@@ -116,10 +372,10 @@ def clear_history(project, session_id):
 
 def load(document_strs: List[str], project: str):
     '''Load doc embeddings to project table in vector store given a list of doc chunks.'''
-    doc_db = DocStore(table_name=project,
-                      embedding_func=encoder)
-    num = doc_db.insert(document_strs)
-    return num
+    doc_db = get_doc_store(project)
+    # Chunks loaded without a source get an empty source id
+    return _insert_chunks(doc_db, project, list(document_strs),
+                          [{'source': '', 'content_hash': content_hash(x)} for x in document_strs])
 
 
 # if __name__ == '__main__':
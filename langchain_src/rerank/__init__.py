@@ -0,0 +1 @@
+from .cross_encoder import Reranker
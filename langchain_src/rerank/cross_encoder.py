@@ -0,0 +1,76 @@
+import os
+import sys
+import hashlib
+from typing import List
+
+from langchain.docstore.document import Document
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from config import RERANK_CONFIG
+from common import LRUCache
+
+
+MODEL = RERANK_CONFIG.get('rerank_model', 'cross-encoder/ms-marco-MiniLM-L-12-v2')
+THRESHOLD = RERANK_CONFIG.get('threshold', 0.6)
+TOP_N = RERANK_CONFIG.get('top_n', None)
+BATCH_SIZE = RERANK_CONFIG.get('batch_size', 32)
+CACHE_SIZE = RERANK_CONFIG.get('cache_size', 10000)
+
+
+def _hash(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class Reranker:
+    '''Rerank searched docs by cross-encoder relevance of (query, doc) pairs,
+    dropping docs scored below threshold and keeping the top_n best ones.
+
+    Args:
+        model_name (str): sentence-transformers cross-encoder model.
+        threshold (float): minimum relevance score in [0, 1] of a doc to keep.
+        top_n (int): maximum number of docs to keep, no limit if None.
+        batch_size (int): number of pairs scored per model forward pass.
+        cache_size (int): number of scores cached by (query hash, doc hash), 0 to disable.
+    '''
+
+    def __init__(self,
+                 model_name: str = MODEL,
+                 threshold: float = THRESHOLD,
+                 top_n: int = TOP_N,
+                 batch_size: int = BATCH_SIZE,
+                 cache_size: int = CACHE_SIZE
+                 ):
+        from sentence_transformers import CrossEncoder  # pylint: disable=C0415
+
+        self.model = CrossEncoder(model_name)
+        self.threshold = threshold
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.score_cache = LRUCache(max_size=cache_size) if cache_size > 0 else None
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        '''Relevance scores of texts to query, only pairs missing from cache go through the model in one batched call.'''
+        query_hash = _hash(query)
+        keys = [(query_hash, _hash(x)) for x in texts]
+        scores = [None] * len(texts)
+        if self.score_cache is not None:
+            scores = [self.score_cache.get(k) for k in keys]
+        missing = [i for i, s in enumerate(scores) if s is None]
+        if missing:
+            # Single-label cross-encoders apply a sigmoid, so scores are in [0, 1]
+            new_scores = self.model.predict(
+                [(query, texts[i]) for i in missing], batch_size=self.batch_size, show_progress_bar=False)
+            for i, s in zip(missing, new_scores):
+                scores[i] = float(s)
+                if self.score_cache is not None:
+                    self.score_cache.put(keys[i], scores[i])
+        return scores
+
+    def rerank(self, query: str, docs: List[Document]) -> List[Document]:
+        if len(docs) == 0:
+            return docs
+        scores = self.score(query, [doc.page_content for doc in docs])
+        ranked = sorted(zip(scores, range(len(docs))), key=lambda x: x[0], reverse=True)
+        res = [docs[i] for s, i in ranked if s >= self.threshold]
+        return res[:self.top_n] if self.top_n else res
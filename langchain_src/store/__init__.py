@@ -1,16 +1,54 @@
 import os
 import sys
-from typing import Optional, List
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Optional, List, Union, Dict, Tuple
+
+import numpy
+from langchain.docstore.document import Document
 
 from .vector_store.milvus import VectorStore, Embeddings
-from .memory_store.pg import MemoryStore
+from .vector_store.local import LocalVectorStore, LOCAL_THRESHOLD
+from .memory_store.pg import MemoryStore, pool_stats, close_async_pools
+from .fusion import reciprocal_rank_fusion, content_hash
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
-from config import USE_SCALAR
+from config import USE_SCALAR, HYBRID_SEARCH_CONFIG, VECTORDB_CONFIG
 
 if USE_SCALAR:
-    from .scalar_store.es import ScalarStore
+    from .scalar_store.es import ScalarStore, close_async_client
+
+
+logger = logging.getLogger('doc_store')
+
+SEARCH_TIMEOUT = HYBRID_SEARCH_CONFIG.get('timeout', {})
+FUSION_WEIGHTS = HYBRID_SEARCH_CONFIG.get('weights', {})
+RRF_K = HYBRID_SEARCH_CONFIG.get('rrf_k', 60)
+TOP_K = VECTORDB_CONFIG.get('top_k', 3)
+THRESHOLD = VECTORDB_CONFIG.get('threshold', None)
+
+# Shared by all DocStores, a store stuck past its timeout keeps a worker until it returns
+search_executor = ThreadPoolExecutor(max_workers=HYBRID_SEARCH_CONFIG.get('max_workers', 16),
+                                     thread_name_prefix='docstore-search')
+# Scalar store writes run next to vector store writes of the same insert
+write_executor = ThreadPoolExecutor(max_workers=HYBRID_SEARCH_CONFIG.get('max_workers', 16),
+                                    thread_name_prefix='docstore-write')
+# Numbers of chunks written to each store by the bulk_load of the calling thread, None outside of one.
+# Kept per call, as loads of the same cached DocStore may overlap.
+_BULK_COUNTS = contextvars.ContextVar('bulk_counts', default=None)
+
+
+async def close_async_clients():
+    '''Close async clients & connection pools of the running event loop, before asyncio.run closes the loop.'''
+    await close_async_pools()
+    if USE_SCALAR:
+        await close_async_client()
 
 
 class DocStore:
@@ -20,49 +58,166 @@ class DocStore:
             self,
             table_name: str,
             embedding_func: Embeddings = None,
-            use_scalar: bool = USE_SCALAR
+            use_scalar: bool = USE_SCALAR,
+            reranker: Any = None,
+            retrieval_cache: Any = None
     ) -> None:
         self.table_name = table_name
         self.use_scalar = use_scalar
         self.embedding_func = embedding_func
+        self.reranker = reranker
+        self.retrieval_cache = retrieval_cache
 
-        self.vector_db = VectorStore(
-            table_name=table_name, embedding_func=self.embedding_func)
+        # Small projects are served by an in-process vector store until they outgrow LOCAL_THRESHOLD
+        if LOCAL_THRESHOLD > 0 and (LocalVectorStore.has_project(table_name) or not VectorStore.has_project(table_name)):
+            self.vector_db = LocalVectorStore(
+                table_name=table_name, embedding_func=self.embedding_func)
+        else:
+            self.vector_db = VectorStore(
+                table_name=table_name, embedding_func=self.embedding_func)
 
         if self.use_scalar:
             self.scalar_db = ScalarStore(index_name=table_name)
         else:
             self.scalar_db = None
 
-    def search(self, query: str):
+        # Number of searches timed out by store name
+        self.search_timeouts = {}
+        self._timeout_lock = threading.Lock()
+
+    @property
+    def vector_db(self) -> Union[VectorStore, LocalVectorStore]:
+        '''Vector store of the project, switched to Milvus once the local project was migrated by any process.'''
+        if isinstance(self._vector_db, LocalVectorStore) and self._vector_db.migrated:
+            self._vector_db = VectorStore(table_name=self.table_name, embedding_func=self.embedding_func)
+        return self._vector_db
+
+    @vector_db.setter
+    def vector_db(self, vector_db: Union[VectorStore, LocalVectorStore]):
+        self._vector_db = vector_db
+
+    def search(self, query: str) -> List[Document]:
+        '''Search vector store and scalar store concurrently, merging results by reciprocal rank fusion.
+        With a reranker, merged docs are reranked and cut to the most relevant ones.
+        '''
+        embedding, cache_key = self._cache_key(query)
+        if cache_key is not None:
+            docs = self.retrieval_cache.get(cache_key)
+            if docs is not None:
+                return docs
+
+        start = time.monotonic()
+        futures = {name: search_executor.submit(store.search, query, **self._search_kwargs(name, embedding))
+                   for name, store in self._stores().items()}
+        results = {}
+        for name, future in futures.items():
+            timeout = SEARCH_TIMEOUT.get(name)
+            try:
+                results[name] = future.result(
+                    timeout=None if timeout is None else max(0, start + timeout - time.monotonic()))
+            except FutureTimeoutError:
+                self._record_timeout(name, timeout)
+        docs = reciprocal_rank_fusion(results, weights=FUSION_WEIGHTS, k=RRF_K)
+        if self.reranker:
+            docs = self.reranker.rerank(query, docs)
+        # Partial results of a timed out search are not cached
+        if cache_key is not None and len(results) == len(futures):
+            self.retrieval_cache.put(cache_key, docs)
+        return docs
+
+    async def asearch(self, query: str) -> List[Document]:
+        '''Async search, querying vector store and scalar store concurrently.'''
+        embedding, cache_key = await asyncio.to_thread(self._cache_key, query)
+        if cache_key is not None:
+            docs = self.retrieval_cache.get(cache_key)
+            if docs is not None:
+                return docs
+
+        async def _search(name, store):
+            timeout = SEARCH_TIMEOUT.get(name)
+            try:
+                return name, await asyncio.wait_for(
+                    store.asearch(query, **self._search_kwargs(name, embedding)), timeout=timeout)
+            except asyncio.TimeoutError:
+                self._record_timeout(name, timeout)
+                return name, None
+
+        stores = self._stores()
+        results = await asyncio.gather(*[_search(name, store) for name, store in stores.items()])
+        results = {name: docs for name, docs in results if docs is not None}
+        docs = reciprocal_rank_fusion(results, weights=FUSION_WEIGHTS, k=RRF_K)
+        if self.reranker:
+            # Cross-encoder inference is CPU/GPU bound, keep it off the event loop
+            docs = await asyncio.to_thread(self.reranker.rerank, query, docs)
+        if cache_key is not None and len(results) == len(stores):
+            self.retrieval_cache.put(cache_key, docs)
+        return docs
+
+    def search_batch(self, queries: List[str], batch_size: int = 256) -> List[List[Document]]:
+        '''Search many queries, e.g. for offline evaluation.
+        Each batch of queries is embedded in one encoder call and sent in one request to each store,
+        stores are queried concurrently and results of each query are merged like search.
+        '''
         res = []
-        pages = []
-        for doc in self.vector_db.search(query):
-            if doc.page_content not in pages:
-                res.append(doc)
-                pages.append(doc.page_content)
-        if self.scalar_db:
-            for doc in self.scalar_db.search(query):
-                if doc.page_content not in pages:
-                    res.append(doc)
-                    pages.append(doc.page_content)
+        for i in range(0, len(queries), batch_size):
+            batch = list(queries[i:i + batch_size])
+            futures = {name: search_executor.submit(store.search_batch, batch)
+                       for name, store in self._stores().items()}
+            results = {name: future.result() for name, future in futures.items()}
+            for j, query in enumerate(batch):
+                docs = reciprocal_rank_fusion({name: x[j] for name, x in results.items()}, weights=FUSION_WEIGHTS, k=RRF_K)
+                if self.reranker:
+                    docs = self.reranker.rerank(query, docs)
+                res.append(docs)
         return res
 
+    def _cache_key(self, query: str) -> tuple:
+        '''(query embedding, retrieval cache key) of query, (None, None) without cache.
+        The embedding is passed on to the vector store search, so the query is encoded once.
+        '''
+        if self.retrieval_cache is None:
+            return None, None
+        embedding = self.embedding_func.embed_query(query)
+        return embedding, self.retrieval_cache.key(self.table_name, embedding, TOP_K, THRESHOLD)
+
+    @staticmethod
+    def _search_kwargs(name: str, embedding: Optional[List[float]]) -> dict:
+        # Only the vector store searches by the query embedding
+        return {'embedding': embedding} if name == 'vector' and embedding is not None else {}
+
+    def _migrate_if_full(self, num: int):
+        '''Move a local project to Milvus before an insert of num chunks would grow it over LOCAL_THRESHOLD.'''
+        local_db = self.vector_db
+        if not isinstance(local_db, LocalVectorStore) or len(local_db) + num <= LOCAL_THRESHOLD:
+            return
+        vector_db = VectorStore(table_name=self.table_name, embedding_func=self.embedding_func)
+        # Other processes serving the local project switch to Milvus once they see it marked as migrated
+        num = local_db.migrate(lambda embeddings, metadatas: vector_db.insert_embeddings(
+            data=embeddings, metadatas=metadatas))
+        logger.info('Migrated project %s with %s chunks from local vector store to Milvus.', self.table_name, num)
+        self.vector_db = vector_db
+
+    def _stores(self) -> Dict[str, Union[VectorStore, LocalVectorStore, 'ScalarStore']]:
+        stores = {'vector': self.vector_db}
+        if self.scalar_db:
+            stores['scalar'] = self.scalar_db
+        return stores
+
+    def _record_timeout(self, name: str, timeout: float):
+        with self._timeout_lock:
+            self.search_timeouts[name] = self.search_timeouts.get(name, 0) + 1
+        logger.warning('Search in %s store of %s timed out after %ss, returning partial results.',
+                       name, self.table_name, timeout)
+
     def insert(self, data: List[str], metadatas: Optional[List[dict]] = None):
-        vec_count = None
-        scalar_count = None
-        vec_count = self.vector_db.insert(data=data, metadatas=metadatas)
+        data = list(data)
+        self._migrate_if_full(len(data))
+        docs = data
         if metadatas and 'doc' in metadatas[0]:
-            data = [doc['doc'] for doc in metadatas]
-        if self.scalar_db:
-            scalar_count = self.scalar_db.insert(data=data)
-        if vec_count and scalar_count:
-            assert vec_count == scalar_count, f'Data count does not match: {vec_count} in vector db VS {scalar_count} in scalar db.'
-        return vec_count
+            docs = [doc['doc'] for doc in metadatas]
+        return self._write(lambda: self.vector_db.insert(data=data, metadatas=metadatas), docs, metadatas)
 
-    def insert_embeddings(self, data: List[float], metadatas: List[dict]):
-        vec_count = None
-        scalar_count = None
+    def insert_embeddings(self, data: Union[List[List[float]], numpy.ndarray], metadatas: List[dict]):
         docs = []
         for d in metadatas:
             assert 'text' in d, 'Embedding insert must have corresponding text in metadatas.'
@@ -70,20 +225,110 @@ class DocStore:
                 docs.append(d['doc'])
             else:
                 docs.append(d['text'])
-        vec_count = self.vector_db.insert_embeddings(
-            data=data, metadatas=metadatas)
+        self._migrate_if_full(len(metadatas))
+        return self._write(lambda: self.vector_db.insert_embeddings(data=data, metadatas=metadatas), docs, metadatas)
+
+    @contextmanager
+    def bulk_load(self):
+        '''Context to insert many batches: refresh of the scalar index is disabled until the end,
+        and numbers of chunks written to vector store and scalar store are checked once at the end.
+        '''
+        counts = {'vector': 0, 'scalar': 0}
+        token = _BULK_COUNTS.set(counts)
+        try:
+            with self.scalar_db.bulk_load() if self.scalar_db else nullcontext():
+                yield self
+        finally:
+            _BULK_COUNTS.reset(token)
         if self.scalar_db:
-            scalar_count = self.scalar_db.insert(data=docs)
-        if vec_count and scalar_count:
+            assert counts['vector'] == counts['scalar'], \
+                f'Data count does not match: {counts["vector"]} in vector db VS {counts["scalar"]} in scalar db.'
+
+    def _write(self, vector_write: Callable[[], int], docs: List[str], metadatas: Optional[List[dict]]):
+        '''Write docs to scalar store in a worker thread while vector_write runs, then check the counts.'''
+        bulk_counts = _BULK_COUNTS.get()
+        scalar_future = None
+        if self.scalar_db:
+            # Vector store pops texts from metadatas, the scalar store gets its own copies
+            scalar_future = write_executor.submit(
+                self.scalar_db.insert, data=docs, metadatas=None if metadatas is None else [dict(m) for m in metadatas],
+                refresh=bulk_counts is None)
+        try:
+            vec_count = vector_write()
+        finally:
+            scalar_count = scalar_future.result() if scalar_future else None
+        if bulk_counts is not None:
+            bulk_counts['vector'] += vec_count or 0
+            bulk_counts['scalar'] += scalar_count or 0
+        elif vec_count and scalar_count:
             assert vec_count == scalar_count, f'Data count does not match: {vec_count} in vector db VS {scalar_count} in scalar db.'
         return vec_count
 
+    def dedup(self, data: List[str], metadatas: List[dict], deduplicator: Any,
+              seen: Optional[set] = None) -> Tuple[List[str], List[dict], int]:
+        '''Drop duplicate chunks of data and chunks already stored before they are embedded.
+        Returns kept chunks with their metadatas and the number of skipped chunks.
+        Chunks are deduplicated within their source only: a chunk shared by two sources is stored for both,
+        so deleting one source does not remove content the other still has.
+        With seen, (source, content hash) of earlier batches of the same load, kept chunks are added to it.
+        '''
+        hashes = [m.get('content_hash') or content_hash(t) for t, m in zip(data, metadatas)]
+        sources = [m.get('source') for m in metadatas]
+        keep = []
+        for source in dict.fromkeys(sources):
+            indices = [i for i, x in enumerate(sources) if x == source]
+            source_hashes = [hashes[i] for i in indices]
+            stored = set(self.vector_db.existing_hashes(source_hashes, source=source))
+            if seen is not None:
+                stored.update(x for x in source_hashes if (source, x) in seen)
+            kept = [indices[i] for i in deduplicator.filter(
+                [data[i] for i in indices], hashes=source_hashes, stored=stored)]
+            if seen is not None:
+                seen.update((source, hashes[i]) for i in kept)
+            keep += kept
+        keep.sort()
+        return [data[i] for i in keep], [metadatas[i] for i in keep], len(data) - len(keep)
+
+    def delete_source(self, source: str, content_hashes: Optional[List[str]] = None) -> int:
+        '''Delete chunks of source (only those with the given content hashes if any) from both stores.'''
+        vec_count = self.vector_db.delete_source(source, content_hashes=content_hashes)
+        if self.scalar_db:
+            scalar_count = self.scalar_db.delete_source(source, content_hashes=content_hashes)
+            if scalar_count != vec_count:
+                logger.warning('Deleted %s chunks of %s in vector db VS %s in scalar db.',
+                               vec_count, source, scalar_count)
+        return vec_count
+
+    def upsert_source(self, source: str, docs: List[Document], stored: Optional[List[str]] = None) -> Dict[str, int]:
+        '''Replace chunks of source with docs, touching changed chunks only.
+        Chunks are matched by content hash: stored chunks not in docs are deleted
+        and only docs not stored yet are embedded and inserted.
+        Content hashes of stored chunks are looked up in the vector store unless given by stored.
+        '''
+        stored = set(self.vector_db.source_hashes(source) if stored is None else stored)
+        chunks = {}
+        for doc in docs:
+            chunks.setdefault(doc.metadata.get('content_hash') or content_hash(doc.page_content), doc.page_content)
+        stale = [x for x in stored if x not in chunks]
+        fresh = [x for x in chunks if x not in stored]
+        deleted = self.delete_source(source, content_hashes=stale) if stale else 0
+        inserted = 0
+        if fresh:
+            inserted = self.insert(data=[chunks[x] for x in fresh],
+                                   metadatas=[{'source': source, 'content_hash': x} for x in fresh])
+        return {'inserted': inserted, 'deleted': deleted, 'unchanged': len(chunks) - len(fresh)}
+
     @classmethod
     def drop(cls, project):
         status = cls.has_project(project)
         assert status, f'No table found for project: {project}'
 
-        VectorStore.drop(project)
+        if LocalVectorStore.has_project(project):
+            LocalVectorStore.drop(project)
+        else:
+            VectorStore.drop(project)
+            if LocalVectorStore.was_migrated(project):
+                LocalVectorStore.drop(project)
 
         if USE_SCALAR:
             ScalarStore.drop(project)
@@ -94,7 +339,7 @@ class DocStore:
 
     @classmethod
     def has_project(cls, project):
-        status = VectorStore.has_project(project)
+        status = LocalVectorStore.has_project(project) or VectorStore.has_project(project)
         if USE_SCALAR:
             assert ScalarStore.has_project(project) == status
         return status
@@ -0,0 +1,38 @@
+import os
+import sys
+from typing import Dict, List, Optional
+
+from langchain.docstore.document import Document
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
+
+from common import content_hash  # pylint: disable=C0413
+
+
+def reciprocal_rank_fusion(results: Dict[str, List[Document]],
+                           weights: Optional[Dict[str, float]] = None,
+                           k: int = 60) -> List[Document]:
+    '''Merge ranked lists of docs from several stores with (weighted) reciprocal rank fusion.
+
+    A doc scores sum(weight / (k + rank)) over the lists it appears in, so chunks found by several stores rank higher.
+    Docs are deduplicated by content hash, keeping the first doc object seen in the order of results.
+
+    Args:
+        results (Dict[str, List[Document]]): ranked docs by store name.
+        weights (Dict[str, float]): weight by store name, 1.0 for stores not given.
+        k (int): constant damping the weight of top ranks.
+    '''
+    weights = weights or {}
+    scores = {}
+    docs = {}
+    for name, ranked in results.items():
+        weight = weights.get(name, 1.0)
+        seen = set()
+        for rank, doc in enumerate(ranked, start=1):
+            key = content_hash(doc.page_content)
+            if key in seen:
+                continue
+            seen.add(key)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
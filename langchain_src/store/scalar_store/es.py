@@ -1,9 +1,17 @@
 import os
 import sys
-from typing import Any, Iterable
+import asyncio
+import weakref
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterable, List, Optional
 
 import elasticsearch
+from elasticsearch.helpers import bulk
 from langchain.retrievers import ElasticSearchBM25Retriever
+from langchain.docstore.document import Document
+from pydantic import PrivateAttr
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
@@ -13,22 +21,143 @@ from config import SCALARDB_CONFIG
 CONNECTION_ARGS = SCALARDB_CONFIG.get(
     'connection_args', {'host': 'localhost', 'port': 9200})
 
+BULK_CONFIG = SCALARDB_CONFIG.get('bulk', {})
+BULK_CHUNK_SIZE = BULK_CONFIG.get('chunk_size', 500)
+BULK_MAX_CHUNK_BYTES = BULK_CONFIG.get('max_chunk_bytes', 100 * 1024 * 1024)
+
+# Metadata of doc chunks stored along with the content
+SOURCE_FIELDS = ('source', 'content_hash')
+
+# Bulk loads running by index name, with the refresh interval to restore after the last one: [count, interval]
+_BULK_LOADS = {}
+_BULK_LOCK = threading.Lock()
+
+# Async clients by event loop, as a client can not be used in other loops than the one it was first used in
+_ASYNC_CLIENTS = weakref.WeakKeyDictionary()
+_ASYNC_LOCK = threading.Lock()
+
+
+def get_async_client(connection_args: dict = CONNECTION_ARGS):
+    '''Async client of the running event loop, created on first use in the loop.'''
+    loop = asyncio.get_running_loop()
+    with _ASYNC_LOCK:
+        client = _ASYNC_CLIENTS.get(loop)
+        if client is None:
+            client = _ASYNC_CLIENTS[loop] = elasticsearch.AsyncElasticsearch(**connection_args)
+    return client
+
+
+async def close_async_client():
+    '''Close the async client of the running event loop if any, e.g. before asyncio.run closes the loop.'''
+    with _ASYNC_LOCK:
+        client = _ASYNC_CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
 
 class ScalarStore(ElasticSearchBM25Retriever):
     '''Scalar store to save and retrieve scalar data.'''
-    def __init__(self, index_name: str, client: Any = elasticsearch.Elasticsearch(**CONNECTION_ARGS)):
-        super().__init__(client=client, index_name=index_name)
+    async_client: Any = None
+    _mapped: bool = PrivateAttr(default=False)
+
+    def __init__(self,
+                 index_name: str,
+                 client: Any = elasticsearch.Elasticsearch(**CONNECTION_ARGS),
+                 async_client: Any = None
+                 ):
+        super().__init__(client=client, index_name=index_name, async_client=async_client)
+        self._mapped = False
 
-    def insert(self, data: Iterable[str]):
-        '''Insert data'''
-        ids = self.add_texts(texts=data)
-        return len(ids)
+    def insert(self, data: Iterable[str], metadatas: Optional[List[dict]] = None, refresh: bool = True):
+        '''Insert data with the bulk API, with source ids and content hashes of chunks if given in metadatas.
+        Set refresh=False to skip refreshing the index, e.g. in bulk_load.
+        '''
+        self._ensure_source_mapping()
+        if metadatas is None:
+            metadatas = itertools.repeat({})
+
+        def _actions():
+            for text, metadata in zip(data, metadatas):
+                action = {'_op_type': 'index', '_index': self.index_name, 'content': text}
+                action.update({k: metadata[k] for k in SOURCE_FIELDS if k in metadata})
+                yield action
+
+        count, _ = bulk(self.client, _actions(), chunk_size=BULK_CHUNK_SIZE, max_chunk_bytes=BULK_MAX_CHUNK_BYTES)
+        if refresh:
+            self.client.indices.refresh(index=self.index_name)
+        return count
+
+    @contextmanager
+    def bulk_load(self):
+        '''Disable periodic refresh of the index during a large load, restoring it and refreshing once afterwards.
+        Overlapping loads of an index share this: the first one saves the refresh interval, the last one restores it.
+        '''
+        self._ensure_source_mapping()
+        with _BULK_LOCK:
+            if self.index_name in _BULK_LOADS:
+                _BULK_LOADS[self.index_name][0] += 1
+            else:
+                settings = self.client.indices.get_settings(index=self.index_name, name='index.refresh_interval')
+                interval = settings.get(self.index_name, {}).get('settings', {}).get('index', {}).get('refresh_interval')
+                self.client.indices.put_settings(index=self.index_name, settings={'index': {'refresh_interval': '-1'}})
+                _BULK_LOADS[self.index_name] = [1, interval]
+        try:
+            yield self
+        finally:
+            with _BULK_LOCK:
+                _BULK_LOADS[self.index_name][0] -= 1
+                if _BULK_LOADS[self.index_name][0] == 0:
+                    interval = _BULK_LOADS.pop(self.index_name)[1]
+                    # None resets the index to the default refresh interval
+                    self.client.indices.put_settings(
+                        index=self.index_name, settings={'index': {'refresh_interval': interval}})
+                    self.client.indices.refresh(index=self.index_name)
+
+    def delete_source(self, source: str, content_hashes: Optional[List[str]] = None) -> int:
+        '''Delete chunks of source, only those with the given content hashes if any'''
+        filters = [{'term': {'source': source}}]
+        if content_hashes is not None:
+            filters.append({'terms': {'content_hash': list(content_hashes)}})
+        res = self.client.delete_by_query(
+            index=self.index_name, query={'bool': {'filter': filters}}, refresh=True)
+        return res['deleted']
+
+    def _ensure_source_mapping(self):
+        # Source fields are matched exactly, map them as keywords before dynamic mapping makes them text
+        if self._mapped:
+            return
+        mappings = {k: {'type': 'keyword'} for k in SOURCE_FIELDS}
+        if self.client.indices.exists(index=self.index_name):
+            self.client.indices.put_mapping(index=self.index_name, properties=mappings)
+        else:
+            self.client.indices.create(index=self.index_name, mappings={'properties': mappings})
+        self._mapped = True
 
     def search(self, query: str):
         '''Query data'''
         res_docs = self.get_relevant_documents(query=query)
         return res_docs
 
+    def search_batch(self, queries: List[str]) -> List[List[Document]]:
+        '''Query data of many queries in one msearch request, same BM25 match as search'''
+        if len(queries) == 0:
+            return []
+        body = []
+        for query in queries:
+            body.append({'index': self.index_name})
+            body.append({'query': {'match': {'content': query}}})
+        res = self.client.msearch(body=body)
+        return [[Document(page_content=r['_source']['content']) for r in x['hits']['hits']] for x in res['responses']]
+
+    async def asearch(self, query: str):
+        '''Async query data, same BM25 match as search.
+        Without an async_client given, the client of the running event loop is used.
+        '''
+        query_dict = {'query': {'match': {'content': query}}}
+        client = self.async_client or get_async_client()
+        res = await client.search(index=self.index_name, body=query_dict)
+        return [Document(page_content=r['_source']['content']) for r in res['hits']['hits']]
+
     @classmethod
     def connect(cls, connection_args: dict = CONNECTION_ARGS):
         client = elasticsearch.Elasticsearch(**connection_args)
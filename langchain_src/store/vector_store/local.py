@@ -0,0 +1,440 @@
+import os
+import sys
+import json
+import uuid
+import shutil
+import asyncio
+import inspect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Optional, Any, Tuple, List, Union
+
+import numpy
+from langchain.embeddings.base import Embeddings
+from langchain.docstore.document import Document
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+from config import VECTORDB_CONFIG
+
+
+logger = logging.getLogger('vector_store')
+
+TOP_K = VECTORDB_CONFIG.get('top_k', 3)
+METRIC_TYPE = VECTORDB_CONFIG.get('index_params', {}).get('metric_type', 'IP')
+LOCAL_CONFIG = VECTORDB_CONFIG.get('local_store', {})
+LOCAL_THRESHOLD = LOCAL_CONFIG.get('threshold', 0)
+LOCAL_PATH = LOCAL_CONFIG.get('path', 'local_vector_db')
+INDEX_TYPE = LOCAL_CONFIG.get('index_type', 'FLAT')
+HNSW_PARAMS = LOCAL_CONFIG.get('hnsw_params', {})
+
+# Data files are named by the generation of the project, which changes when a delete rewrites them
+EMBEDDING_FILE = 'embeddings.{}.f32'
+DOC_FILE = 'docs.{}.jsonl'
+HNSW_FILE = 'hnsw.{}.bin'
+MANIFEST_FILE = 'manifest.json'
+LOCK_FILE = 'write.lock'
+
+
+def _read_manifest(project_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(project_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class LocalVectorStore:
+    '''
+    In-process vector store for small projects: insert, search.
+    Embeddings are a float32 matrix memory-mapped from disk, searched exactly or with an HNSW index (hnswlib),
+    and docs are kept in a list in the same order.
+    Inserts append rows to the embedding & doc files and commit the new row count in a manifest,
+    so rows past the count (e.g. of a crashed insert) are never read. Deletes rewrite the files under a new generation.
+    Every process reloads the project when the manifest changes, reading only appended rows of the same generation.
+    '''
+
+    def __init__(self, table_name: str, embedding_func: Embeddings = None, path: str = LOCAL_PATH,
+                 index_type: str = INDEX_TYPE, metric_type: str = METRIC_TYPE):
+        '''Initialize local vector db, loading project data if it exists'''
+        assert index_type in ['FLAT', 'HNSW'], f'Invalid local index type: {index_type}'
+        assert metric_type in ['IP', 'L2'], f'Invalid metric type for local vector store: {metric_type}'
+        self.embedding_func = embedding_func
+        self.collection_name = table_name
+        self.index_type = index_type
+        self.metric_type = metric_type
+        self.path = path
+        self.dir = os.path.join(path, table_name)
+        # Writes & reloads are serialized by the lock, searches read the (embeddings, docs, hnsw) snapshot without locking
+        self._lock = threading.Lock()
+        self._state = (None, [], None)
+        # Manifest of the loaded state and the stat of its file, to find changes by other processes
+        self._manifest = None
+        self._stat = None
+        self._load()
+
+    @property
+    def col(self):
+        '''Loaded embeddings, None if the project has no data yet (same check as Milvus collection).'''
+        return self._snapshot()[0]
+
+    @property
+    def migrated(self) -> bool:
+        '''Whether the project was migrated to Milvus, e.g. by another process.'''
+        self._refresh()
+        return self._manifest is not None and self._manifest.get('migrated', False)
+
+    def __len__(self) -> int:
+        return len(self._snapshot()[1])
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vectors([embedding], k=k, **kwargs)[0]
+
+    def similarity_search_with_score_by_vectors(
+        self,
+        embeddings: Union[List[List[float]], numpy.ndarray],
+        k: int = 4,
+        **kwargs: Any,
+    ) -> List[List[Tuple[Document, float]]]:
+        '''Search many query vectors at once, returning results of each query in the same order.'''
+        queries = numpy.asarray(embeddings, dtype=numpy.float32).reshape(len(embeddings), -1)
+        embeddings, docs, hnsw = self._snapshot()
+        if embeddings is None:
+            raise RuntimeError('No existing collection to search.')
+        k = min(k, len(docs))
+        if k == 0:
+            return [[] for _ in queries]
+        if hnsw is not None:
+            # The index may hold rows appended after this snapshot, which are left out
+            ids, scores = hnsw.knn_query(queries, k=min(k, hnsw.get_current_count()))
+            if self.metric_type == 'IP':
+                # hnswlib returns 1 - inner product
+                scores = 1 - scores
+        else:
+            if self.metric_type == 'IP':
+                # Larger inner product is closer, sort by negative scores
+                scores = queries @ embeddings.T
+                order = -scores
+            else:
+                scores = (queries ** 2).sum(axis=1, keepdims=True) - 2 * queries @ embeddings.T \
+                    + (embeddings ** 2).sum(axis=1)
+                order = scores
+            top = numpy.argpartition(order, k - 1, axis=1)[:, :k]
+            top_order = numpy.take_along_axis(order, top, axis=1)
+            ids = numpy.take_along_axis(top, numpy.argsort(top_order, axis=1), axis=1)
+            scores = numpy.take_along_axis(scores, ids, axis=1)
+
+        batch_ret = []
+        for row_ids, row_scores in zip(ids, scores):
+            ret = []
+            for i, score in zip(row_ids, row_scores):
+                if i >= len(docs):
+                    continue
+                meta = dict(docs[i])
+                text = meta.pop('text')
+                doc = Document(page_content=meta.pop('doc', text), metadata=meta)
+                ret.append((doc, float(score)))
+            batch_ret.append(ret)
+        return batch_ret
+
+    def insert(self, data: List[str], metadatas: Optional[List[dict]] = None):
+        '''Insert data'''
+        data = list(data)
+        if len(data) == 0:
+            return 0
+        if 'as_array' in inspect.signature(self.embedding_func.embed_documents).parameters:
+            embeddings = self.embedding_func.embed_documents(data, as_array=True)
+        else:
+            embeddings = self.embedding_func.embed_documents(data)
+        if metadatas is None:
+            metadatas = [{}] * len(data)
+        metadatas = [{**m, 'text': t} for t, m in zip(data, metadatas)]
+        return self.insert_embeddings(data=embeddings, metadatas=metadatas)
+
+    def insert_embeddings(self,
+                          data: Union[List[List[float]], numpy.ndarray],
+                          metadatas: List[dict],
+                          **kwargs: Any
+                          ):
+        '''Insert embeddings with texts, appended to the project files, so the cost depends on the batch only'''
+        embeddings = numpy.ascontiguousarray(data, dtype=numpy.float32)
+        if len(embeddings) == 0:
+            logger.debug('Nothing to insert, skipping.')
+            return 0
+        assert len(embeddings) == len(metadatas), 'Numbers of embeddings and metadatas do not match.'
+        for d in metadatas:
+            assert 'text' in d, 'Embedding insert must have corresponding text in metadatas.'
+
+        with self._write_lock():
+            # Append after rows inserted by other processes
+            self._refresh(locked=True)
+            manifest = self._manifest
+            if manifest is not None and manifest.get('migrated', False):
+                raise RuntimeError(f'Project {self.collection_name} was migrated to Milvus.')
+            if manifest is None:
+                manifest = self._new_manifest(embeddings.shape[1])
+            assert manifest['dim'] == embeddings.shape[1], \
+                f'Embedding dim {embeddings.shape[1]} does not match project dim {manifest["dim"]}.'
+            self._write_manifest(self._append(manifest, embeddings, metadatas))
+            self._load()
+            self._save_hnsw()
+        return len(metadatas)
+
+    def search(self, query: str, embedding: Optional[List[float]] = None) -> List[Document]:
+        '''Query data, with the query embedding if already computed'''
+        assert self.col is not None, f'No project table: {self.collection_name}'
+        if embedding is None:
+            embedding = self.embedding_func.embed_query(query)
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=TOP_K)]
+
+    def search_batch(self, queries: List[str]) -> List[List[Document]]:
+        '''Query data of many queries, embedded in one encoder batch and searched by one matrix product'''
+        assert self.col is not None, f'No project table: {self.collection_name}'
+        if len(queries) == 0:
+            return []
+        if 'as_array' in inspect.signature(self.embedding_func.embed_documents).parameters:
+            embeddings = self.embedding_func.embed_documents(list(queries), as_array=True)
+        else:
+            embeddings = self.embedding_func.embed_documents(list(queries))
+        res = self.similarity_search_with_score_by_vectors(embeddings, k=TOP_K)
+        return [[doc for doc, _ in pairs] for pairs in res]
+
+    async def asearch(self, query: str, embedding: Optional[List[float]] = None) -> List[Document]:
+        '''Async query data, the encoder pass runs off the event loop'''
+        return await asyncio.to_thread(self.search, query, embedding)
+
+    def source_hashes(self, source: str) -> List[str]:
+        '''Content hashes of chunks stored for source'''
+        return [d.get('content_hash') for d in self._snapshot()[1] if d.get('source') == source]
+
+    def existing_hashes(self, content_hashes: List[str], source: Optional[str] = None) -> List[str]:
+        '''Content hashes of the given ones which are already stored (for source if given)'''
+        content_hashes = set(content_hashes)
+        docs = self._snapshot()[1]
+        if source is not None:
+            docs = [d for d in docs if d.get('source') == source]
+        return list({d.get('content_hash') for d in docs} & content_hashes)
+
+    def delete_source(self, source: str, content_hashes: Optional[List[str]] = None) -> int:
+        '''Delete chunks of source, only those with the given content hashes if any.
+        The kept rows are written to files of a new generation, so processes still reading the old ones are not broken.
+        '''
+        content_hashes = None if content_hashes is None else set(content_hashes)
+        with self._write_lock():
+            self._refresh(locked=True)
+            embeddings, docs, _ = self._state
+            keep = [i for i, d in enumerate(docs) if d.get('source') != source
+                    or (content_hashes is not None and d.get('content_hash') not in content_hashes)]
+            num = len(docs) - len(keep)
+            if num == 0:
+                return 0
+            generation = self._manifest['generation']
+            manifest = self._new_manifest(embeddings.shape[1])
+            self._write_manifest(self._append(manifest, numpy.asarray(embeddings[keep]), [docs[i] for i in keep]))
+            self._load()
+            self._save_hnsw()
+            self._remove_files(generation)
+        return num
+
+    def export(self) -> Tuple[Optional[numpy.ndarray], List[dict]]:
+        '''All embeddings and metadatas (with text) of the project, e.g. to migrate it to Milvus.'''
+        embeddings, docs, _ = self._snapshot()
+        return embeddings, [dict(d) for d in docs]
+
+    def migrate(self, insert_func: Callable[[numpy.ndarray, List[dict]], Any]) -> int:
+        '''Pass all rows of the project to insert_func (e.g. Milvus insert), then mark it as migrated and remove its files.
+        Writes of other processes wait until the migration ends, and then fail on the mark.
+        Only the manifest is kept, so other processes switch to Milvus once they read it,
+        and searches already running keep their memory-mapped rows until then.
+        '''
+        with self._write_lock():
+            self._refresh(locked=True)
+            embeddings, docs, _ = self._state
+            if embeddings is None:
+                return 0
+            insert_func(embeddings, [dict(d) for d in docs])
+            generation = self._manifest['generation']
+            self._write_manifest({'migrated': True})
+            self._load()
+            self._remove_files(generation)
+        return len(docs)
+
+    def _snapshot(self) -> tuple:
+        self._refresh()
+        return self._state
+
+    def _refresh(self, locked: bool = False):
+        '''Reload the project if its manifest file changed, e.g. by an insert or delete of another process.'''
+        if self._manifest_stat() == self._stat:
+            return
+        if locked:
+            self._load()
+            return
+        with self._lock:
+            if self._manifest_stat() != self._stat:
+                self._load()
+
+    def _manifest_stat(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(os.path.join(self.dir, MANIFEST_FILE))
+        except FileNotFoundError:
+            return None
+        # The manifest is replaced by a new file on every write, so the inode changes even within the mtime resolution
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        # Files of the read manifest may be removed by a delete of another process meanwhile, then read the new one
+        for _ in range(3):
+            stat = self._manifest_stat()
+            manifest = _read_manifest(self.dir)
+            try:
+                state = self._load_state(manifest)
+            except FileNotFoundError:
+                continue
+            self._state, self._manifest, self._stat = state, manifest, stat
+            return
+        raise RuntimeError(f'Failed to load local vector store of project: {self.collection_name}')
+
+    def _load_state(self, manifest: Optional[dict]) -> tuple:
+        '''(embeddings, docs, hnsw) committed by manifest, reusing the loaded docs & index of the same generation.'''
+        if manifest is None or manifest.get('migrated', False):
+            return None, [], None
+        count, dim, generation = manifest['count'], manifest['dim'], manifest['generation']
+        embeddings = numpy.zeros((0, dim), dtype=numpy.float32)
+        if count > 0:
+            embeddings = numpy.memmap(self._file(EMBEDDING_FILE, generation),
+                                      dtype=numpy.float32, mode='r', shape=(count, dim))
+
+        docs, docs_size, hnsw = [], 0, None
+        if self._manifest is not None and self._manifest.get('generation') == generation:
+            # Rows of a generation are only appended, read the new ones
+            _, docs, hnsw = self._state
+            docs_size = self._manifest['docs_size']
+        if manifest['docs_size'] > docs_size:
+            with open(self._file(DOC_FILE, generation), 'rb') as f:
+                f.seek(docs_size)
+                lines = f.read(manifest['docs_size'] - docs_size).decode('utf-8').splitlines()
+            docs = docs + [json.loads(x) for x in lines]
+
+        if self.index_type == 'HNSW' and count > 0:
+            hnsw = self._update_hnsw(hnsw, embeddings, generation)
+        else:
+            hnsw = None
+        return embeddings, docs, hnsw
+
+    def _append(self, manifest: dict, embeddings: numpy.ndarray, docs: List[dict]) -> dict:
+        '''Append rows to the files of the manifest generation, returning the manifest to commit them.'''
+        os.makedirs(self.dir, exist_ok=True)
+        lines = ''.join(json.dumps(d) + '\n' for d in docs).encode('utf-8')
+        generation = manifest['generation']
+        for name, size, data in [
+            (EMBEDDING_FILE, manifest['count'] * manifest['dim'] * embeddings.itemsize, embeddings.tobytes()),
+            (DOC_FILE, manifest['docs_size'], lines)
+        ]:
+            with open(self._file(name, generation), 'ab') as f:
+                # Cut off rows written past the manifest, e.g. by a crashed insert
+                f.truncate(size)
+                f.write(data)
+        return {**manifest, 'count': manifest['count'] + len(embeddings), 'docs_size': manifest['docs_size'] + len(lines)}
+
+    @staticmethod
+    def _new_manifest(dim: int) -> dict:
+        # A random generation, so files of a dropped & recreated project never match the loaded ones
+        return {'dim': dim, 'count': 0, 'docs_size': 0, 'generation': uuid.uuid4().hex, 'hnsw_count': 0}
+
+    def _write_manifest(self, manifest: dict):
+        # Write to a temporary file and rename, so a crash never leaves a half-written manifest
+        tmp_path = os.path.join(self.dir, MANIFEST_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(self.dir, MANIFEST_FILE))
+
+    def _remove_files(self, generation: str):
+        # Processes with the files memory-mapped or open keep reading them until they reload
+        for name in [EMBEDDING_FILE, DOC_FILE, HNSW_FILE]:
+            try:
+                os.remove(self._file(name, generation))
+            except FileNotFoundError:
+                pass
+
+    def _file(self, name: str, generation: str) -> str:
+        return os.path.join(self.dir, name.format(generation))
+
+    @contextmanager
+    def _write_lock(self):
+        '''Serialize writes of threads by the lock, and writes of processes by a lock file of the project.'''
+        import fcntl  # pylint: disable=C0415
+
+        os.makedirs(self.dir, exist_ok=True)
+        with self._lock, open(os.path.join(self.dir, LOCK_FILE), 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _update_hnsw(self, hnsw, embeddings: numpy.ndarray, generation: str):
+        '''Add rows missing in the index of the generation, loading or building it if needed.'''
+        if hnsw is None:
+            hnsw = self._load_hnsw(embeddings, generation)
+        if hnsw is None or len(embeddings) > hnsw.get_max_elements():
+            # A full index is rebuilt with room to grow rather than resized, as searches may be using it
+            return self._build_hnsw(embeddings)
+        start = hnsw.get_current_count()
+        if start < len(embeddings):
+            hnsw.add_items(embeddings[start:], numpy.arange(start, len(embeddings)))
+        return hnsw
+
+    def _save_hnsw(self):
+        '''Save the index once the project doubled since the last save, so saves cost O(1) per row on average.'''
+        hnsw = self._state[2]
+        if hnsw is None or hnsw.get_current_count() < 2 * self._manifest['hnsw_count']:
+            return
+        hnsw_path = self._file(HNSW_FILE, self._manifest['generation'])
+        hnsw.save_index(hnsw_path + '.tmp')
+        os.replace(hnsw_path + '.tmp', hnsw_path)
+        self._write_manifest({**self._manifest, 'hnsw_count': hnsw.get_current_count()})
+        self._load()
+
+    def _build_hnsw(self, embeddings: numpy.ndarray):
+        import hnswlib  # pylint: disable=C0415
+
+        hnsw = hnswlib.Index(space='ip' if self.metric_type == 'IP' else 'l2', dim=embeddings.shape[1])
+        hnsw.init_index(max_elements=2 * len(embeddings),
+                        ef_construction=HNSW_PARAMS.get('ef_construction', 200),
+                        M=HNSW_PARAMS.get('M', 16))
+        hnsw.add_items(embeddings, numpy.arange(len(embeddings)))
+        hnsw.set_ef(max(HNSW_PARAMS.get('ef', 64), TOP_K))
+        return hnsw
+
+    def _load_hnsw(self, embeddings: numpy.ndarray, generation: str):
+        import hnswlib  # pylint: disable=C0415
+
+        hnsw_path = self._file(HNSW_FILE, generation)
+        if not os.path.exists(hnsw_path):
+            return None
+        hnsw = hnswlib.Index(space='ip' if self.metric_type == 'IP' else 'l2', dim=embeddings.shape[1])
+        hnsw.load_index(hnsw_path, max_elements=2 * len(embeddings))
+        hnsw.set_ef(max(HNSW_PARAMS.get('ef', 64), TOP_K))
+        return hnsw
+
+    @classmethod
+    def drop(cls, project: str, path: str = LOCAL_PATH):
+        '''Remove the project directory, with the manifest left by a migration if any'''
+        if os.path.isdir(os.path.join(path, project)):
+            shutil.rmtree(os.path.join(path, project))
+        else:
+            raise AttributeError(f'No table in local vector db: {project}')
+
+    @classmethod
+    def has_project(cls, project: str, path: str = LOCAL_PATH):
+        manifest = _read_manifest(os.path.join(path, project))
+        return manifest is not None and not manifest.get('migrated', False)
+
+    @classmethod
+    def was_migrated(cls, project: str, path: str = LOCAL_PATH):
+        manifest = _read_manifest(os.path.join(path, project))
+        return manifest is not None and manifest.get('migrated', False)
@@ -1,7 +1,12 @@
 import os
 import sys
+import json
+import asyncio
+import inspect
 import logging
-from typing import Optional, Any, Tuple, List, Dict
+from typing import Optional, Any, Tuple, List, Dict, Union
+
+import numpy
 
 from langchain.vectorstores import Milvus
 from langchain.embeddings.base import Embeddings
@@ -20,6 +25,14 @@ INDEX_PARAMS = VECTORDB_CONFIG.get('index_params', None)
 SEARCH_PARAMS = VECTORDB_CONFIG.get('search_params', None)
 
 
+def source_expr(source: str, content_hashes: Optional[List[str]] = None) -> str:
+    '''Milvus boolean expression matching chunks of source (with given content hashes)'''
+    expr = f'source == {json.dumps(source, ensure_ascii=False)}'
+    if content_hashes is not None:
+        expr += f' and content_hash in {json.dumps(list(content_hashes))}'
+    return expr
+
+
 class VectorStore(Milvus):
     '''
     Vector database APIs: insert, search
@@ -49,19 +62,37 @@ class VectorStore(Milvus):
         timeout: Optional[int] = None,
         **kwargs: Any,
     ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vectors(
+            [embedding], k=k, param=param, expr=expr, timeout=timeout, **kwargs)[0]
+
+    def similarity_search_with_score_by_vectors(
+        self,
+        embeddings: Union[List[List[float]], numpy.ndarray],
+        k: int = 4,
+        param: Optional[dict] = None,
+        expr: Optional[str] = None,
+        timeout: Optional[int] = None,
+        **kwargs: Any,
+    ) -> List[List[Tuple[Document, float]]]:
+        '''Search many query vectors in one RPC, returning results of each query in the same order.'''
         if self.col is None:
             raise RuntimeError('No existing collection to search.')
 
         if param is None:
             param = self.search_params
 
+        if isinstance(embeddings, numpy.ndarray):
+            # Rows are passed as float32 arrays without building lists of floats here,
+            # pymilvus still converts them element by element into the protobuf request
+            embeddings = list(numpy.ascontiguousarray(embeddings, dtype=numpy.float32))
+
         # Determine result metadata fields.
         output_fields = self.fields[:]
         output_fields.remove(self._vector_field)
 
         # Perform the search.
         res = self.col.search(
-            data=[embedding],
+            data=embeddings,
             anns_field=self._vector_field,
             param=param,
             limit=k,
@@ -71,38 +102,57 @@ class VectorStore(Milvus):
             **kwargs,
         )
         # Organize results.
-        ret = []
         if 'doc' in output_fields:
             doc_field = 'doc'
         else:
             doc_field = self._text_field
-        for result in res[0]:
-            meta = {x: result.entity.get(x) for x in output_fields}
-            doc = Document(page_content=meta.pop(doc_field), metadata=meta)
-            pair = (doc, result.score)
-            ret.append(pair)
-
-        return ret
+        batch_ret = []
+        for hits in res:
+            ret = []
+            for result in hits:
+                meta = {x: result.entity.get(x) for x in output_fields}
+                doc = Document(page_content=meta.pop(doc_field), metadata=meta)
+                pair = (doc, result.score)
+                ret.append(pair)
+            batch_ret.append(ret)
+
+        return batch_ret
 
     def insert(self, data: List[str], metadatas: Optional[List[dict]] = None):
         '''Insert data'''
-        pks = self.add_texts(
-            texts=data,
-            metadatas=metadatas
-        )
-        return len(pks)
+        if 'as_array' not in inspect.signature(self.embedding_func.embed_documents).parameters:
+            pks = self.add_texts(
+                texts=data,
+                metadatas=metadatas
+            )
+            return len(pks)
+        data = list(data)
+        if len(data) == 0:
+            return 0
+        # Keep embeddings in one float32 array from the encoder to the insert call
+        embeddings = self.embedding_func.embed_documents(data, as_array=True)
+        if metadatas is None:
+            metadatas = [{}] * len(data)
+        metadatas = [{**m, 'text': t} for t, m in zip(data, metadatas)]
+        return self.insert_embeddings(data=embeddings, metadatas=metadatas)
 
     def insert_embeddings(self,
-                          data: List[float],
+                          data: Union[List[List[float]], numpy.ndarray],
                           metadatas: List[dict],
                           timeout: Optional[int] = None,
                           batch_size: int = 1000,
                           **kwargs: Any
                           ):
-        '''Insert embeddings with texts'''
+        '''Insert embeddings with texts.
+        A 2-d numpy array is passed to pymilvus batch by batch as slices, without converting rows to lists here
+        (pymilvus still converts vectors element by element into the protobuf request).
+        '''
         from pymilvus import Collection, MilvusException  # pylint: disable=C0415
 
-        embeddings = list(data)
+        if isinstance(data, numpy.ndarray):
+            embeddings = numpy.ascontiguousarray(data, dtype=numpy.float32)
+        else:
+            embeddings = list(data)
         texts = []
         for d in metadatas:
             texts.append(d.pop('text'))
@@ -152,11 +202,13 @@ class VectorStore(Milvus):
         return len(pks)
 
 
-    def search(self, query: str) -> List[Document]:
-        '''Query data'''
+    def search(self, query: str, embedding: Optional[List[float]] = None) -> List[Document]:
+        '''Query data, with the query embedding if already computed'''
         assert self.col, f'No project table: {self.collection_name}'
-        docs = self.similarity_search(
-            query=query,
+        if embedding is None:
+            embedding = self.embedding_func.embed_query(query)
+        docs = self.similarity_search_by_vector(
+            embedding=embedding,
             k=TOP_K,
             param=self.search_params
         )
@@ -167,6 +219,81 @@ class VectorStore(Milvus):
             res.append(doc)
         return res
 
+    def search_batch(self, queries: List[str]) -> List[List[Document]]:
+        '''Query data of many queries, embedded in one encoder batch and searched in one RPC'''
+        assert self.col, f'No project table: {self.collection_name}'
+        if len(queries) == 0:
+            return []
+        if 'as_array' in inspect.signature(self.embedding_func.embed_documents).parameters:
+            embeddings = self.embedding_func.embed_documents(list(queries), as_array=True)
+        else:
+            embeddings = self.embedding_func.embed_documents(list(queries))
+        res = []
+        for pairs in self.similarity_search_with_score_by_vectors(embeddings, k=TOP_K, param=self.search_params):
+            docs = []
+            for doc, _ in pairs:
+                if 'text' in doc.metadata:
+                    del doc.metadata['text']
+                docs.append(doc)
+            res.append(docs)
+        return res
+
+    def __len__(self) -> int:
+        '''Number of live entities by a count(*) query, without flushing and without deleted rows not compacted yet.'''
+        if self.col is None:
+            return 0
+        return self.col.query(expr='', output_fields=['count(*)'], consistency_level='Strong')[0]['count(*)']
+
+    def source_hashes(self, source: str) -> List[str]:
+        '''Content hashes of chunks stored for source'''
+        if self.col is None:
+            return []
+        self._check_source_fields()
+        res = self.col.query(expr=source_expr(source), output_fields=['content_hash'])
+        return [x['content_hash'] for x in res]
+
+    def delete_source(self, source: str, content_hashes: Optional[List[str]] = None) -> int:
+        '''Delete chunks of source, only those with the given content hashes if any'''
+        if self.col is None:
+            return 0
+        self._check_source_fields()
+        # Milvus deletes by primary keys only, so look up the chunks first
+        res = self.col.query(expr=source_expr(source, content_hashes), output_fields=[self._primary_field])
+        pks = [x[self._primary_field] for x in res]
+        if len(pks) == 0:
+            return 0
+        self.col.delete(expr=f'{self._primary_field} in {pks}')
+        return len(pks)
+
+    def existing_hashes(self, content_hashes: List[str], source: Optional[str] = None,
+                        batch_size: int = 1000) -> List[str]:
+        '''Content hashes of the given ones which are already stored (for source if given),
+        empty if the project stores no content hashes
+        '''
+        if self.col is None or 'content_hash' not in self.fields:
+            return []
+        content_hashes = list(set(content_hashes))
+        res = []
+        for i in range(0, len(content_hashes), batch_size):
+            batch = content_hashes[i:i + batch_size]
+            if source is not None:
+                expr = source_expr(source, batch)
+            else:
+                expr = f'content_hash in {json.dumps(batch)}'
+            res += [x['content_hash'] for x in self.col.query(expr=expr, output_fields=['content_hash'])]
+        return res
+
+    def _check_source_fields(self):
+        if 'source' not in self.fields or 'content_hash' not in self.fields:
+            raise RuntimeError(f'Project {self.collection_name} was created without source ids, '
+                               'drop and insert it again to update sources.')
+
+    async def asearch(self, query: str, embedding: Optional[List[float]] = None) -> List[Document]:
+        '''Async query data.
+        pymilvus has no asyncio client, so the encoder pass and the search RPC run off the event loop.
+        '''
+        return await asyncio.to_thread(self.search, query, embedding)
+
     @classmethod
     def connect(cls, connection_args: dict = CONNECTION_ARGS):
         from pymilvus import connections  # pylint: disable=C0415
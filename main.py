@@ -1,8 +1,10 @@
+import json
 import argparse
 
 import uvicorn
 from fastapi import FastAPI
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 
 
 # Specify mode
@@ -19,9 +21,11 @@ assert (USE_LANGCHAIN and not USE_TOWHEE ) or (USE_TOWHEE and not USE_LANGCHAIN)
     'The service should start with either "--langchain" or "--towhee".'
 
 if USE_LANGCHAIN:
-    from langchain_src.operations import chat, insert, drop
+    from langchain_src.operations import chat_async, chat_stream, insert, drop, upsert_source, delete_source, \
+        sync, count, cache_stats, encoder_stats, memory_stats
 if USE_TOWHEE:
-    from towhee_src.operations import chat, insert, drop
+    from towhee_src.operations import chat_async, chat_stream, insert, drop, upsert_source, delete_source, \
+        sync, count, cache_stats, encoder_stats, memory_stats
 
 app = FastAPI()
 origins = ['*']
@@ -31,25 +35,75 @@ def check_api():
     return jsonable_encoder({'status': True, 'msg': 'ok'}), 200
 
 @app.get('/answer')
-def do_answer_api(session_id: str, project: str, question: str):
+async def do_answer_api(session_id: str, project: str, question: str):
     try:
-        final_answer = chat(session_id=session_id,
-                            project=project, question=question)
+        final_answer = await chat_async(session_id=session_id,
+                                        project=project, question=question)
         assert isinstance(final_answer, str)
         return jsonable_encoder({'status': True, 'msg': final_answer}), 200
     except Exception as e:  # pylint: disable=W0718
         return jsonable_encoder({'status': False, 'msg': f'Failed to answer question:\n{e}', 'code': 400}), 400
 
 
+@app.get('/answer/stream')
+async def do_answer_stream_api(session_id: str, project: str, question: str):
+    async def event_stream():
+        try:
+            async for token in chat_stream(session_id=session_id, project=project, question=question):
+                yield f'data: {json.dumps(token)}\n\n'
+            yield 'event: end\ndata: \n\n'
+        except Exception as e:  # pylint: disable=W0718
+            yield f'event: error\ndata: {json.dumps(f"Failed to answer question: {e}")}\n\n'
+
+    return StreamingResponse(event_stream(), media_type='text/event-stream')
+
+
 @app.post('/project/add')
 def do_project_add_api(data_src: str, project: str, source_type: str = 'file'):
     try:
-        num = insert(data_src=data_src, project=project, source_type=source_type)
-        return jsonable_encoder({'status': True, 'msg': f'Successfully inserted doc chunks: {num}'}), 200
+        res = insert(data_src=data_src, project=project, source_type=source_type)
+        return jsonable_encoder({'status': True, 'msg': f'Successfully inserted doc chunks: {res["inserted"]}, '
+                                                        f'skipped duplicate chunks: {res["skipped"]}'}), 200
     except Exception as e:  # pylint: disable=W0718
         return jsonable_encoder({'status': False, 'msg': f'Failed to load data:\n{e}'}), 400
 
 
+@app.post('/project/source/upsert')
+def do_source_upsert_api(project: str, source: str, source_type: str = 'file'):
+    try:
+        res = upsert_source(project=project, source=source, source_type=source_type)
+        return jsonable_encoder({'status': True, 'msg': f'Successfully updated source {source}: {res}'}), 200
+    except Exception as e:  # pylint: disable=W0718
+        return jsonable_encoder({'status': False, 'msg': f'Failed to update source:\n{e}'}), 400
+
+
+@app.post('/project/source/delete')
+def do_source_delete_api(project: str, source: str):
+    try:
+        num = delete_source(project=project, source=source)
+        return jsonable_encoder({'status': True, 'msg': f'Deleted doc chunks of {source}: {num}'}), 200
+    except Exception as e:  # pylint: disable=W0718
+        return jsonable_encoder({'status': False, 'msg': f'Failed to delete source:\n{e}'}), 400
+
+
+@app.post('/project/sync')
+def do_project_sync_api(project: str, data_dir: str):
+    try:
+        res = sync(project=project, data_dir=data_dir)
+        return jsonable_encoder({'status': True, 'msg': f'Successfully synced {data_dir}: {res}'}), 200
+    except Exception as e:  # pylint: disable=W0718
+        return jsonable_encoder({'status': False, 'msg': f'Failed to sync data:\n{e}'}), 400
+
+
+@app.get('/project/count')
+def do_project_count_api(project: str):
+    try:
+        num = count(project=project)
+        return jsonable_encoder({'status': True, 'msg': num}), 200
+    except Exception as e:  # pylint: disable=W0718
+        return jsonable_encoder({'status': False, 'msg': f'Failed to count project data:\n{e}'}), 400
+
+
 @app.post('/project/drop')
 def do_project_drop_api(project: str):
     # Drop data in vector db
@@ -60,5 +114,20 @@ def do_project_drop_api(project: str):
         return jsonable_encoder({'status': False, 'msg': f'Failed to drop project:\n{e}'}), 400
 
 
+@app.get('/cache/stats')
+def do_cache_stats_api():
+    return jsonable_encoder({'status': True, 'msg': cache_stats()}), 200
+
+
+@app.get('/encoder/stats')
+def do_encoder_stats_api():
+    return jsonable_encoder({'status': True, 'msg': encoder_stats()}), 200
+
+
+@app.get('/memory/stats')
+def do_memory_stats_api():
+    return jsonable_encoder({'status': True, 'msg': memory_stats()}), 200
+
+
 if __name__ == '__main__':
     uvicorn.run(app=app, host='0.0.0.0', port=8900)
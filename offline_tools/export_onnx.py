@@ -0,0 +1,141 @@
+import sys
+import os
+import json
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from config import TEXTENCODER_CONFIG
+from langchain_src.embedding.onnx_encoder import MODEL_FILE, ENCODER_CONFIG_FILE
+
+
+PARITY_TEXTS = [
+    'What is Towhee?',
+    'How to insert data into Milvus collection?',
+    'Akcio is a demo project for retrieval augmented generation.',
+    'Towhee is a framework that provides ETL for unstructured data using SoTA machine learning models.',
+    'Milvus is an open-source vector database built to power embedding similarity search and AI applications. '
+    'Milvus makes unstructured data search more accessible, and provides a consistent user experience '
+    'regardless of the deployment environment.',
+]
+
+
+def export_onnx(model_name, output_dir, quantize=True, opset=14):
+    import torch  # pylint: disable=C0415
+    from sentence_transformers import SentenceTransformer  # pylint: disable=C0415
+
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer = st_model[0]
+    pooling = 'mean'
+    normalize = False
+    for module in st_model:
+        if hasattr(module, 'get_pooling_mode_str'):
+            pooling = module.get_pooling_mode_str()
+        if type(module).__name__ == 'Normalize':
+            normalize = True
+    assert pooling in ['mean', 'cls'], f'Pooling mode {pooling} is not supported by the onnx encoder.'
+
+    features = transformer.tokenizer(['export onnx model'], return_tensors='pt')
+    input_names = [x for x in ['input_ids', 'attention_mask', 'token_type_ids'] if x in features]
+    dynamic_axes = {x: {0: 'batch', 1: 'sequence'} for x in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    fp32_path = os.path.join(output_dir, 'model_fp32.onnx')
+    model_path = os.path.join(output_dir, MODEL_FILE)
+    transformer.auto_model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer.auto_model,
+            args=tuple(features[x] for x in input_names),
+            f=fp32_path,
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True
+        )
+    print(f'exported onnx model to {fp32_path}')
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType  # pylint: disable=C0415
+
+        quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+        print(f'quantized onnx model to int8: {model_path}')
+    else:
+        os.replace(fp32_path, model_path)
+
+    transformer.tokenizer.save_pretrained(output_dir)
+    encoder_config = {
+        'model': model_name,
+        'dim': st_model.get_sentence_embedding_dimension(),
+        'max_length': st_model.max_seq_length,
+        'pooling': pooling,
+        'normalize': normalize,
+        'quantized': quantize
+    }
+    with open(os.path.join(output_dir, ENCODER_CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump(encoder_config, f, indent=2)
+    return st_model
+
+
+def check_parity(st_model, model_name, output_dir, texts=None, min_cosine=0.99):
+    from langchain_src.embedding.onnx_encoder import TextEncoder  # pylint: disable=C0415
+
+    texts = texts or PARITY_TEXTS
+    onnx_encoder = TextEncoder(model_name=model_name, onnx_path=output_dir, embedding_cache=None)
+
+    t0 = time.time()
+    torch_embeds = st_model.encode(texts, convert_to_numpy=True)
+    t1 = time.time()
+    onnx_embeds = onnx_encoder.embed_documents(texts, norm=False, as_array=True)
+    t2 = time.time()
+
+    torch_embeds = torch_embeds / np.linalg.norm(torch_embeds, axis=1, keepdims=True)
+    onnx_embeds = onnx_embeds / np.linalg.norm(onnx_embeds, axis=1, keepdims=True)
+    cosine = (torch_embeds * onnx_embeds).sum(axis=1)
+    drift = 1 - cosine
+    report = {
+        'num_texts': len(texts),
+        'cosine_min': float(cosine.min()),
+        'cosine_mean': float(cosine.mean()),
+        'drift_max': float(drift.max()),
+        'drift_mean': float(drift.mean()),
+        'torch_sec': t1 - t0,
+        'onnx_sec': t2 - t1,
+        'passed': bool(cosine.min() >= min_cosine)
+    }
+    print('parity report =', json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default=TEXTENCODER_CONFIG.get('model', 'multi-qa-mpnet-base-cos-v1'),
+                        help='Sentence-transformers model to export, defaults to the model in TEXTENCODER_CONFIG.')
+    parser.add_argument("--output_dir", type=str, default=TEXTENCODER_CONFIG.get('onnx_path', 'onnx_model'),
+                        help='Directory to save onnx model and tokenizer, defaults to onnx_path in TEXTENCODER_CONFIG.')
+    parser.add_argument("--quantize", type=int, default=1,
+                        help='Whether to apply dynamic int8 quantization to the exported model.')
+    parser.add_argument("--parity_file", type=str, required=False,
+                        help='A text file with one sentence per line to check cosine drift against the PyTorch model. '
+                             'Some built-in sentences are used if not specified.')
+    parser.add_argument("--min_cosine", type=float, default=0.99,
+                        help='Exit with error if any onnx embedding has a lower cosine similarity to the PyTorch one.')
+    args = parser.parse_args()
+
+    parity_texts = None
+    if args.parity_file:
+        with open(args.parity_file, encoding='utf-8') as f:
+            parity_texts = [line.strip() for line in f if line.strip()]
+
+    model = export_onnx(args.model, args.output_dir, quantize=args.quantize != 0)
+    res = check_parity(model, args.model, args.output_dir, texts=parity_texts, min_cosine=args.min_cosine)
+    if not res['passed']:
+        sys.exit(f'Cosine similarity {res["cosine_min"]} is lower than {args.min_cosine}.')
+    print(f'finish exporting {args.model} to {args.output_dir}')
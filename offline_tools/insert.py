@@ -11,6 +11,8 @@ from offline_tools.utils.load_npy import langchain_load
 from offline_tools.utils.stackoverflow_json2csv import stackoverflow_json2csv
 from offline_tools.generator_questions import get_output_csv
 from langchain_src.embedding import TextEncoder
+from common import Deduplicator
+from config import DATAPARSER_CONFIG
 
 
 def split_df_by_row(df, n):
@@ -31,6 +33,20 @@ def get_named_col_names(df):
     return named_col_names
 
 
+def drop_duplicate_chunks(df, enable_qa=True):
+    dedup_config = DATAPARSER_CONFIG.get('dedup', {})
+    if not dedup_config.get('enable', False):
+        return df
+    # In qa mode, the same question of the same doc chunk is a duplicate
+    cols = ['question', 'doc_chunk'] if enable_qa else ['doc_chunk']
+    texts = df[cols].astype(str).agg('\n'.join, axis=1).tolist()
+    deduplicator = Deduplicator(near_dup=dedup_config.get('near_dup', False),
+                                max_distance=dedup_config.get('max_distance', 3))
+    keep = deduplicator.filter(texts)
+    print('skipped duplicate chunks =', len(df) - len(keep))
+    return df.iloc[keep].reset_index(drop=True)
+
+
 def get_embedding_array(df, enable_qa=True, batch_size=64):
     encoder = TextEncoder()
     original_col = get_named_col_names(df)
@@ -45,12 +61,13 @@ def get_embedding_array(df, enable_qa=True, batch_size=64):
     for i, question in enumerate(tqdm(df[emb_col])):
         q_list.append(question)
         if (i + 1) % batch_size == 0 or i == len(df) - 1:
-            batch_embeddings = encoder.embed_documents(q_list)
-            embeddings.extend(batch_embeddings)
+            batch_embeddings = encoder.embed_documents(q_list, as_array=True)
+            embeddings.append(batch_embeddings)
             q_list = []
     t2 = time.time()
     print('time = ', t2 - t1)
-    df['embedding'] = embeddings
+    # Rows are float32 views of one array instead of lists of Python floats
+    df['embedding'] = list(np.concatenate(embeddings))
     cols_to_save = original_col + ['embedding']
 
     embeddings_array = df[cols_to_save].to_numpy()
@@ -67,6 +84,7 @@ def save_embedding(csv_file, enable_qa=True, batch_size=64):
 
     if 'like' in df.columns:
         df = df.drop(labels='like', axis=1)
+    df = drop_duplicate_chunks(df, enable_qa=enable_qa)
     embedding_array = get_embedding_array(df, enable_qa=enable_qa, batch_size=batch_size)
     output_npy_path = f'{csv_file[:-4]}_embedding.npy'
     np.save(output_npy_path, embedding_array)
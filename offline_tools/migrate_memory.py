@@ -0,0 +1,37 @@
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--platform", type=str, default='towhee', choices=['towhee', 'langchain'],
+                        help='It is your option of platform to build the system.')
+    parser.add_argument("--projects", type=str, nargs='+', required=False,
+                        help='Projects to migrate, defaults to all tables with the per-project layout.')
+    parser.add_argument("--keep", action='store_true',
+                        help='Keep project tables after copying their history to the shared table.')
+    args = parser.parse_args()
+
+    if args.platform == 'langchain':
+        from langchain_src.store.memory_store.pg import MemoryStore
+
+        migrate = MemoryStore.migrate
+        legacy_tables = MemoryStore.legacy_tables
+    else:
+        from towhee_src.memory.sql import MemoryStore
+
+        memory_store = MemoryStore()
+        migrate = memory_store.migrate
+        legacy_tables = memory_store.legacy_tables
+
+    t0 = time.time()
+    projects = args.projects or legacy_tables()
+    for project in projects:
+        num = migrate(project, drop=not args.keep)
+        print(f'finish migrating chat history of {project}: {num} rows')
+    print(f'total time = {time.time() - t0} (s).')
@@ -0,0 +1,30 @@
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--platform", type=str, default='towhee', choices=['towhee', 'langchain'],
+                        help='It is your option of platform to build the system.')
+    parser.add_argument("--project_root", type=str, required=True,
+                        help='A folder containing your project docs, synced recursively.')
+    parser.add_argument("--project_name", type=str, required=True,
+                        help='It is your project name. It is also the collection_name in the vector database.')
+    parser.add_argument("--patterns", type=str, nargs='+', required=False,
+                        help='Glob patterns of files to sync, defaults to patterns in SYNC_CONFIG.')
+    args = parser.parse_args()
+
+    if args.platform == 'langchain':
+        from langchain_src.operations import sync
+    else:
+        from towhee_src.operations import sync
+
+    t0 = time.time()
+    res = sync(args.project_name, args.project_root, patterns=args.patterns)
+    print(f'finish syncing {args.project_root} to {args.project_name}: {res}')
+    print(f'total time = {time.time() - t0} (s).')
@@ -36,23 +36,25 @@ def langchain_load(npy_path, project, batch_size=128, enable_qa=True):
     row_ind = 0
     it = iter(reader)
     batch_rows = []
-    while True:
-        # print(row_ind)
-        try:
-            row = next(it)
-            # print(row)
-            batch_rows.append(row)
-            if (row_ind + 1) % batch_size == 0 or row_ind == len(reader) - 1:
-                data = [row[embedding_col_ind] for row in batch_rows]
-                if enable_qa:
-                    metadatas = [{'text': row[question_col_ind], 'doc': row[doc_chunk_col_ind]} for row in batch_rows]
-                else:
-                    metadatas = [{'text': row[doc_chunk_col_ind]} for row in batch_rows]
-                doc_db.insert_embeddings(data, metadatas)
-                batch_rows = []
-        except StopIteration:
-            break
-        row_ind += 1
+    # Refresh of the scalar index is disabled during the load, counts of both stores are checked at the end
+    with doc_db.bulk_load():
+        while True:
+            # print(row_ind)
+            try:
+                row = next(it)
+                # print(row)
+                batch_rows.append(row)
+                if (row_ind + 1) % batch_size == 0 or row_ind == len(reader) - 1:
+                    data = np.stack([row[embedding_col_ind] for row in batch_rows]).astype(np.float32)
+                    if enable_qa:
+                        metadatas = [{'text': row[question_col_ind], 'doc': row[doc_chunk_col_ind]} for row in batch_rows]
+                    else:
+                        metadatas = [{'text': row[doc_chunk_col_ind]} for row in batch_rows]
+                    doc_db.insert_embeddings(data, metadatas)
+                    batch_rows = []
+            except StopIteration:
+                break
+            row_ind += 1
     # print('row_ind = ', row_ind)
 
 
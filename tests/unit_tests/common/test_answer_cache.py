@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+from common import AnswerCache
+
+
+class TestAnswerCache(unittest.TestCase):
+    project = 'akcio_ut'
+
+    def test_lookup(self):
+        cache = AnswerCache(threshold=0.9, ttl=None, max_size=2)
+        assert cache.lookup(self.project, [1.0, 0.0]) is None
+
+        cache.add(self.project, [1.0, 0.0], 'answer a')
+        assert cache.lookup(self.project, [0.99, 0.05]) == 'answer a'
+        assert cache.lookup(self.project, [0.0, 1.0]) is None
+        assert cache.lookup('other_project', [1.0, 0.0]) is None
+
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 3
+
+    def test_max_size(self):
+        cache = AnswerCache(threshold=0.9, ttl=None, max_size=2)
+        cache.add(self.project, [1.0, 0.0, 0.0], 'a')
+        cache.add(self.project, [0.0, 1.0, 0.0], 'b')
+        cache.add(self.project, [0.0, 0.0, 1.0], 'c')
+        assert cache.lookup(self.project, [1.0, 0.0, 0.0]) is None
+        assert cache.lookup(self.project, [0.0, 0.0, 1.0]) == 'c'
+        assert cache.stats()['size'][self.project] == 2
+
+    def test_ttl(self):
+        cache = AnswerCache(threshold=0.9, ttl=0.01)
+        cache.add(self.project, [1.0, 0.0], 'a')
+        time.sleep(0.02)
+        assert cache.lookup(self.project, [1.0, 0.0]) is None
+
+    def test_invalidate(self):
+        cache = AnswerCache(threshold=0.9, ttl=None)
+        epoch = cache.epoch(self.project)
+        cache.add(self.project, [1.0, 0.0], 'a', epoch=epoch)
+        cache.invalidate(self.project)
+        assert cache.lookup(self.project, [1.0, 0.0]) is None
+
+        # Answer computed before invalidation is not cached
+        cache.add(self.project, [1.0, 0.0], 'stale', epoch=epoch)
+        assert cache.lookup(self.project, [1.0, 0.0]) is None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+from common import Deduplicator, simhash, content_hash
+
+
+class TestDeduplicator(unittest.TestCase):
+    text = ' '.join(f'word{i}' for i in range(200))
+
+    def test_exact(self):
+        deduplicator = Deduplicator()
+        texts = ['a b', 'c', 'a  b\n', 'd']
+        assert deduplicator.filter(texts) == [0, 1, 3]
+        assert deduplicator.filter(texts, stored=[content_hash('c')]) == [0, 3]
+
+    def test_near_dup(self):
+        near = self.text.replace('word100', 'changed')
+        assert bin(simhash(self.text) ^ simhash(near)).count('1') <= 3
+        assert Deduplicator().filter([self.text, near]) == [0, 1]
+        assert Deduplicator(near_dup=True).filter([self.text, near, 'other text']) == [0, 2]
+
+
+if __name__ == '__main__':
+    unittest.main()
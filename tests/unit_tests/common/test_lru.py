@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+from common import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        evicted = []
+        cache = LRUCache(max_size=2, on_evict=evicted.append)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1  # 'b' becomes least recently used
+        cache.put('c', 3)
+        assert 'b' not in cache
+        assert evicted == [2]
+        assert len(cache) == 2
+
+    def test_get_or_create(self):
+        cache = LRUCache(max_size=4)
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return object()
+
+        value = cache.get_or_create('k', factory)
+        assert cache.get_or_create('k', factory) is value
+        assert len(calls) == 1
+
+    def test_invalidate(self):
+        evicted = []
+        cache = LRUCache(max_size=8, on_evict=evicted.append)
+        cache.put(('p1', 's1'), 1)
+        cache.put(('p1', 's2'), 2)
+        cache.put(('p2', 's1'), 3)
+        assert cache.invalidate(lambda key: key[0] == 'p1') == 2
+        assert sorted(evicted) == [1, 2]
+        assert cache.get(('p2', 's1')) == 3
+        assert cache.pop(('p2', 's1')) == 3
+        assert len(cache) == 0
+
+
+if __name__ == '__main__':
+    unittest.main()
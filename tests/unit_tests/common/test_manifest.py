@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+from common import SyncManifest, scan_files, file_hash
+
+
+class TestSyncManifest(unittest.TestCase):
+    def test_diff(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_dir = os.path.join(tmp_dir, 'docs')
+            os.makedirs(os.path.join(data_dir, 'sub'))
+            paths = [os.path.join(data_dir, 'a.md'), os.path.join(data_dir, 'sub', 'b.md')]
+            for path in paths:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(path)
+            with open(os.path.join(data_dir, 'c.txt'), 'w', encoding='utf-8') as f:
+                f.write('c')
+            files = scan_files(data_dir, ['*.md'])
+            assert files == sorted(paths)
+
+            manifest = SyncManifest('test', path=tmp_dir)
+            changed, removed = manifest.diff(files)
+            assert changed == {x: file_hash(x) for x in paths} and removed == []
+            for path, content in changed.items():
+                manifest.update(path, content, ['chunk'])
+            manifest.save()
+
+            manifest = SyncManifest('test', path=tmp_dir)
+            assert manifest.chunks(paths[0]) == ['chunk']
+            assert manifest.diff(files) == ({}, [])
+
+            # Touched without changes
+            os.utime(paths[0], ns=(0, 0))
+            assert manifest.diff(files) == ({}, [])
+            with open(paths[0], 'a', encoding='utf-8') as f:
+                f.write('changed')
+            os.remove(paths[1])
+            changed, removed = manifest.diff(scan_files(data_dir, ['*.md']))
+            assert list(changed) == [paths[0]] and removed == [paths[1]]
+
+            SyncManifest.drop('test', path=tmp_dir)
+            assert SyncManifest('test', path=tmp_dir).files == {}
+
+
+if __name__ == '__main__':
+    unittest.main()
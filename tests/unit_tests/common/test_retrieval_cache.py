@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+from common import RetrievalCache, ProjectGenerations
+
+
+class TestRetrievalCache(unittest.TestCase):
+    def test_cache(self):
+        generations = ProjectGenerations()
+        cache = RetrievalCache(max_size=10, generations=generations)
+
+        key = cache.key('project', [0.6, 0.8], 10, 0.6)
+        assert cache.get(key) is None
+        cache.put(key, ['doc'])
+        # Float noise and scale of the embedding do not change the key
+        assert cache.get(cache.key('project', [1.2, 1.6000001], 10, 0.6)) == ['doc']
+        assert cache.get(cache.key('project', [0.6, 0.8], 5, 0.6)) is None
+        assert cache.get(cache.key('other', [0.6, 0.8], 10, 0.6)) is None
+
+        # Results are never served after the project generation changes
+        generations.bump('project')
+        assert cache.get(cache.key('project', [0.6, 0.8], 10, 0.6)) is None
+        cache.invalidate('project')
+        assert cache.stats()['size'] == 0
+        assert cache.stats()['hits'] == 1
+
+    def test_ttl(self):
+        cache = RetrievalCache(max_size=10, ttl=0.1, generations=ProjectGenerations())
+        key = cache.key('project', [0.6, 0.8], 10, 0.6)
+        cache.put(key, ['doc'])
+        assert cache.get(key) == ['doc']
+        # Changes of other processes are missed until results expire
+        time.sleep(0.2)
+        assert cache.get(key) is None
+
+
+if __name__ == '__main__':
+    unittest.main()
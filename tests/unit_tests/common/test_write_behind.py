@@ -0,0 +1,117 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../..'))
+
+from common import WriteBehindBuffer
+
+
+class MockStore:
+    def __init__(self):
+        self.rows = {}
+        self.batches = []
+        self.fail = False
+        self.written = threading.Event()
+
+    def write(self, project, batch):
+        if self.fail:
+            raise RuntimeError('mock failure')
+        self.batches.append((project, batch))
+        for session_id, messages in batch:
+            self.rows.setdefault((project, session_id), []).extend(messages)
+        self.written.set()
+
+    def read(self, project, session_id):
+        return list(self.rows.get((project, session_id), []))
+
+
+class TestWriteBehindBuffer(unittest.TestCase):
+    def test_batch_by_rows(self):
+        store = MockStore()
+        buffer = WriteBehindBuffer(store.write, interval=60, max_rows=3)
+        buffer.add('p1', 's1', [('q0', 'a0')])
+        buffer.add('p1', 's2', [('q1', 'a1')])
+        buffer.add('p2', 's1', [('q2', 'a2')])
+        assert store.written.wait(2)
+        buffer.close()
+        # One batch per project with all its sessions
+        assert sorted(x[0] for x in store.batches) == ['p1', 'p2']
+        assert [len(x[1]) for x in store.batches if x[0] == 'p1'] == [2]
+        assert buffer.pending() == 0
+
+    def test_batch_by_interval(self):
+        store = MockStore()
+        buffer = WriteBehindBuffer(store.write, interval=0.1, max_rows=100)
+        buffer.add('p1', 's1', [('q0', 'a0')])
+        assert store.written.wait(2)
+        assert store.read('p1', 's1') == [('q0', 'a0')]
+        buffer.close()
+
+    def test_read_your_writes(self):
+        store = MockStore()
+        buffer = WriteBehindBuffer(store.write, interval=60, max_rows=100)
+        buffer.add('p1', 's1', [('q0', 'a0')])
+        buffer.flush()
+        buffer.add('p1', 's1', [('q1', 'a1')])
+        buffer.add('p1', 's2', [('x', 'y')])
+        read = lambda: store.read('p1', 's1')
+        assert buffer.read('p1', 's1', read) == [('q0', 'a0'), ('q1', 'a1')]
+        buffer.flush()
+        assert buffer.read('p1', 's1', read) == [('q0', 'a0'), ('q1', 'a1')]
+        buffer.close()
+
+    def test_read_during_flush(self):
+        store = MockStore()
+        release = threading.Event()
+        writing = threading.Event()
+
+        def slow_write(project, batch):
+            writing.set()
+            assert release.wait(2)
+            store.write(project, batch)
+
+        buffer = WriteBehindBuffer(slow_write, interval=60, max_rows=100)
+        buffer.add('p1', 's1', [('q0', 'a0')])
+        flush = threading.Thread(target=buffer.flush)
+        flush.start()
+        assert writing.wait(2)
+        read = lambda: store.read('p1', 's1')
+        # Reads do not wait for the write and include the messages being written
+        assert buffer.read('p1', 's1', read) == [('q0', 'a0')]
+        assert buffer.pending('p1') == 1
+
+        # A commit while reading the store is read again, not returned twice
+        reads = []
+        def commit_and_read():
+            if not reads:
+                release.set()
+                flush.join()
+            reads.append(read())
+            return reads[-1]
+        assert buffer.read('p1', 's1', commit_and_read) == [('q0', 'a0')]
+        assert len(reads) == 2
+        assert buffer.pending('p1') == 0
+        buffer.close()
+
+    def test_failure_and_close(self):
+        store = MockStore()
+        store.fail = True
+        buffer = WriteBehindBuffer(store.write, interval=60, max_rows=100)
+        buffer.add('p1', 's1', [('q0', 'a0')])
+        buffer.flush()
+        # Failed messages stay buffered and visible, in order with later ones
+        buffer.add('p1', 's1', [('q1', 'a1')])
+        assert buffer.pending('p1') == 2
+        assert buffer.read('p1', 's1', lambda: []) == [('q0', 'a0'), ('q1', 'a1')]
+        assert buffer.stats['errors'] == 1
+
+        store.fail = False
+        buffer.close()
+        assert store.read('p1', 's1') == [('q0', 'a0'), ('q1', 'a1')]
+        assert buffer.pending() == 0
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+from langchain_src.agent import FinalAnswerStreamHandler
+
+
+class TestFinalAnswerStreamHandler(unittest.TestCase):
+    final_answer = '```json\n{\n    "action": "Final Answer",\n    "action_input": "Say \\"hi\\"\\nto \\u00e9 bot"\n}\n```'
+    tool_action = '```json\n{\n    "action": "Search",\n    "action_input": "towhee"\n}\n```'
+
+    @staticmethod
+    def stream(handler, text, step=3):
+        async def run():
+            await handler.on_llm_start({}, [])
+            for i in range(0, len(text), step):
+                await handler.on_llm_new_token(text[i:i + step])
+            tokens = []
+            while not handler.queue.empty():
+                tokens.append(await handler.queue.get())
+            return tokens
+        return asyncio.run(run())
+
+    def test_final_answer(self):
+        handler = FinalAnswerStreamHandler()
+        tokens = self.stream(handler, self.final_answer)
+        assert len(tokens) > 1
+        assert ''.join(tokens) == 'Say "hi"\nto é bot'
+        assert handler.streamed
+
+    def test_tool_action(self):
+        handler = FinalAnswerStreamHandler()
+        tokens = self.stream(handler, self.tool_action)
+        assert tokens == []
+        assert not handler.streamed
+
+
+if __name__ == '__main__':
+    unittest.main()
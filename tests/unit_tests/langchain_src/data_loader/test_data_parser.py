@@ -11,6 +11,8 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../../../..'))
 
 from langchain_src.data_loader import DataParser
+from langchain_src.data_loader.url_fetcher import URLFetcher
+from common import content_hash
 
 
 class TestDataParser(unittest.TestCase):
@@ -27,11 +29,19 @@ class TestDataParser(unittest.TestCase):
             assert output == ['ab', 'cd']
 
     def test_call_from_urls(self):
-        with patch('langchain.document_loaders.UnstructuredURLLoader.load') as mock_url_loader:
-            mock_url_loader.return_value = [Document(page_content='ab\ncd', metadata={})]
+        with patch.object(URLFetcher, 'iter_fetch') as mock_url_loader:
+            mock_url_loader.return_value = [[Document(page_content='ab\ncd', metadata={})]]
             output = self.data_parser('www.mockurl.com', source_type='url')
             assert output == ['ab', 'cd']
 
+    def test_load_documents(self):
+        with patch.object(URLFetcher, 'iter_fetch') as mock_url_loader:
+            mock_url_loader.return_value = [[Document(page_content='ab\ncd', metadata={'source': 'www.mockurl.com'})]]
+            docs = self.data_parser.load_documents('www.mockurl.com', source_type='url')
+            assert docs[0].page_content == 'ab'
+            for doc in docs:
+                assert doc.metadata == {'source': 'www.mockurl.com', 'content_hash': content_hash(doc.page_content)}
+
 
 if __name__ == '__main__':
     unittest.main()
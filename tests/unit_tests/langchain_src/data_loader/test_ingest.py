@@ -0,0 +1,83 @@
+import os
+import sys
+import unittest
+from contextlib import nullcontext
+
+import numpy
+from langchain.docstore.document import Document
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+from langchain_src.data_loader import IngestPipeline
+from common import Deduplicator, content_hash
+
+
+class MockParser:
+    def __init__(self, sources, fail_at=None):
+        self.sources = sources
+        self.fail_at = fail_at
+
+    def iter_documents(self, data_src, source_type='file'):
+        for src in data_src:
+            if src == self.fail_at:
+                raise RuntimeError(f'Failed to load {src}')
+            yield [Document(page_content=x, metadata={'source': src, 'content_hash': content_hash(x)})
+                   for x in self.sources[src]]
+
+
+class MockEncoder:
+    def embed_documents(self, texts, as_array=False):
+        return numpy.ones((len(texts), 2), dtype=numpy.float32)
+
+
+class MockDocStore:
+    def __init__(self):
+        self.batches = []
+
+    def bulk_load(self):
+        return nullcontext(self)
+
+    def insert_embeddings(self, data, metadatas):
+        assert len(data) == len(metadatas)
+        self.batches.append([m['text'] for m in metadatas])
+        return len(metadatas)
+
+    def dedup(self, data, metadatas, deduplicator, seen=None):
+        # Duplicates are found within a source
+        hashes = [(m['source'], m['content_hash']) for m in metadatas]
+        keep = deduplicator.filter(data, hashes=hashes, stored=seen)
+        seen.update(hashes[i] for i in keep)
+        return [data[i] for i in keep], [metadatas[i] for i in keep], len(data) - len(keep)
+
+
+class TestIngestPipeline(unittest.TestCase):
+    sources = {'a': ['1', '2', '3'], 'b': ['4', '2', '5', '4', '6']}
+
+    def test_run(self):
+        doc_db = MockDocStore()
+        progress = []
+        pipeline = IngestPipeline(MockParser(self.sources), doc_db, MockEncoder(), batch_size=2,
+                                  memory_budget_mb=0, progress=progress.append)
+        assert pipeline.queue_size == 1
+        res = pipeline.run(['a', 'b'])
+        assert res == {'inserted': 8, 'skipped': 0}
+        assert doc_db.batches == [['1', '2'], ['3', '4'], ['2', '5'], ['4', '6']]
+        assert [x['inserted'] for x in progress] == [2, 4, 6, 8, 8]
+        assert progress[-1]['sources'] == 2
+
+        doc_db = MockDocStore()
+        pipeline = IngestPipeline(MockParser(self.sources), doc_db, MockEncoder(), deduplicator=Deduplicator(),
+                                  batch_size=2, progress=lambda x: None)
+        assert pipeline.run(['a', 'b']) == {'inserted': 7, 'skipped': 1}
+        # Duplicates of earlier batches of the source are skipped too, chunks of other sources are not
+        assert doc_db.batches == [['1', '2'], ['3', '4'], ['2', '5'], ['6']]
+
+    def test_error(self):
+        pipeline = IngestPipeline(MockParser(self.sources, fail_at='b'), MockDocStore(), MockEncoder(),
+                                  batch_size=2, progress=lambda x: None)
+        with self.assertRaises(RuntimeError):
+            pipeline.run(['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
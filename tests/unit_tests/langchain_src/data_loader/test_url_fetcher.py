@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+from langchain_src.data_loader.url_fetcher import URLFetcher
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_GET(self):  # pylint: disable=C0103
+        with self.lock:
+            MockHandler.active += 1
+            MockHandler.max_active = max(MockHandler.max_active, MockHandler.active)
+        time.sleep(0.05)
+        with self.lock:
+            MockHandler.active -= 1
+        if self.path == '/missing':
+            self.send_response(404)
+            self.end_headers()
+            return
+        etag = f'"{self.path}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = f'page {self.path}'.encode('utf-8')
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestURLFetcher(unittest.TestCase):
+    def test_fetch(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host = f'http://127.0.0.1:{server.server_address[1]}'
+        urls = [f'{host}/{i}' for i in range(6)] + [f'{host}/missing']
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir, \
+                    patch('langchain_src.data_loader.url_fetcher.html_to_text', side_effect=lambda x: x.upper()):
+                fetcher = URLFetcher(max_workers=8, max_per_host=2, retries=0, cache_path=tmp_dir, parse_workers=0)
+                res = list(fetcher.iter_fetch(urls))
+                assert [[doc.page_content for doc in docs] for docs in res] == \
+                    [[f'PAGE /{i}'] for i in range(6)] + [[]]
+                assert res[0][0].metadata == {'source': urls[0]}
+                assert fetcher.stats == {'fetched': 6, 'not_modified': 0, 'failed': 1}
+                assert MockHandler.max_active <= 2
+
+                # Pages not modified are served from the cache of the last run
+                fetcher = URLFetcher(max_workers=8, retries=0, cache_path=tmp_dir, parse_workers=0)
+                docs = fetcher.fetch(urls[:3])
+                assert [doc.page_content for doc in docs] == ['PAGE /0', 'PAGE /1', 'PAGE /2']
+                assert fetcher.stats == {'fetched': 0, 'not_modified': 3, 'failed': 0}
+                fetcher.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+from langchain_src.embedding.batcher import EmbeddingBatcher
+
+
+class TestEmbeddingBatcher(unittest.TestCase):
+    def test_batch(self):
+        batches = []
+
+        def embed_func(texts):
+            batches.append(texts)
+            return numpy.array([[float(x), 0.0] for x in texts], dtype=numpy.float32)
+
+        batcher = EmbeddingBatcher(embed_func, max_batch_size=4, max_wait_ms=200)
+        with ThreadPoolExecutor(8) as pool:
+            res = list(pool.map(batcher.embed, [str(i) for i in range(8)]))
+        batcher.close()
+
+        # Every caller gets the row of its own text
+        assert [x[0] for x in res] == list(range(8))
+        assert sum(len(x) for x in batches) == 8
+        assert max(len(x) for x in batches) <= 4
+        assert len(batches) < 8
+
+        stats = batcher.stats()
+        assert stats['requests'] == 8
+        assert stats['batches'] == len(batches)
+        assert stats['max_batch_size'] == max(len(x) for x in batches)
+        assert stats['max_queue_ms'] >= stats['avg_queue_ms'] > 0
+
+    def test_error(self):
+        def embed_func(texts):
+            raise ValueError('mock error')
+
+        batcher = EmbeddingBatcher(embed_func, max_wait_ms=0)
+        with self.assertRaises(ValueError):
+            batcher.embed('hello')
+        batcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import atexit
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+from langchain_src.embedding.cache import EmbeddingCache
+
+
+class MockSentenceTransformer:
+    calls = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def encode(self, texts, **kwargs):
+        self.calls.append(texts)
+        if isinstance(texts, str):
+            return numpy.array([3.0, 4.0], dtype=numpy.float32)
+        return numpy.array([[3.0, 4.0]] * len(texts), dtype=numpy.float32)
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_lru(self):
+        cache = EmbeddingCache(max_size=2)
+        k1, k2, k3 = [cache.key('model', t) for t in ['a', 'b', 'c']]
+        cache.put(k1, [1.0, 0.0])
+        cache.put(k2, [0.0, 1.0])
+        assert cache.get(k1).tolist() == [1.0, 0.0]
+        cache.put(k3, [1.0, 1.0])
+        assert cache.get(k2) is None
+        assert cache.get(k3).dtype == numpy.float32
+        assert len(cache) == 2
+
+    def test_key(self):
+        assert EmbeddingCache.key('m', ' hello \n world') == EmbeddingCache.key('m', 'hello world')
+        assert EmbeddingCache.key('m', 'hello') != EmbeddingCache.key('other', 'hello')
+        assert EmbeddingCache.key('m', 'hello', norm=True) != EmbeddingCache.key('m', 'hello')
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'cache.npz')
+            cache = EmbeddingCache(max_size=4, path=path)
+            key = cache.key('model', 'question')
+            cache.put(key, [0.5, 0.5])
+            cache.save()
+
+            new_cache = EmbeddingCache(max_size=4, path=path)
+            assert new_cache.get(key).tolist() == [0.5, 0.5]
+
+            atexit.unregister(cache._save_at_exit)
+            atexit.unregister(new_cache._save_at_exit)
+
+    def test_text_encoder(self):
+        mock_module = MagicMock(SentenceTransformer=MockSentenceTransformer)
+        with patch.dict(sys.modules, {'sentence_transformers': mock_module}):
+            from langchain_src.embedding import TextEncoder
+
+            encoder = TextEncoder(embedding_cache=EmbeddingCache(max_size=4))
+            MockSentenceTransformer.calls.clear()
+            embed = encoder.embed_query('hello', norm=True)
+            assert numpy.allclose(embed, [0.6, 0.8])
+            assert encoder.embed_query('hello ', norm=True) == embed
+            assert len(MockSentenceTransformer.calls) == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch, MagicMock
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+
+class MockSentenceTransformer:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def encode(self, texts, **kwargs):
+        return numpy.array([[3.0, 4.0], [0.0, 2.0]][:len(texts)], dtype=numpy.float64)
+
+
+class TestTextEncoder(unittest.TestCase):
+    def test_embed_documents(self):
+        mock_module = MagicMock(SentenceTransformer=MockSentenceTransformer)
+        with patch.dict(sys.modules, {'sentence_transformers': mock_module}):
+            from langchain_src.embedding.langchain_huggingface import TextEncoder
+
+            encoder = TextEncoder(embedding_cache=None)
+            embeds = encoder.embed_documents(['hello', 'world'], norm=True)
+            assert isinstance(embeds, list)
+            assert numpy.allclose(embeds, [[0.6, 0.8], [0.0, 1.0]])
+
+            embeds = encoder.embed_documents(['hello', 'world'], norm=True, as_array=True)
+            assert isinstance(embeds, numpy.ndarray)
+            assert embeds.dtype == numpy.float32
+            assert embeds.flags['C_CONTIGUOUS']
+            assert numpy.allclose(embeds, [[0.6, 0.8], [0.0, 1.0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+
+class MockTokenizer:
+    def __call__(self, texts, **kwargs):
+        max_len = max(len(x.split()) for x in texts)
+        mask = numpy.array([[1] * len(x.split()) + [0] * (max_len - len(x.split())) for x in texts])
+        return {'input_ids': mask.copy(), 'attention_mask': mask}
+
+
+class MockSession:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_inputs(self):
+        return [SimpleNamespace(name='input_ids'), SimpleNamespace(name='attention_mask')]
+
+    def run(self, output_names, inputs):
+        # Token embedding is [1, 0] for the first token and [0, 1] for others
+        ids = inputs['input_ids']
+        token_embeds = numpy.zeros(ids.shape + (2,), dtype=numpy.float32)
+        token_embeds[:, 0, 0] = 1
+        token_embeds[:, 1:, 1] = 1
+        return [token_embeds]
+
+
+class TestOnnxEncoder(unittest.TestCase):
+    def test_embed(self):
+        mock_ort = MagicMock(InferenceSession=MockSession)
+        mock_transformers = MagicMock()
+        mock_transformers.AutoTokenizer.from_pretrained.return_value = MockTokenizer()
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                patch.dict(sys.modules, {'onnxruntime': mock_ort, 'transformers': mock_transformers}):
+            open(os.path.join(tmp_dir, 'model.onnx'), 'wb').close()
+            with open(os.path.join(tmp_dir, 'encoder_config.json'), 'w', encoding='utf-8') as f:
+                json.dump({'model': 'test-model', 'dim': 2, 'max_length': 8, 'pooling': 'mean', 'normalize': False}, f)
+
+            from langchain_src.embedding.onnx_encoder import TextEncoder
+
+            encoder = TextEncoder(model_name='test-model', onnx_path=tmp_dir, batch_size=1, embedding_cache=None)
+            embeds = encoder.embed_documents(['a b c d', 'a', 'a b'], as_array=True, norm=False)
+            assert embeds.dtype == numpy.float32
+            # Mean pooling skips padded tokens and keeps the input order
+            assert numpy.allclose(embeds, [[0.25, 0.75], [1.0, 0.0], [0.5, 0.5]])
+
+            embed = encoder.embed_query('a b', norm=True)
+            assert numpy.allclose(embed, [0.5 ** 0.5, 0.5 ** 0.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,6 +25,34 @@ class TestERNIE(unittest.TestCase):
             res = chat_llm._generate(messages)
             self.assertEqual(res.generations[0].text, 'mock answer')
 
+    def test_generate_streaming(self):
+        class MockStreamResponse:
+            def iter_lines(self):
+                return [
+                    b'data: {"result": "mock ", "is_end": false}',
+                    b'',
+                    b'data: {"result": "answer", "is_end": true, "usage": 2}',
+                ]
+
+        class MockRunManager:
+            tokens = []
+
+            def on_llm_new_token(self, token):
+                self.tokens.append(token)
+
+        with patch('requests.post') as mock_post, patch('requests.request') as mock_request:
+            mock_res1 = Response()
+            mock_res1._content = b'{ "access_token" : "mock_token" }'
+            mock_post.return_value = mock_res1
+            mock_request.return_value = MockStreamResponse()
+            from langchain_src.llm.ernie import ChatLLM
+
+            chat_llm = ChatLLM(api_key='mock-key', secret_key='mock-key', streaming=True)
+            run_manager = MockRunManager()
+            res = chat_llm._generate([HumanMessage(content='hello')], run_manager=run_manager)
+            self.assertEqual(run_manager.tokens, ['mock ', 'answer'])
+            self.assertEqual(res.generations[0].text, 'mock answer')
+
 
 if __name__ == '__main__':
     unittest.main()
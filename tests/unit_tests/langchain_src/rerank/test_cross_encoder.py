@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch, MagicMock
+
+from langchain.docstore.document import Document
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+
+class MockCrossEncoder:
+    pairs = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def predict(self, pairs, **kwargs):
+        self.pairs.extend(pairs)
+        # Score is the fraction of query words in doc
+        return [len(set(q.split()) & set(d.split())) / len(q.split()) for q, d in pairs]
+
+
+class TestReranker(unittest.TestCase):
+    def test_rerank(self):
+        mock_module = MagicMock(CrossEncoder=MockCrossEncoder)
+        with patch.dict(sys.modules, {'sentence_transformers': mock_module}):
+            from langchain_src.rerank import Reranker
+
+            reranker = Reranker(threshold=0.5, top_n=2, cache_size=10)
+            docs = [Document(page_content=x) for x in ['a b', 'a', 'c', 'a b c']]
+            res = reranker.rerank('a b c', docs)
+            assert [x.page_content for x in res] == ['a b c', 'a b']
+
+            # Scores are cached by query and doc
+            MockCrossEncoder.pairs.clear()
+            reranker.rerank('a b c', docs + [Document(page_content='b c')])
+            assert MockCrossEncoder.pairs == [('a b c', 'b c')]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+import os
+import sys
+import asyncio
+import unittest
+from contextlib import contextmanager, asynccontextmanager
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../../..'))
+
+from langchain_src.store.memory_store import pg
+from langchain_src.store.memory_store.pg import MemoryStore, pool_stats
+
+
+class MockCursor:
+    def __init__(self, pool):
+        self.pool = pool
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        self.pool.queries.append(query)
+        if query.startswith('SELECT message'):
+            # Rows are selected by (session_id,), or (project, session_id) in the shared table
+            n = 2 if 'project = %s' in query else 1
+            self.rows = [{'message': m} for k, m in self.pool.rows if k == tuple(params[:n])]
+            if len(params) > n:
+                self.rows = self.rows[-params[n]:]
+        return self
+
+    def executemany(self, query, rows):
+        self.pool.queries.append(query)
+        self.pool.rows += [(tuple(x[:-1]), pg.json.loads(x[-1])) for x in rows]
+
+    def fetchall(self):
+        return self.rows
+
+
+class MockPool:
+    '''Records queries and connections borrowed, keeps inserted rows in memory.'''
+    def __init__(self):
+        self.queries = []
+        self.rows = []
+        self.borrowed = 0
+
+    @contextmanager
+    def connection(self):
+        self.borrowed += 1
+        yield self
+
+    def cursor(self):
+        return MockCursor(self)
+
+    def execute(self, query, params=None):
+        return MockCursor(self).execute(query, params)
+
+
+class MockAsyncCursor:
+    '''Async cursor over the rows of a MockPool.'''
+    def __init__(self, pool):
+        self.cursor = MockCursor(pool)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def execute(self, query, params=None):
+        self.cursor.execute(query, params)
+        return self
+
+    async def executemany(self, query, rows):
+        self.cursor.executemany(query, rows)
+
+    async def fetchall(self):
+        return self.cursor.fetchall()
+
+
+class MockAsyncPool:
+    '''Async pool over the rows of a MockPool, records the loops it is used in.'''
+    def __init__(self, pool):
+        self.pool = pool
+        self.loops = set()
+
+    @asynccontextmanager
+    async def connection(self):
+        self.loops.add(asyncio.get_running_loop())
+        self.pool.borrowed += 1
+        yield self
+
+    def cursor(self):
+        return MockAsyncCursor(self.pool)
+
+    async def execute(self, query, params=None):
+        return await MockAsyncCursor(self.pool).execute(query, params)
+
+
+def mock_pools(pool, async_pool):
+    async def get_async_pool(*args):
+        return async_pool
+
+    return patch.object(pg, 'get_pool', lambda *args: pool), patch.object(pg, 'get_async_pool', get_async_pool)
+
+
+class TestMemoryStore(unittest.TestCase):
+    def test_pooled_history(self):
+        pool = MockPool()
+        async_pool = MockAsyncPool(pool)
+        patch_pool, patch_async_pool = mock_pools(pool, async_pool)
+        with patch_pool, patch_async_pool:
+            memory = MemoryStore(table_name='akcio_ut', session_id='test000')
+            memory.add_history([{'question': 'q0', 'answer': 'a0'}])
+            asyncio.run(memory.aadd_history([{'question': 'q1', 'answer': 'a1'}]))
+            # Table and index are created by the first write only, each write borrows one connection
+            assert len([x for x in pool.queries if 'CREATE' in x]) == 2
+            assert pool.borrowed == 2
+
+            assert memory.get_history() == [('q0', 'a0'), ('q1', 'a1')]
+            assert memory.get_history(limit=1) == [('q1', 'a1')]
+            assert asyncio.run(memory.aget_history(limit=1)) == [('q1', 'a1')]
+            assert 'LIMIT' in pool.queries[-1]
+            # Async reads & writes run on the async pool, not in threads
+            assert asyncio.run(memory.aget_history()) == [('q0', 'a0'), ('q1', 'a1')]
+            assert len(async_pool.loops) == 3
+
+            other = MemoryStore(table_name='akcio_ut', session_id='test001')
+            assert other.get_history() == []
+            assert len(memory.memory.load_memory_variables({})['chat_history']) == 4
+
+    def test_write_behind(self):
+        pool = MockPool()
+        patch_pool, patch_async_pool = mock_pools(pool, MockAsyncPool(pool))
+        with patch_pool, patch_async_pool, \
+                patch.object(pg, '_BUFFERS', {}), \
+                patch.dict(pg.WRITE_BEHIND_CONFIG, {'enable': True, 'interval': 60, 'max_rows': 100}):
+            memory = MemoryStore(table_name='akcio_ut', session_id='test000')
+            other = MemoryStore(table_name='akcio_ut', session_id='test001')
+            assert memory.history_db.write_buffer is other.history_db.write_buffer
+            memory.add_history([{'question': 'q0', 'answer': 'a0'}])
+            other.add_history([{'question': 'x', 'answer': 'y'}])
+            assert pool.rows == []
+            assert memory.get_history(limit=1) == [('q0', 'a0')]
+            assert asyncio.run(memory.aget_history()) == [('q0', 'a0')]
+
+            # Sessions of a table are written in one insert
+            memory.history_db.write_buffer.flush()
+            assert len([x for x in pool.queries if x.startswith('INSERT')]) == 1
+            assert memory.get_history() == [('q0', 'a0')]
+            assert asyncio.run(other.aget_history()) == [('x', 'y')]
+            memory.history_db.write_buffer.close()
+
+    def test_shared_table(self):
+        pool = MockPool()
+        with patch.object(pg, 'get_pool', lambda *args: pool), \
+                patch.object(pg, 'SHARED_TABLE', 'chat_history'), \
+                patch.object(pg, 'PARTITIONS', 4):
+            memory = MemoryStore(table_name='akcio_ut', session_id='test000')
+            other = MemoryStore(table_name='akcio_ut_other', session_id='test000')
+            memory.add_history([{'question': 'q0', 'answer': 'a0'}, {'question': 'q1', 'answer': 'a1'}])
+            other.add_history([{'question': 'x', 'answer': 'y'}])
+            # Projects share one table partitioned by project, created by the first write of each store
+            creates = [x for x in pool.queries if 'CREATE' in x]
+            assert 'PARTITION BY HASH (project)' in creates[0]
+            assert len(creates) == 10 and all('chat_history' in x for x in creates)
+            assert 'chat_history_p3 PARTITION OF chat_history' in creates[4]
+            assert pool.rows[0][0] == ('akcio_ut', 'test000')
+
+            assert memory.get_history() == [('q0', 'a0'), ('q1', 'a1')]
+            assert memory.get_history(limit=1) == [('q1', 'a1')]
+            assert other.get_history() == [('x', 'y')]
+            assert 'project = %s AND session_id = %s' in pool.queries[-1]
+
+    def test_async_pool_per_loop(self):
+        async def get_pools():
+            try:
+                return await pg.get_async_pool('postgresql://localhost:1/none'), \
+                    await pg.get_async_pool('postgresql://localhost:1/none')
+            finally:
+                await pg.close_async_pools()
+
+        with patch.dict(pg.POOL_CONFIG, {'min_size': 0}):
+            first = asyncio.run(get_pools())
+            second = asyncio.run(get_pools())
+        # One pool per event loop, closed before its loop ends
+        assert first[0] is first[1] and first[0] is not second[0]
+        assert first[0].closed and second[0].closed
+        assert len(pg._ASYNC_POOLS) == 0
+
+    def test_pool_stats(self):
+        assert pool_stats('postgresql://not_opened') == {'open': False}
+
+
+if __name__ == '__main__':
+    unittest.main()
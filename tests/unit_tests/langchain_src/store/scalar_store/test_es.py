@@ -0,0 +1,95 @@
+import os
+import sys
+import asyncio
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../../..'))
+
+from langchain_src.store.scalar_store import es
+from langchain_src.store.scalar_store.es import ScalarStore, close_async_client
+
+
+class MockIndices:
+    '''Keeps the refresh interval of indices, records refreshes.'''
+    def __init__(self):
+        self.intervals = {'akcio_ut': '5s'}
+        self.refreshes = 0
+
+    def exists(self, index):
+        return True
+
+    def put_mapping(self, index, properties):
+        pass
+
+    def get_settings(self, index, name):
+        return {index: {'settings': {'index': {'refresh_interval': self.intervals.get(index)}}}}
+
+    def put_settings(self, index, settings):
+        self.intervals[index] = settings['index']['refresh_interval']
+
+    def refresh(self, index):
+        self.refreshes += 1
+
+
+class MockClient:
+    def __init__(self):
+        self.indices = MockIndices()
+
+
+class MockAsyncClient:
+    '''Fails like an aiohttp client used in another event loop than its first one.'''
+    def __init__(self, **kwargs):
+        self.loop = None
+        self.closed = False
+
+    async def search(self, index, body):
+        loop = asyncio.get_running_loop()
+        assert self.loop in (None, loop) and not self.closed, 'Event loop is closed'
+        self.loop = loop
+        return {'hits': {'hits': [{'_source': {'content': body['query']['match']['content']}}]}}
+
+    async def close(self):
+        self.closed = True
+
+
+class TestScalarStore(unittest.TestCase):
+    def test_overlapping_bulk_loads(self):
+        client = MockClient()
+        first = ScalarStore(index_name='akcio_ut', client=client)
+        second = ScalarStore(index_name='akcio_ut', client=client)
+
+        first_load = first.bulk_load()
+        first_load.__enter__()
+        assert client.indices.intervals['akcio_ut'] == '-1'
+        with second.bulk_load():
+            assert client.indices.intervals['akcio_ut'] == '-1'
+        # Refresh stays off until the last load ends
+        assert client.indices.intervals['akcio_ut'] == '-1'
+        assert client.indices.refreshes == 0
+        first_load.__exit__(None, None, None)
+        assert client.indices.intervals['akcio_ut'] == '5s'
+        assert client.indices.refreshes == 1
+
+        with first.bulk_load():
+            assert client.indices.intervals['akcio_ut'] == '-1'
+        assert client.indices.intervals['akcio_ut'] == '5s'
+
+    def test_async_client_per_loop(self):
+        store = ScalarStore(index_name='akcio_ut', client=MockClient())
+
+        async def search(query):
+            try:
+                return await store.asearch(query)
+            finally:
+                await close_async_client()
+
+        with patch.object(es.elasticsearch, 'AsyncElasticsearch', MockAsyncClient):
+            # Each asyncio.run has its own loop and client
+            assert asyncio.run(search('a'))[0].page_content == 'a'
+            assert asyncio.run(search('b'))[0].page_content == 'b'
+        assert len(es._ASYNC_CLIENTS) == 0
+
+
+if __name__ == '__main__':
+    unittest.main()
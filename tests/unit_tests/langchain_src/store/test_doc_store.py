@@ -0,0 +1,258 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+from contextlib import contextmanager
+from unittest.mock import patch
+
+import numpy
+
+from langchain.docstore.document import Document
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+from langchain_src.store import DocStore, LocalVectorStore
+from common import RetrievalCache, ProjectGenerations, Deduplicator, content_hash
+from langchain_src.store.fusion import reciprocal_rank_fusion
+
+
+class MockStore:
+    def __init__(self, contents, delay=0):
+        self.contents = contents
+        self.delay = delay
+        self.embeddings = []
+
+    def search(self, query, **kwargs):
+        self.embeddings.append(kwargs.get('embedding'))
+        time.sleep(self.delay)
+        return [Document(page_content=x) for x in self.contents]
+
+    async def asearch(self, query, **kwargs):
+        self.embeddings.append(kwargs.get('embedding'))
+        await asyncio.sleep(self.delay)
+        return [Document(page_content=x) for x in self.contents]
+
+    def search_batch(self, queries):
+        return [[Document(page_content=f'{query} {x}') for x in self.contents] for query in queries]
+
+
+def mock_doc_store(vector_db, scalar_db, reranker=None):
+    doc_db = DocStore.__new__(DocStore)
+    doc_db.table_name = 'test'
+    doc_db.reranker = reranker
+    doc_db.retrieval_cache = None
+    doc_db.vector_db = vector_db
+    doc_db.scalar_db = scalar_db
+    doc_db.search_timeouts = {}
+    doc_db._timeout_lock = threading.Lock()
+    return doc_db
+
+
+class TestDocStore(unittest.TestCase):
+    def test_fusion(self):
+        results = {
+            'vector': [Document(page_content=x) for x in ['a', 'b', 'c', 'a']],
+            'scalar': [Document(page_content=x) for x in ['c', 'd']]
+        }
+        docs = reciprocal_rank_fusion(results)
+        # 'c' is found by both stores
+        assert [x.page_content for x in docs] == ['c', 'a', 'b', 'd']
+
+        docs = reciprocal_rank_fusion(results, weights={'scalar': 0})
+        assert [x.page_content for x in docs] == ['a', 'b', 'c', 'd']
+
+    def test_search(self):
+        doc_db = mock_doc_store(MockStore(['a', 'b']), MockStore(['b', 'c']))
+        assert [x.page_content for x in doc_db.search('query')] == ['b', 'a', 'c']
+        assert [x.page_content for x in asyncio.run(doc_db.asearch('query'))] == ['b', 'a', 'c']
+
+    def test_search_batch(self):
+        doc_db = mock_doc_store(MockStore(['a', 'b']), MockStore(['b', 'c']))
+        res = doc_db.search_batch(['x', 'y', 'z'], batch_size=2)
+        assert [[doc.page_content for doc in docs] for docs in res] == [
+            ['x b', 'x a', 'x c'], ['y b', 'y a', 'y c'], ['z b', 'z a', 'z c']]
+
+    def test_search_timeout(self):
+        doc_db = mock_doc_store(MockStore(['a', 'b']), MockStore(['c'], delay=0.5))
+        with patch('langchain_src.store.SEARCH_TIMEOUT', {'vector': 1, 'scalar': 0.05}):
+            assert [x.page_content for x in doc_db.search('query')] == ['a', 'b']
+            assert [x.page_content for x in asyncio.run(doc_db.asearch('query'))] == ['a', 'b']
+        assert doc_db.search_timeouts == {'scalar': 2}
+
+    def test_retrieval_cache(self):
+        class MockEncoder:
+            calls = 0
+
+            def embed_query(self, text):
+                self.calls += 1
+                return [1.0, 0.0]
+
+        vector_db, scalar_db = MockStore(['a']), MockStore(['b'], delay=0.5)
+        doc_db = mock_doc_store(vector_db, scalar_db)
+        doc_db.embedding_func = MockEncoder()
+        generations = ProjectGenerations()
+        doc_db.retrieval_cache = RetrievalCache(generations=generations)
+
+        with patch('langchain_src.store.SEARCH_TIMEOUT', {'vector': 1, 'scalar': 0.05}):
+            # Partial results are not cached
+            assert [x.page_content for x in doc_db.search('query')] == ['a']
+            assert doc_db.retrieval_cache.stats()['size'] == 0
+        assert [x.page_content for x in doc_db.search('query')] == ['a', 'b']
+        assert doc_db.retrieval_cache.stats()['size'] == 1
+        # The query is encoded once, for the cache key and the vector store search
+        assert doc_db.embedding_func.calls == 2
+        assert vector_db.embeddings == [[1.0, 0.0]] * 2 and scalar_db.embeddings == [None] * 2
+
+        vector_db.contents = ['c']
+        assert [x.page_content for x in asyncio.run(doc_db.asearch('query'))] == \
+            [x.page_content for x in doc_db.search('query')]
+        assert doc_db.retrieval_cache.stats()['hits'] == 2
+        generations.bump('test')
+        assert 'c' in [x.page_content for x in doc_db.search('query')]
+
+    def test_migrate_local(self):
+        class MockEncoder:
+            def embed_documents(self, texts, as_array=False):
+                return numpy.ones((len(texts), 2), dtype=numpy.float32)
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                patch('langchain_src.store.LOCAL_THRESHOLD', 3), \
+                patch('langchain_src.store.VectorStore') as mock_vector_store:
+            local_db = LocalVectorStore('test', embedding_func=MockEncoder(), path=tmp_dir)
+            doc_db = mock_doc_store(local_db, None)
+            doc_db.embedding_func = local_db.embedding_func
+            doc_db.insert(['a', 'b'])
+            assert doc_db.vector_db is local_db
+
+            # Inserting 2 more chunks grows the project over the threshold
+            doc_db.insert(['c', 'd'])
+            milvus_db = mock_vector_store.return_value
+            assert doc_db.vector_db is milvus_db
+            migrated = milvus_db.insert_embeddings.call_args.kwargs
+            assert migrated['data'].shape == (2, 2)
+            assert [x['text'] for x in migrated['metadatas']] == ['a', 'b']
+            milvus_db.insert.assert_called_once_with(data=['c', 'd'], metadatas=None)
+            assert not LocalVectorStore.has_project('test', path=tmp_dir)
+
+    def test_upsert_source(self):
+        class MockEncoder:
+            def __init__(self):
+                self.embedded = []
+
+            def embed_documents(self, texts, as_array=False):
+                self.embedded += texts
+                return numpy.ones((len(texts), 2), dtype=numpy.float32)
+
+        def source_docs(texts):
+            return [Document(page_content=x, metadata={'source': 'readme'}) for x in texts]
+
+        with tempfile.TemporaryDirectory() as tmp_dir, patch('langchain_src.store.LOCAL_THRESHOLD', 100):
+            encoder = MockEncoder()
+            local_db = LocalVectorStore('test', embedding_func=encoder, path=tmp_dir)
+            doc_db = mock_doc_store(local_db, None)
+            doc_db.embedding_func = encoder
+            doc_db.insert(['other'], metadatas=[{'source': 'other', 'content_hash': content_hash('other')}])
+
+            res = doc_db.upsert_source('readme', source_docs(['a', 'b']))
+            assert res == {'inserted': 2, 'deleted': 0, 'unchanged': 0}
+            res = doc_db.upsert_source('readme', source_docs(['a', 'c']))
+            assert res == {'inserted': 1, 'deleted': 1, 'unchanged': 1}
+            # Unchanged chunk 'a' is not embedded again
+            assert encoder.embedded == ['other', 'a', 'b', 'c']
+            _, metadatas = local_db.export()
+            assert sorted(x['text'] for x in metadatas) == ['a', 'c', 'other']
+
+            assert doc_db.delete_source('readme') == 2
+            assert [x['text'] for x in local_db.export()[1]] == ['other']
+
+            # Chunks stored for another source are kept, so deleting that source does not remove them
+            data, metadatas, skipped = doc_db.dedup(
+                ['other', 'new', 'new '], [{'source': 'x'}] * 3, Deduplicator())
+            assert data == ['other', 'new'] and metadatas == [{'source': 'x'}] * 2 and skipped == 1
+            data, _, skipped = doc_db.dedup(
+                ['other', 'new', 'new'], [{'source': 'other'}, {'source': 'x'}, {'source': 'y'}], Deduplicator())
+            assert data == ['new', 'new'] and skipped == 1
+
+    def test_dual_write(self):
+        class MockWriter:
+            def __init__(self, delay, lost=0):
+                self.delay = delay
+                self.lost = lost
+                self.calls = []
+                self.bulk = False
+
+            def insert(self, data, metadatas=None, refresh=True):
+                time.sleep(self.delay)
+                self.calls.append((list(data), refresh, self.bulk))
+                return len(data) - self.lost
+
+            @contextmanager
+            def bulk_load(self):
+                self.bulk = True
+                yield self
+                self.bulk = False
+
+        vector_db, scalar_db = MockWriter(0.2), MockWriter(0.2)
+        doc_db = mock_doc_store(vector_db, scalar_db)
+        start = time.time()
+        assert doc_db.insert(['a', 'b'], metadatas=[{'doc': 'doc a'}, {'doc': 'doc b'}]) == 2
+        # Both stores are written concurrently
+        assert time.time() - start < 0.35
+        assert scalar_db.calls == [(['doc a', 'doc b'], True, False)]
+
+        with doc_db.bulk_load():
+            doc_db.insert(['c'])
+            doc_db.insert(['d'])
+        assert scalar_db.calls[1:] == [(['c'], False, True), (['d'], False, True)]
+
+        # Counts are checked per insert, or once at the end of a bulk load
+        scalar_db.lost = 1
+        with self.assertRaises(AssertionError):
+            doc_db.insert(['e', 'f'])
+        with self.assertRaises(AssertionError):
+            with doc_db.bulk_load():
+                doc_db.insert(['g', 'h'])
+                doc_db.insert(['i'])
+
+    def test_overlapping_bulk_loads(self):
+        class MockWriter:
+            def __init__(self, lost=0):
+                self.lost = lost
+
+            def insert(self, data, metadatas=None, refresh=True):
+                return len(data) - self.lost
+
+            @contextmanager
+            def bulk_load(self):
+                yield self
+
+        doc_db = mock_doc_store(MockWriter(), MockWriter())
+        first_in, second_done = threading.Event(), threading.Event()
+        errors = []
+
+        def first():
+            try:
+                with doc_db.bulk_load():
+                    doc_db.insert(['a'])
+                    first_in.set()
+                    second_done.wait(2)
+                    # Counts of the first load are not reset or ended by the second one
+                    doc_db.insert(['b'])
+            except Exception as e:  # pylint: disable=W0718
+                errors.append(e)
+
+        thread = threading.Thread(target=first)
+        thread.start()
+        first_in.wait(2)
+        with doc_db.bulk_load():
+            doc_db.insert(['c'])
+        second_done.set()
+        thread.join()
+        assert errors == []
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../../..'))
+
+from langchain_src.store.vector_store.local import LocalVectorStore
+
+
+class MockEncoder:
+    vectors = {'a': [1.0, 0.0], 'b': [0.0, 1.0], 'c': [0.6, 0.8]}
+
+    def embed_documents(self, texts, as_array=False):
+        return numpy.array([self.vectors[x] for x in texts], dtype=numpy.float32)
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+class TestLocalVectorStore(unittest.TestCase):
+    def test_insert_search(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            vector_db = LocalVectorStore('test', embedding_func=MockEncoder(), path=tmp_dir)
+            assert vector_db.col is None
+            assert not LocalVectorStore.has_project('test', path=tmp_dir)
+
+            assert vector_db.insert(['a', 'b'], metadatas=[{'doc': 'doc a'}, {'doc': 'doc b'}]) == 2
+            assert vector_db.insert(['c']) == 1
+            assert LocalVectorStore.has_project('test', path=tmp_dir)
+
+            res = vector_db.similarity_search_with_score_by_vector([1.0, 0.0], k=2)
+            assert [(doc.page_content, round(score, 2)) for doc, score in res] == [('doc a', 1.0), ('c', 0.6)]
+
+            # Data is loaded memory-mapped by a new store of the same project
+            new_db = LocalVectorStore('test', embedding_func=MockEncoder(), path=tmp_dir)
+            assert isinstance(new_db.col, numpy.memmap)
+            assert len(new_db) == 3
+            assert [doc.page_content for doc in new_db.search('b')][:2] == ['doc b', 'c']
+
+            res = new_db.search_batch(['a', 'b'])
+            assert [[doc.page_content for doc in docs] for docs in res] == [['doc a', 'c', 'doc b'], ['doc b', 'c', 'doc a']]
+
+            embeddings, metadatas = new_db.export()
+            assert embeddings.shape == (3, 2)
+            assert metadatas[0] == {'doc': 'doc a', 'text': 'a'}
+
+            LocalVectorStore.drop('test', path=tmp_dir)
+            assert not LocalVectorStore.has_project('test', path=tmp_dir)
+
+    def test_delete_source(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            vector_db = LocalVectorStore('test', embedding_func=MockEncoder(), path=tmp_dir)
+            vector_db.insert(['a', 'b', 'c'], metadatas=[
+                {'source': 'x', 'content_hash': 'ha'},
+                {'source': 'y', 'content_hash': 'hb'},
+                {'source': 'x', 'content_hash': 'hc'}
+            ])
+            assert vector_db.source_hashes('x') == ['ha', 'hc']
+            assert vector_db.delete_source('x', content_hashes=['hc']) == 1
+            assert vector_db.source_hashes('x') == ['ha']
+            assert vector_db.delete_source('x') == 1
+            assert vector_db.delete_source('x') == 0
+            assert [doc.page_content for doc in vector_db.search('a')] == ['b']
+
+            new_db = LocalVectorStore('test', embedding_func=MockEncoder(), path=tmp_dir)
+            assert len(new_db) == 1
+            assert new_db.delete_source('y') == 1
+            assert new_db.search('a') == []
+
+    def test_append_reload(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            vector_db = LocalVectorStore('test', embedding_func=MockEncoder(), path=tmp_dir)
+            # Another process serving the same project
+            other_db = LocalVectorStore('test', embedding_func=MockEncoder(), path=tmp_dir)
+            vector_db.insert(['a'])
+            embedding_file = [x for x in os.listdir(vector_db.dir) if x.startswith('embeddings.')][0]
+            inode = os.stat(os.path.join(vector_db.dir, embedding_file)).st_ino
+            assert len(other_db) == 1
+
+            # Bytes past the manifest, as left by a crashed insert, are never read and cut off by the next insert
+            for name in os.listdir(vector_db.dir):
+                if name.startswith(('embeddings.', 'docs.')):
+                    with open(os.path.join(vector_db.dir, name), 'ab') as f:
+                        f.write(b'\x00' * 12)
+            other_db.insert(['b'])
+            vector_db.insert(['c'])
+            # Rows are appended to the same file
+            assert os.stat(os.path.join(vector_db.dir, embedding_file)).st_ino == inode
+            assert os.path.getsize(os.path.join(vector_db.dir, embedding_file)) == 3 * 2 * 4
+            assert [doc.page_content for doc in vector_db.search('b')] == ['b', 'c', 'a']
+            assert [doc.page_content for doc in other_db.search('b')] == ['b', 'c', 'a']
+
+            # A delete rewrites the rows in files of a new generation
+            other_db.insert(['a'], metadatas=[{'source': 'x'}])
+            assert vector_db.delete_source('x') == 1
+            assert embedding_file not in os.listdir(vector_db.dir)
+            assert [x['text'] for x in other_db.export()[1]] == ['a', 'b', 'c']
+
+    def test_migrate(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            vector_db = LocalVectorStore('test', embedding_func=MockEncoder(), path=tmp_dir)
+            other_db = LocalVectorStore('test', embedding_func=MockEncoder(), path=tmp_dir)
+            vector_db.insert(['a', 'b'])
+            assert [doc.page_content for doc in other_db.search('a')] == ['a', 'b']
+
+            migrated = []
+            assert vector_db.migrate(lambda embeddings, metadatas: migrated.append((embeddings.shape, metadatas))) == 2
+            assert migrated == [((2, 2), [{'text': 'a'}, {'text': 'b'}])]
+            assert not LocalVectorStore.has_project('test', path=tmp_dir)
+            assert LocalVectorStore.was_migrated('test', path=tmp_dir)
+            assert sorted(os.listdir(vector_db.dir)) == ['manifest.json', 'write.lock']
+            # The other process sees the migration and no longer writes locally
+            assert other_db.migrated and other_db.col is None
+            with self.assertRaises(RuntimeError):
+                other_db.insert(['c'])
+
+            LocalVectorStore.drop('test', path=tmp_dir)
+            assert not LocalVectorStore.was_migrated('test', path=tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
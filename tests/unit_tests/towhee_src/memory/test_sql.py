@@ -1,10 +1,15 @@
 import os
 import sys
+import json
+import asyncio
 import unittest
 
+from sqlalchemy import event, inspect, text
+
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
 
-from towhee_src.memory.sql import MemoryStore
+from towhee_src.memory import sql
+from towhee_src.memory.sql import MemoryStore, dispose_async_engines
 from towhee_src.base import BaseMemory
 
 
@@ -33,6 +38,30 @@ class TestSql(unittest.TestCase):
         history = self.memory.get_history(self.project, self.session_id)
         assert history == self.messages
 
+    def test_async_history(self):
+        session_id = 'test_async'
+        asyncio.run(self.memory.aadd_history(self.project, session_id, self.messages))
+        history = asyncio.run(self.memory.aget_history(self.project, session_id))
+        assert history == self.messages
+        assert self.memory.get_history(self.project, session_id) == self.messages
+
+    def test_async_engine_per_loop(self):
+        session_id = 'test_loops'
+
+        async def chat(question):
+            try:
+                await self.memory.aadd_history(self.project, session_id, [(question, 'answer')])
+                return self.memory.async_engine, await self.memory.aget_history(self.project, session_id)
+            finally:
+                await dispose_async_engines()
+
+        # Each asyncio.run has its own loop and engine
+        engine1, history1 = asyncio.run(chat('q1'))
+        engine2, history2 = asyncio.run(chat('q2'))
+        assert engine1 is not engine2
+        assert history1 == [('q1', 'answer')] and history2 == [('q1', 'answer'), ('q2', 'answer')]
+        assert len(sql._ASYNC_ENGINES) == 0
+
     def test_utils(self):
         self.memory.add_history(self.project, self.session_id, self.messages)
         assert self.memory.check(self.project)
@@ -44,6 +73,130 @@ class TestSql(unittest.TestCase):
         self.memory.drop(self.project)
         assert not self.memory.check(self.project)
 
+    def test_table_cache(self):
+        project = 'akcio_ut_cache'
+        self.memory.add_history(project, self.session_id, self.messages)
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(self.memory.engine, 'before_cursor_execute', record)
+        try:
+            self.memory.add_history(project, self.session_id, self.messages)
+            history = self.memory.get_history(project, self.session_id)
+        finally:
+            event.remove(self.memory.engine, 'before_cursor_execute', record)
+        assert history == self.messages * 2
+        # One insert and one select, no catalog queries
+        assert len(statements) == 2
+        assert statements[0].startswith('INSERT') and statements[1].startswith('SELECT')
+
+        # Table dropped by another store is created again
+        other = MemoryStore(configs=self.test_config)
+        other.drop(project)
+        assert self.memory.get_history(project, self.session_id) == []
+        self.memory.add_history(project, self.session_id, self.messages)
+        assert other.get_history(project, self.session_id) == self.messages
+        other.drop(project)
+        assert not self.memory.check(project)
+
+    def test_history_limit(self):
+        project = 'akcio_ut_limit'
+        messages = [(f'q{i}', f'a{i}') for i in range(5)]
+        self.memory.add_history(project, self.session_id, messages)
+        self.memory.add_history(project, 'other', [('x', 'y')])
+        assert self.memory.get_history(project, self.session_id) == messages
+        assert self.memory.get_history(project, self.session_id, limit=2) == messages[-2:]
+        assert self.memory.get_history(project, self.session_id, limit=10) == messages
+        assert asyncio.run(self.memory.aget_history(project, self.session_id, limit=3)) == messages[-3:]
+
+        indexes = inspect(self.memory.engine).get_indexes(project)
+        assert [x['column_names'] for x in indexes] == [['session_id', 'id']]
+        self.memory.drop(project)
+
+    def test_index_existing_table(self):
+        project = 'akcio_ut_noindex'
+        with self.memory.engine.connect() as conn:
+            conn.execute(text(f'CREATE TABLE {project} (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                              'session_id VARCHAR NOT NULL, message JSON NOT NULL)'))
+            conn.commit()
+        memory = MemoryStore(configs=self.test_config)
+        memory.add_history(project, self.session_id, self.messages)
+        indexes = inspect(memory.engine).get_indexes(project)
+        assert [x['column_names'] for x in indexes] == [['session_id', 'id']]
+        assert memory.get_history(project, self.session_id, limit=1) == self.messages
+        memory.drop(project)
+
+    def test_legacy_message(self):
+        project = 'akcio_ut_legacy'
+        self.memory.add_history(project, self.session_id, self.messages)
+        # Messages used to be saved as json strings in the JSON column
+        with self.memory.engine.connect() as conn:
+            conn.execute(text(f'INSERT INTO {project} (session_id, message) VALUES (:s, :m)'),
+                         {'s': self.session_id, 'm': json.dumps(json.dumps({'type': 'chat', 'data': ['q', 'a']}))})
+            conn.commit()
+        assert self.memory.get_history(project, self.session_id) == self.messages + [('q', 'a')]
+        self.memory.drop(project)
+
+    def test_write_behind(self):
+        project = 'akcio_ut_buffered'
+        config = {**self.test_config, 'write_behind': {'enable': True, 'interval': 60, 'max_rows': 100}}
+        memory = MemoryStore(configs=config)
+        memory.add_history(project, self.session_id, self.messages)
+        asyncio.run(memory.aadd_history(project, self.session_id, [('q1', 'a1')]))
+        # Buffered turns are read before they are written
+        assert not inspect(memory.engine).has_table(project)
+        assert memory.get_history(project, self.session_id) == self.messages + [('q1', 'a1')]
+        assert asyncio.run(memory.aget_history(project, self.session_id, limit=1)) == [('q1', 'a1')]
+
+        memory.write_buffer.flush()
+        assert self.memory.get_history(project, self.session_id) == self.messages + [('q1', 'a1')]
+        assert memory.get_history(project, self.session_id) == self.messages + [('q1', 'a1')]
+
+        # Turns buffered at close are written
+        memory.add_history(project, self.session_id, [('q2', 'a2')])
+        memory.write_buffer.close()
+        assert self.memory.get_history(project, self.session_id, limit=1) == [('q2', 'a2')]
+        self.memory.drop(project)
+
+    def test_shared_table(self):
+        project = 'akcio_ut_shared'
+        config = {**self.test_config, 'storage': {'layout': 'shared', 'shared_table': 'chat_history_ut'}}
+        memory = MemoryStore(configs=config)
+        messages = [(f'q{i}', f'a{i}') for i in range(3)]
+        memory.add_history(project, self.session_id, messages)
+        memory.add_history('akcio_ut_shared2', self.session_id, [('x', 'y')])
+        assert not inspect(memory.engine).has_table(project)
+        assert memory.get_history(project, self.session_id) == messages
+        assert memory.get_history(project, self.session_id, limit=1) == messages[-1:]
+        assert memory.get_history('akcio_ut_shared2', self.session_id) == [('x', 'y')]
+
+        assert memory.check(project)
+        memory.drop(project, self.session_id)
+        assert memory.get_history(project, self.session_id) == []
+        memory.drop('akcio_ut_shared2')
+        assert not memory.check('akcio_ut_shared2')
+        assert not memory.check(project)
+
+    def test_migrate(self):
+        project = 'akcio_ut_migrate'
+        self.memory.add_history(project, self.session_id, self.messages)
+        self.memory.add_history(project, 'other', [('x', 'y')])
+        config = {**self.test_config, 'storage': {'layout': 'shared', 'shared_table': 'chat_history_ut'}}
+        memory = MemoryStore(configs=config)
+        assert project in memory.legacy_tables()
+        assert 'chat_history_ut' not in memory.legacy_tables()
+
+        assert memory.migrate(project, drop=False) == 2
+        assert inspect(memory.engine).has_table(project)
+        memory.drop(project)
+        assert memory.migrate(project) == 2
+        assert not inspect(memory.engine).has_table(project)
+        assert memory.get_history(project, self.session_id) == self.messages
+        assert memory.get_history(project, 'other') == [('x', 'y')]
+        assert memory.migrate(project) == 0
+        memory.drop(project)
+
     @classmethod
     def tearDownClass(cls):
         os.remove(cls.db_path)
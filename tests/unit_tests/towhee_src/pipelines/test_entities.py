@@ -0,0 +1,147 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+from towhee_src import pipelines
+from towhee_src.pipelines import TowheePipelines
+
+
+class MockCollection:
+    '''Milvus collection of live rows, the count query can be held to run inserts meanwhile.'''
+    rows = {}
+    hold = None
+
+    def __init__(self, name, schema=None):
+        self.name = name
+
+    def create_index(self, field_name, index_params):
+        pass
+
+    def query(self, expr, output_fields, **kwargs):
+        if output_fields == ['count(*)']:
+            count = len(self.rows.setdefault(self.name, []))
+            if MockCollection.hold:
+                MockCollection.hold()
+            return [{'count(*)': count}]
+        source = expr.split('==')[1].strip().strip('"')
+        return [{'id': i} for i, s in self.rows.get(self.name, []) if s == source]
+
+    def delete(self, expr):
+        ids = set(int(x) for x in expr.split('[')[1].rstrip(']').split(','))
+        self.rows[self.name] = [x for x in self.rows[self.name] if x[0] not in ids]
+
+
+class MockIndices:
+    def __init__(self, es_client):
+        self.es_client = es_client
+
+    def exists(self, index):
+        return index in self.es_client.mappings
+
+    def create(self, index, mappings=None):
+        self.es_client.mappings[index] = mappings or {}
+        self.es_client.docs[index] = []
+
+    def get_mapping(self, index):
+        return {index: {'mappings': self.es_client.mappings[index]}}
+
+
+class MockElasticsearch:
+    '''Index of docs by source, sources over ignore_above (256) are not indexed by the dynamic "doc.keyword".'''
+    def __init__(self):
+        self.mappings = {}
+        self.docs = {}
+        self.indices = MockIndices(self)
+
+    def index(self, index, doc):
+        if index not in self.mappings:
+            # Dynamic mapping of the insert pipeline
+            self.indices.create(index, {'properties': {'doc': {'type': 'text'}}})
+        self.docs[index].append(doc)
+
+    def delete_by_query(self, index, query, refresh=False):
+        (field, source), = query['term'].items()
+        matched = [x for x in self.docs[index] if x['doc'] == source
+                   and (field == 'doc' or (field == 'doc.keyword' and len(source) <= 256))]
+        self.docs[index] = [x for x in self.docs[index] if x not in matched]
+        return {'deleted': len(matched)}
+
+    def count(self, index):
+        return {'count': len(self.docs[index])}
+
+
+class MockFlushScheduler:
+    def add(self, project, num):
+        pass
+
+
+def mock_pipelines():
+    towhee_pipelines = TowheePipelines.__new__(TowheePipelines)
+    towhee_pipelines.use_scalar = False
+    towhee_pipelines.flush_scheduler = MockFlushScheduler()
+    towhee_pipelines._entity_counts = {}
+    towhee_pipelines._count_deltas = {}
+    towhee_pipelines._count_lock = threading.Lock()
+    return towhee_pipelines
+
+
+class TestEntities(unittest.TestCase):
+    def setUp(self):
+        MockCollection.rows = {'akcio_ut': [(i, 'a.md') for i in range(3)] + [(3, 'b.md')]}
+        MockCollection.hold = None
+
+    def test_count_cached(self):
+        towhee_pipelines = mock_pipelines()
+        with patch.object(pipelines, 'Collection', MockCollection):
+            assert towhee_pipelines.count_entities('akcio_ut') == 4
+            MockCollection.rows['akcio_ut'].append((4, 'c.md'))
+            towhee_pipelines.add_entities('akcio_ut', 1)
+            assert towhee_pipelines.count_entities('akcio_ut') == 5
+            # Deleted rows are not counted, also by the exact count
+            assert towhee_pipelines.delete_source('akcio_ut', 'a.md') == 3
+            assert towhee_pipelines.count_entities('akcio_ut') == 2
+            assert towhee_pipelines.count_entities('akcio_ut', exact=True) == 2
+
+    def test_count_with_concurrent_writes(self):
+        towhee_pipelines = mock_pipelines()
+
+        def insert_while_counting():
+            # Rows inserted after the count query was answered
+            MockCollection.rows['akcio_ut'].append((4, 'c.md'))
+            towhee_pipelines.add_entities('akcio_ut', 1)
+
+        MockCollection.hold = insert_while_counting
+        with patch.object(pipelines, 'Collection', MockCollection):
+            assert towhee_pipelines.count_entities('akcio_ut') == 5
+            MockCollection.hold = None
+            assert towhee_pipelines.count_entities('akcio_ut') == 5
+            assert towhee_pipelines._count_deltas == {}
+
+    def test_delete_long_source(self):
+        towhee_pipelines = mock_pipelines()
+        towhee_pipelines.use_scalar = True
+        towhee_pipelines.es_client = MockElasticsearch()
+        towhee_pipelines.textencoder_config = {'dim': 2}
+        towhee_pipelines.milvus_index_params = {}
+        url = 'https://example.com/' + 'x' * 300
+        MockCollection.rows = {'akcio_ut': [(0, url), (1, url), (2, 'b.md')]}
+        with patch.object(pipelines, 'Collection', MockCollection):
+            towhee_pipelines.create('akcio_ut')
+            assert towhee_pipelines.es_client.mappings['akcio_ut'] == {'properties': {'doc': {'type': 'keyword'}}}
+            for _, source in MockCollection.rows['akcio_ut']:
+                towhee_pipelines.es_client.index('akcio_ut', {'doc': source})
+
+            # Chunks of a source longer than ignore_above are deleted from both stores
+            assert towhee_pipelines.delete_source('akcio_ut', url) == 2
+            assert towhee_pipelines.es_client.count(index='akcio_ut')['count'] == 1
+            with self.assertNoLogs(pipelines.logger, level='WARNING'):
+                assert towhee_pipelines.count_entities('akcio_ut', exact=True) == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import time
+import threading
+import unittest
+
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../..'))
+
+from towhee_src.pipelines.flush import FlushScheduler
+
+
+class TestFlushScheduler(unittest.TestCase):
+    def setUp(self):
+        self.flushed = []
+        self.event = threading.Event()
+
+    def flush_func(self, project):
+        self.flushed.append(project)
+        self.event.set()
+
+    def test_flush_by_rows(self):
+        scheduler = FlushScheduler(self.flush_func, interval=60, max_rows=10)
+        scheduler.add('p1', 4)
+        scheduler.add('p1', 4)
+        assert scheduler.pending('p1') == 8
+        assert not self.event.wait(0.2)
+        scheduler.add('p1', 4)
+        assert self.event.wait(2)
+        assert self.flushed == ['p1']
+        assert scheduler.pending('p1') == 0
+        scheduler.close()
+
+    def test_flush_by_interval(self):
+        scheduler = FlushScheduler(self.flush_func, interval=0.2, max_rows=1000)
+        start = time.monotonic()
+        scheduler.add('p1', 1)
+        scheduler.add('p2', 1)
+        assert self.event.wait(2)
+        time.sleep(0.1)
+        assert time.monotonic() - start >= 0.2
+        assert sorted(self.flushed) == ['p1', 'p2']
+        scheduler.close()
+
+    def test_flush_discard_close(self):
+        scheduler = FlushScheduler(self.flush_func, interval=60, max_rows=1000)
+        scheduler.add('p1', 1)
+        scheduler.add('p2', 1)
+        scheduler.add('p3', 1)
+        scheduler.flush('p1')
+        assert self.flushed == ['p1']
+        scheduler.discard('p2')
+        scheduler.close()
+        # Pending projects are flushed at close, discarded ones are not
+        assert self.flushed == ['p1', 'p3']
+        assert scheduler.flushes == 2
+
+    def test_flush_error(self):
+        def flush_func(project):
+            raise RuntimeError(project)
+
+        scheduler = FlushScheduler(flush_func, interval=60, max_rows=1000)
+        scheduler.add('p1', 1)
+        scheduler.flush()
+        assert scheduler.pending('p1') == 0
+        assert scheduler.flushes == 0
+        scheduler.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import asyncio
 import unittest
 from unittest.mock import patch
 
@@ -19,6 +20,12 @@ class MockStore:
     def add_history(self, project, session_id, messages: list):
         self.memory += messages
 
+    async def aget_history(self, *args, **kwargs):
+        return self.get_history(*args, **kwargs)
+
+    async def aadd_history(self, project, session_id, messages: list):
+        self.add_history(project, session_id, messages)
+
     def drop(self, *args, **kwargs):
         self.memory = []
 
@@ -49,6 +56,9 @@ class MockPipeline:
         if not self.check(project):
             self.projects[project] = ''
 
+    def add_entities(self, project, num):
+        pass
+
     def count_entities(self, project):
         return len(self.projects[project])
     
@@ -93,6 +103,28 @@ class TestOperations(unittest.TestCase):
                 clean_history = get_history(self.project, self.session_id)
                 assert clean_history == []
 
+    def test_chat_stream(self):
+
+        with patch('towhee_src.pipelines.TowheePipelines') as mock_pipelines, \
+             patch('towhee_src.memory.MemoryStore') as mock_memory:
+            mock_pipelines.return_value = MockPipeline()
+            mock_memory.return_value = MockStore()
+
+            from towhee_src import operations
+            from towhee_src.operations import chat_stream, get_history, clear_history
+
+            async def collect():
+                return [token async for token in chat_stream(self.session_id, self.project, self.question)]
+
+            with patch.object(operations, 'search_pipeline', MockPipeline().search_pipeline):
+                clear_history(self.project, self.session_id)
+                tokens = asyncio.run(collect())
+                assert ''.join(tokens) == self.expect_answer
+
+                history = get_history(self.project, self.session_id)
+                assert history == [(self.question, self.expect_answer)]
+                clear_history(self.project, self.session_id)
+
 
     def test_insert(self):
 
@@ -114,7 +146,7 @@ class TestOperations(unittest.TestCase):
                 from towhee_src.operations import insert, check, drop
 
                 count = insert(self.test_src, self.project)
-                assert count == self.expect_len
+                assert count == {'inserted': self.expect_len, 'skipped': 0}
                 status = check(self.project)
                 assert status['store']
 
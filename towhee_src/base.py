@@ -1,5 +1,6 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional
 
 from towhee.runtime.runtime_pipeline import RuntimePipeline
 
@@ -13,10 +14,18 @@ class BaseMemory(ABC):
         pass
 
     @abstractmethod
-    def get_history(self, project: str, session_id: str) -> List[tuple]:
-        '''Get chat history from the project table for each session.'''
+    def get_history(self, project: str, session_id: str, limit: Optional[int] = None) -> List[tuple]:
+        '''Get chat history from the project table for each session, only the last limit turns if given.'''
         pass
 
+    async def aadd_history(self, project: str, session_id: str, messages: List[dict]):
+        '''Async add_history, override with a native async client when the database has one.'''
+        return await asyncio.to_thread(self.add_history, project, session_id, messages)
+
+    async def aget_history(self, project: str, session_id: str, limit: Optional[int] = None) -> List[tuple]:
+        '''Async get_history, override with a native async client when the database has one.'''
+        return await asyncio.to_thread(self.get_history, project, session_id, limit)
+
     @abstractmethod
     def drop(self, project):
         '''Clear all memory saved in the table "project"'''
@@ -56,6 +65,16 @@ class BasePipelines(ABC):
         '''Drop project table(s).'''
         pass
 
+    @abstractmethod
+    def delete_source(self, project, source) -> int:
+        '''Delete doc chunks of one source from project table(s).'''
+        pass
+
+    @abstractmethod
+    def add_entities(self, project, num):
+        '''Record doc chunks inserted into project.'''
+        pass
+
     @abstractmethod 
     def count_entities(self, project) -> int:
         '''Count doc chunks in project.'''
@@ -1 +1 @@
-from .sql import MemoryStore
+from .sql import MemoryStore, dispose_async_engines
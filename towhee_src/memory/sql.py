@@ -1,72 +1,312 @@
 import sys
 import os
 import json
-from typing import List, Dict
+import asyncio
+import logging
+import weakref
+import threading
+from typing import List, Dict, Optional
 
-from sqlalchemy import create_engine, inspect, MetaData, Table, Column, String, Integer, JSON
+from sqlalchemy import create_engine, inspect, make_url, select, literal, text, MetaData, Table, Column, \
+    String, Integer, BigInteger, JSON, Index
+from sqlalchemy.exc import DBAPIError
 
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
 from config import MEMORYDB_CONFIG
 from towhee_src.base import BaseMemory
+from common import WriteBehindBuffer
+
+
+logger = logging.getLogger(__name__)
+
+# Async dialect+driver used for each sync dialect in connect_str
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+psycopg',
+    'sqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+}
+
+# Engines shared by all memory stores of the process, by url
+_ENGINES = {}
+# Async engines by event loop then url, as pooled asyncio connections can not be used in other loops
+_ASYNC_ENGINES = weakref.WeakKeyDictionary()
+_ENGINES_LOCK = threading.Lock()
+
+
+def json_codec(name: str = 'orjson'):
+    '''(serializer, deserializer) of the message column, orjson if installed else the standard json module.'''
+    if name == 'orjson':
+        try:
+            import orjson  # pylint: disable=C0415
+            return (lambda x: orjson.dumps(x).decode('utf-8')), orjson.loads
+        except ModuleNotFoundError:
+            logger.warning('orjson is not installed, using json to encode chat messages.')
+    return json.dumps, json.loads
+
+
+def shared_engine(url, configs: Dict, is_async: bool = False):
+    '''Engine of url shared across memory stores, created with pool settings and json codec of configs.
+    An async engine is shared within the running event loop only.
+    '''
+    key = str(url)
+    with _ENGINES_LOCK:
+        engines = _ASYNC_ENGINES.setdefault(asyncio.get_running_loop(), {}) if is_async else _ENGINES
+        if key not in engines:
+            serializer, deserializer = json_codec(configs.get('json_codec', 'orjson'))
+            kwargs = {'json_serializer': serializer, 'json_deserializer': deserializer}
+            if make_url(url).get_backend_name() != 'sqlite':
+                # SQLite connections are local files, pool settings only apply to server databases
+                kwargs.update(configs.get('pool', {}))
+            if is_async:
+                from sqlalchemy.ext.asyncio import create_async_engine  # pylint: disable=C0415
+
+                engines[key] = create_async_engine(url=url, **kwargs)
+            else:
+                engines[key] = create_engine(url=url, **kwargs)
+        return engines[key]
+
+
+async def dispose_async_engines():
+    '''Close async engines of the running event loop, e.g. before asyncio.run closes the loop.'''
+    with _ENGINES_LOCK:
+        engines = _ASYNC_ENGINES.pop(asyncio.get_running_loop(), {})
+    for engine in engines.values():
+        await engine.dispose()
 
         
 class MemoryStore(BaseMemory):
-    '''Memory store using SQL databases supported by sqlalchemy. (eg. Postgresql)'''
+    '''Memory store using SQL databases supported by sqlalchemy. (eg. Postgresql)
+
+    Project tables are reflected once and cached until dropped, so a chat turn runs one select and one insert.
+    Tables are indexed on (session_id, id), so reading the last turns of a session does not scan the table.
+    With write_behind enabled, turns are buffered and written in batches in the background instead of in the request,
+    and reads include buffered turns.
+    With the shared storage layout, all projects are kept in one table keyed by (project, session_id, id),
+    hash partitioned by project on Postgres, instead of one table per project.
+    '''
     def __init__(self, configs: Dict = MEMORYDB_CONFIG):
         '''Initialize memory storage'''
-        self.engine = create_engine(url=configs['connect_str'])
+        self.configs = configs
+        self.engine = shared_engine(configs['connect_str'], configs)
         self.meta = MetaData()
+        self.async_connect_str = configs.get('async_connect_str', None) or self._async_url(configs['connect_str'])
+        # Table objects by project, MetaData is not thread-safe so it is changed under the lock
+        self._tables = {}
+        self._tables_lock = threading.Lock()
+        # Projects whose table is known to have the session index
+        self._indexed = set()
+        storage = configs.get('storage', {})
+        self.shared_table = storage.get('shared_table', 'chat_history') if storage.get('layout') == 'shared' else None
+        self.partitions = storage.get('partitions', 0)
+        write_behind = configs.get('write_behind', {})
+        if write_behind.get('enable', False):
+            self.write_buffer = WriteBehindBuffer(
+                write_func=self._write_batch,
+                interval=write_behind.get('interval', 1),
+                max_rows=write_behind.get('max_rows', 100)
+            )
+        else:
+            self.write_buffer = None
+
+    @property
+    def async_engine(self):
+        '''Async engine of the running event loop, created on its first async call,
+        so sync-only users do not need an async driver.
+        '''
+        return shared_engine(self.async_connect_str, self.configs, is_async=True)
 
     def add_history(self, project: str, session_id: str, messages: List[dict]):
-        project_table = self._create_table_if_not_exists(project)
+        if self.write_buffer is not None:
+            self.write_buffer.add(project, session_id, [tuple(x) for x in messages])
+            return
+        self._insert_rows(project, self._messages_to_rows(project, session_id, messages))
 
-        data = [
-            {'session_id': session_id, 'message': json.dumps(self._message_to_dict(message))}
-            for message in messages
-            ]
+    def _write_batch(self, project: str, batch: List[tuple]):
+        '''Write buffered turns of many sessions of project in one insert.'''
+        data = [row for session_id, messages in batch
+                for row in self._messages_to_rows(project, session_id, messages)]
+        self._insert_rows(project, data)
+
+    def _insert_rows(self, project: str, data: List[dict]):
         with self.engine.connect() as conn:
-            query = project_table.insert()
-            conn.execute(query, data)
+            try:
+                conn.execute(self._create_table_if_not_exists(conn, project).insert(), data)
+            except DBAPIError:
+                # The cached table may have been dropped by another process, look it up again once
+                conn.rollback()
+                if not self._forget_table(project):
+                    raise
+                conn.execute(self._create_table_if_not_exists(conn, project).insert(), data)
             conn.commit()
 
-    def get_history(self, project: str, session_id: str):
-        if self.check(project):
-            project_table = Table(project, self.meta, autoload_with=self.engine)
-            query = project_table.select().where(project_table.c.session_id == session_id)
-            messages = []
-            with self.engine.connect() as conn:
-                for row in conn.execute(query):
-                    message = row.message
-                    if isinstance(message, str):
-                        message = json.loads(message)
-                    message = self._message_from_dict(message)
-                    messages.append(message)
-        else:
-            messages = []
-        return messages
+    async def aadd_history(self, project: str, session_id: str, messages: List[dict]):
+        if self.write_buffer is not None:
+            self.add_history(project, session_id, messages)
+            return
+        data = self._messages_to_rows(project, session_id, messages)
+        async with self.async_engine.connect() as conn:
+            try:
+                project_table = await conn.run_sync(self._create_table_if_not_exists, project)
+                await conn.execute(project_table.insert(), data)
+            except DBAPIError:
+                await conn.rollback()
+                if not self._forget_table(project):
+                    raise
+                project_table = await conn.run_sync(self._create_table_if_not_exists, project)
+                await conn.execute(project_table.insert(), data)
+            await conn.commit()
+
+    def get_history(self, project: str, session_id: str, limit: Optional[int] = None):
+        if self.write_buffer is not None:
+            messages = self.write_buffer.read(
+                project, session_id, lambda: self._read_history(project, session_id, limit))
+            return messages[-limit:] if limit and limit > 0 else messages
+        return self._read_history(project, session_id, limit)
 
-    def _create_table_if_not_exists(self, project):
-        if not self.check(project):
-            project_table = Table(project, self.meta,
-                                Column('id', Integer, primary_key=True, autoincrement=True),
-                                Column('session_id', String, nullable=False),
-                                Column('message', JSON, nullable=False)
-                                )
-            self.meta.create_all(self.engine)
-        project_table = Table(project, self.meta, autoload_with=self.engine)
+    def _read_history(self, project: str, session_id: str, limit: Optional[int] = None):
+        with self.engine.connect() as conn:
+            try:
+                return self._select_history(conn, project, session_id, limit)
+            except DBAPIError:
+                conn.rollback()
+                if not self._forget_table(project):
+                    raise
+                return self._select_history(conn, project, session_id, limit)
+
+    async def aget_history(self, project: str, session_id: str, limit: Optional[int] = None):
+        if self.write_buffer is not None:
+            # Reads must be ordered with background flushes, which run in threads
+            return await asyncio.to_thread(self.get_history, project, session_id, limit)
+        async with self.async_engine.connect() as conn:
+            try:
+                return await conn.run_sync(self._select_history, project, session_id, limit)
+            except DBAPIError:
+                await conn.rollback()
+                if not self._forget_table(project):
+                    raise
+                return await conn.run_sync(self._select_history, project, session_id, limit)
+
+    def _select_history(self, conn, project, session_id, limit=None):
+        '''Messages of session in order, only the last limit ones if limit is a positive number.'''
+        project_table = self._get_table(conn, project)
+        if project_table is None:
+            return []
+        query = project_table.select().where(*self._project_filter(project_table, project),
+                                             project_table.c.session_id == session_id)
+        if limit and limit > 0:
+            # Read the last turns backwards through the ([project,] session_id, id) index
+            query = query.order_by(project_table.c.id.desc()).limit(limit)
+            return self._rows_to_messages(conn.execute(query))[::-1]
+        query = query.order_by(project_table.c.id)
+        return self._rows_to_messages(conn.execute(query))
+
+    def _table_name(self, project):
+        return self.shared_table or project
+
+    def _project_filter(self, project_table, project) -> list:
+        '''Where clauses selecting rows of project, none if the table holds one project.'''
+        return [project_table.c.project == project] if self.shared_table else []
+
+    def _get_table(self, conn, project):
+        '''Cached table of project, None if it does not exist (not cached, another process may create it).'''
+        name = self._table_name(project)
+        project_table = self._tables.get(name)
+        if project_table is not None:
+            return project_table
+        if not inspect(conn).has_table(name):
+            return None
+        with self._tables_lock:
+            project_table = Table(name, self.meta, autoload_with=conn, extend_existing=True)
+            self._tables[name] = project_table
+        return project_table
+
+    def _create_table_if_not_exists(self, conn, project):
+        project_table = self._get_table(conn, project)
+        if project_table is not None:
+            if project_table.name not in self._indexed:
+                self._create_index_if_not_exists(conn, project_table)
+            return project_table
+        name = self._table_name(project)
+        with self._tables_lock:
+            if self.shared_table:
+                project_table = self._shared_table_def(name)
+            else:
+                project_table = Table(name, self.meta,
+                                    Column('id', Integer, primary_key=True, autoincrement=True),
+                                    Column('session_id', String, nullable=False),
+                                    Column('message', JSON, nullable=False),
+                                    Index(f'{name}_session_id_idx', 'session_id', 'id'),
+                                    extend_existing=True
+                                    )
+            # Another process may have created the table since it was checked
+            project_table.create(conn, checkfirst=True)
+            if self.shared_table and 'postgresql_partition_by' in project_table.dialect_kwargs:
+                for i in range(self.partitions):
+                    conn.execute(text(f'CREATE TABLE IF NOT EXISTS {name}_p{i} PARTITION OF {name} '
+                                      f'FOR VALUES WITH (MODULUS {self.partitions}, REMAINDER {i});'))
+            self._tables[name] = project_table
+            self._indexed.add(name)
         return project_table
+
+    def _shared_table_def(self, name):
+        '''Table of all projects. On Postgres the key (project, session_id, id) is the primary key, as partitions
+        need the partition key in it. Other databases only auto-increment a single-column key, indexed on it then.
+        '''
+        if self.engine.dialect.name == 'postgresql':
+            kwargs = {'postgresql_partition_by': 'HASH (project)'} if self.partitions > 0 else {}
+            return Table(name, self.meta,
+                         Column('project', String, primary_key=True),
+                         Column('session_id', String, primary_key=True),
+                         Column('id', BigInteger, primary_key=True, autoincrement=True),
+                         Column('message', JSON, nullable=False),
+                         extend_existing=True,
+                         **kwargs
+                         )
+        return Table(name, self.meta,
+                     Column('id', Integer, primary_key=True, autoincrement=True),
+                     Column('project', String, nullable=False),
+                     Column('session_id', String, nullable=False),
+                     Column('message', JSON, nullable=False),
+                     Index(f'{name}_session_id_idx', 'project', 'session_id', 'id'),
+                     extend_existing=True
+                     )
+
+    def _create_index_if_not_exists(self, conn, project_table):
+        '''Add the session index to a table created without it, in the transaction of the insert.'''
+        columns = [[c.name for c in index.columns] for index in project_table.indexes]
+        if not self.shared_table and ['session_id', 'id'] not in columns:
+            index = Index(f'{project_table.name}_session_id_idx', project_table.c.session_id, project_table.c.id)
+            index.create(conn, checkfirst=True)
+        self._indexed.add(project_table.name)
+
+    def _forget_table(self, project) -> bool:
+        '''Drop cached table of project, returning whether it was cached.'''
+        name = self._table_name(project)
+        with self._tables_lock:
+            project_table = self._tables.pop(name, None)
+            self._indexed.discard(name)
+            if project_table is not None:
+                self.meta.remove(project_table)
+        return project_table is not None
         
     def drop(self, project, session_id=None):
+        if self.write_buffer is not None:
+            # Write buffered turns first, so none of them is written after the delete
+            self.write_buffer.flush()
         if self.check(project):
-            project_table = Table(project, self.meta, autoload_with=self.engine)
-            if session_id and len(session_id) > 0:
-                query = project_table.delete().where(project_table.c.session_id == session_id)
+            with self.engine.connect() as conn:
+                project_table = self._get_table(conn, project)
+            if (session_id and len(session_id) > 0) or self.shared_table:
+                query = project_table.delete().where(*self._project_filter(project_table, project))
+                if session_id and len(session_id) > 0:
+                    query = query.where(project_table.c.session_id == session_id)
                 with self.engine.connect() as conn:
                     conn.execute(query)
                     conn.commit()
             else:
+                self._forget_table(project)
                 query = project_table.drop(self.engine)
 
         if not session_id or len(session_id) == 0:
@@ -74,7 +314,75 @@ class MemoryStore(BaseMemory):
             assert not existence, f'Failed to drop table {project}.'
 
     def check(self, project):
-        return inspect(self.engine).has_table(project)
+        if self.write_buffer is not None and self.write_buffer.pending(project) > 0:
+            # The table of a new project is created by the first write
+            self.write_buffer.flush()
+        if not self.shared_table:
+            return inspect(self.engine).has_table(project)
+        with self.engine.connect() as conn:
+            project_table = self._get_table(conn, project)
+            if project_table is None:
+                return False
+            query = select(project_table.c.id).where(*self._project_filter(project_table, project)).limit(1)
+            return conn.execute(query).first() is not None
+
+    def migrate(self, project, drop: bool = True) -> int:
+        '''Move history of project from its own table to the shared table in one transaction,
+        returning the number of rows moved. The project table is dropped unless drop is False.
+        '''
+        assert self.shared_table, 'Migration needs the shared storage layout.'
+        assert project != self.shared_table, f'Can not migrate the shared table {project}.'
+        if self.write_buffer is not None:
+            self.write_buffer.flush()
+        with self.engine.begin() as conn:
+            if not inspect(conn).has_table(project):
+                return 0
+            legacy_table = Table(project, MetaData(), autoload_with=conn)
+            shared_table = self._create_table_if_not_exists(conn, project)
+            query = shared_table.insert().from_select(
+                ['project', 'session_id', 'message'],
+                select(literal(project), legacy_table.c.session_id, legacy_table.c.message).order_by(legacy_table.c.id)
+            )
+            num = conn.execute(query).rowcount
+            if drop:
+                legacy_table.drop(conn)
+        return num
+
+    def legacy_tables(self) -> List[str]:
+        '''Names of tables with the per-project layout (id, session_id, message), to be migrated.'''
+        columns = {'id', 'session_id', 'message'}
+        db = inspect(self.engine)
+        return [x for x in db.get_table_names()
+                if x != self.shared_table and {c['name'] for c in db.get_columns(x)} == columns]
+
+    def _messages_to_rows(self, project: str, session_id: str, messages: List[tuple]):
+        # The JSON column encodes messages with the json codec of the engine
+        rows = [
+            {'session_id': session_id, 'message': self._message_to_dict(message)}
+            for message in messages
+            ]
+        if self.shared_table:
+            for row in rows:
+                row['project'] = project
+        return rows
+
+    def _rows_to_messages(self, rows):
+        messages = []
+        for row in rows:
+            message = row.message
+            if isinstance(message, str):
+                # Messages were encoded twice before the JSON column did it
+                message = json.loads(message)
+            message = self._message_from_dict(message)
+            messages.append(message)
+        return messages
+
+    @staticmethod
+    def _async_url(connect_str: str):
+        url = make_url(connect_str)
+        if '+' not in url.drivername and url.drivername in ASYNC_DRIVERS:
+            url = url.set(drivername=ASYNC_DRIVERS[url.drivername])
+        return url
     
     @staticmethod
     def _message_from_dict(message: dict):
@@ -101,4 +409,4 @@ class MemoryStore(BaseMemory):
 #     print(memory.get_history(project, session_id))
 
 #     memory.drop(project)
-#     print(memory.check(project))
\ No newline at end of file
+#     print(memory.check(project))
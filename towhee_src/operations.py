@@ -1,11 +1,15 @@
 import sys
 import os
+import asyncio
 import logging
+from typing import List
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from towhee_src.memory import MemoryStore
+from towhee_src.memory import MemoryStore, dispose_async_engines
 from towhee_src.pipelines import TowheePipelines
+from common import AnswerCache, SyncManifest, project_generations, scan_files
+from config import ANSWERCACHE_CONFIG, SYNC_CONFIG, MEMORYDB_CONFIG
 
 
 logger = logging.getLogger(__name__)
@@ -13,42 +17,215 @@ logger = logging.getLogger(__name__)
 
 towhee_pipelines = TowheePipelines()
 memory_store = MemoryStore()
+history_window = MEMORYDB_CONFIG.get('history_window', 0)
 
 # Initiate pipelines
 insert_pipeline = towhee_pipelines.insert_pipeline
 search_pipeline = towhee_pipelines.search_pipeline
 
+if ANSWERCACHE_CONFIG.get('enable', False):
+    # Questions are matched with the same text encoder as the LangChain option
+    from langchain_src.embedding import TextEncoder
+    encoder = TextEncoder()
+    answer_cache = AnswerCache(
+        threshold=ANSWERCACHE_CONFIG.get('threshold', 0.95),
+        ttl=ANSWERCACHE_CONFIG.get('ttl', 3600),
+        max_size=ANSWERCACHE_CONFIG.get('max_size', 1000)
+    )
+else:
+    answer_cache = None
+
 def chat(session_id, project, question):
     '''Chat API'''
+    async def _chat():
+        try:
+            return await chat_async(session_id=session_id, project=project, question=question)
+        finally:
+            # Each asyncio.run has a new event loop, engines bound to this one are closed with it
+            await dispose_async_engines()
+
+    return asyncio.run(_chat())
+
+
+async def chat_async(session_id, project, question):
+    '''Async chat API'''
     try:
-        history = memory_store.get_history(project, session_id)
-        res = search_pipeline(question, history, project)
-        final_answer = res.get()[0]
+        history = await memory_store.aget_history(project, session_id, limit=history_window)
+        cache_key, final_answer = await _lookup_answer(project, question, history)
+        if final_answer is None:
+            # Towhee runtime pipelines are synchronous, run the search off the event loop
+            res = await asyncio.to_thread(search_pipeline, question, history, project)
+            final_answer = res.get()[0]
+            _cache_answer(project, cache_key, final_answer)
 
         # Update history
         messages = [(question, final_answer)]
-        memory_store.add_history(project, session_id, messages)
+        await memory_store.aadd_history(project, session_id, messages)
         return final_answer
     except Exception as e:
         print(e)
         return 'Something went wrong. Please clear history and try again!'
 
 
+async def chat_stream(session_id, project, question):
+    '''Streaming chat API, with the same output as chat_async.
+    The osschat search pipeline returns the LLM answer as one row, so the answer is yielded once it is ready
+    and the turn is saved to memory after the stream ends.
+    '''
+    history = await memory_store.aget_history(project, session_id, limit=history_window)
+    cache_key, final_answer = await _lookup_answer(project, question, history)
+    if final_answer is not None:
+        yield final_answer
+    else:
+        res = await asyncio.to_thread(search_pipeline, question, history, project)
+        final_answer = ''
+        while True:
+            row = res.get()
+            if row is None:
+                break
+            final_answer += row[0]
+            yield row[0]
+        _cache_answer(project, cache_key, final_answer)
+
+    messages = [(question, final_answer)]
+    await memory_store.aadd_history(project, session_id, messages)
+
+
+async def _lookup_answer(project, question, history):
+    '''Look up answer cache for the first question of a session, later ones depend on the conversation.
+    Returns the key to cache a new answer (None if not cacheable) and the cached answer (None on miss).
+    '''
+    if answer_cache is None or len(history) > 0:
+        return None, None
+    epoch = answer_cache.epoch(project)
+    embedding = await asyncio.to_thread(encoder.embed_query, question)
+    return (embedding, epoch), answer_cache.lookup(project, embedding)
+
+
+def _cache_answer(project, cache_key, answer):
+    if cache_key is not None:
+        embedding, epoch = cache_key
+        answer_cache.add(project, embedding, answer, epoch=epoch)
+
+
+def cache_stats():
+    '''Hit/miss counters of answer cache.'''
+    if answer_cache is None:
+        return {'enable': False}
+    return {'enable': True, **answer_cache.stats()}
+
+
+def encoder_stats():
+    '''Query embedding cache and micro-batching metrics of the answer cache text encoder.'''
+    if answer_cache is None:
+        return {'enable': False}
+    embedding_cache = getattr(encoder, 'embedding_cache', None)
+    embedding_batcher = getattr(encoder, 'embedding_batcher', None)
+    return {
+        'cache': embedding_cache.stats() if embedding_cache else {'enable': False},
+        'batcher': embedding_batcher.stats() if embedding_batcher else {'enable': False}
+    }
+
+
+def memory_stats():
+    '''Connection pool status of the engine shared by memory stores.'''
+    return {'pool': memory_store.engine.pool.status()}
+
+
+def project_changed(project: str):
+    '''Bump project generation and drop cached answers of project, called when its data changes.
+    Retrieval runs inside the search pipeline, so there are no cached search results to drop.
+    '''
+    project_generations.bump(project)
+    if answer_cache:
+        answer_cache.invalidate(project)
+
+
 def insert(data_src, project, source_type: str = 'file'):
     '''Load project docs will load docs from data source and then insert doc embeddings into the project table in the vector store.
     If there is no project table, it will create one.
+    The insert pipeline splits and embeds docs inside, so no duplicate chunks are skipped.
     '''
     if not towhee_pipelines.check(project):
         towhee_pipelines.create(project)
-    res = insert_pipeline(data_src, project).to_list()
-    num = towhee_pipelines.count_entities(project)
-    assert len(res) <= num, 'Failed to insert data.'
-    return len(res)
+    num = _insert(data_src, project)
+    project_changed(project)
+    return {'inserted': num, 'skipped': 0}
+
+
+def _insert(data_src, project):
+    '''Run the insert pipeline, returning the number of rows written.
+    Rows are not flushed here, the flush scheduler of pipelines flushes them in batches.
+    '''
+    num = len(insert_pipeline(data_src, project).to_list())
+    towhee_pipelines.add_entities(project, num)
+    return num
+
+
+def upsert_source(project, source, source_type: str = 'file'):
+    '''Update chunks of one source (file path or url) in the project, chunks of other sources are untouched.
+    The insert pipeline stores no content hashes, so all chunks of the source are deleted and inserted again.
+    '''
+    if not towhee_pipelines.check(project):
+        towhee_pipelines.create(project)
+    try:
+        deleted = towhee_pipelines.delete_source(project, source)
+        num = _insert(source, project)
+    finally:
+        project_changed(project)
+    return {'inserted': num, 'deleted': deleted, 'unchanged': 0}
+
+
+def sync(project, data_dir, patterns: List[str] = None):
+    '''Sync files under data_dir to the project, working on the diff since the last sync only.
+    A manifest of the project records content hashes of synced files: unchanged files are skipped,
+    changed files are inserted again and removed ones are deleted.
+    '''
+    manifest = SyncManifest(project, path=SYNC_CONFIG.get('manifest_path', 'sync_manifest'))
+    files = scan_files(data_dir, patterns or SYNC_CONFIG.get('patterns', ['*.md']))
+    changed, removed = manifest.diff(files)
+    if not towhee_pipelines.check(project):
+        towhee_pipelines.create(project)
+    res = {'inserted': 0, 'deleted': 0, 'unchanged': 0,
+           'files_changed': len(changed), 'files_removed': len(removed), 'files_unchanged': len(files) - len(changed)}
+    try:
+        for path, content in changed.items():
+            # The insert pipeline stores no content hashes, chunks of a changed file are all replaced
+            res['deleted'] += towhee_pipelines.delete_source(project, path)
+            res['inserted'] += _insert(path, project)
+            manifest.update(path, content, [])
+        for path in removed:
+            res['deleted'] += towhee_pipelines.delete_source(project, path)
+            manifest.remove(path)
+    finally:
+        # Keep progress of synced files if a later one failed
+        manifest.save()
+        if changed or removed:
+            project_changed(project)
+    return res
+
+
+def delete_source(project, source):
+    '''Delete chunks of one source (file path or url) from the project.'''
+    assert towhee_pipelines.check(project), f'No project store: {project}'
+    try:
+        num = towhee_pipelines.delete_source(project, source)
+    finally:
+        project_changed(project)
+    return num
+
+
+def count(project):
+    '''Number of doc chunks in the project, cached by pipelines so status checks never flush.'''
+    assert towhee_pipelines.check(project), f'No project store: {project}'
+    return towhee_pipelines.count_entities(project)
 
 
 def drop(project):
     '''Drop project will clean both vector and memory stores.'''
     status = check(project)
+    project_changed(project)
+    SyncManifest.drop(project, path=SYNC_CONFIG.get('manifest_path', 'sync_manifest'))
     # Clear vector db
     try:
         if status['store']:
@@ -1,5 +1,8 @@
 import sys
 import os
+import json
+import logging
+import threading
 from typing import Any, Dict
 
 from pymilvus import Collection, connections
@@ -9,6 +12,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '../..'))
 
 from towhee_src.base import BasePipelines
 from towhee_src.pipelines.prompts import PROMPT_OP
+from towhee_src.pipelines.flush import FlushScheduler
 from config import (
     USE_SCALAR, LLM_OPTION,
     TEXTENCODER_CONFIG, CHAT_CONFIG,
@@ -16,6 +20,11 @@ from config import (
     RERANK_CONFIG
     )
 
+logger = logging.getLogger(__name__)
+
+# Rerank options accepted by the osschat-search pipeline config, others are for the LangChain option
+TOWHEE_RERANK_KEYS = ['rerank', 'rerank_model', 'threshold']
+
 
 class TowheePipelines(BasePipelines):
     def __init__(self, 
@@ -46,6 +55,19 @@ class TowheePipelines(BasePipelines):
         self.milvus_topk = vectordb_config.get('top_k', 5)
         self.milvus_threshold = vectordb_config.get('threshold', 0)
         self.milvus_index_params = vectordb_config.get('index_params', {})
+        flush_config = vectordb_config.get('flush', {})
+
+        # Inserts do not flush, collections are flushed in batches by the scheduler
+        self.flush_scheduler = FlushScheduler(
+            flush_func=lambda project: Collection(project).flush(),
+            interval=flush_config.get('interval', 30),
+            max_rows=flush_config.get('max_rows', 10000)
+        )
+        # Cached numbers of entities by project, kept up to date by inserts & deletes of this process
+        self._entity_counts = {}
+        # Changes by inserts & deletes during counts in flight, by project, added to the count once it is read
+        self._count_deltas = {}
+        self._count_lock = threading.Lock()
 
         connections.connect(
             host=self.milvus_host,
@@ -85,7 +107,7 @@ class TowheePipelines(BasePipelines):
         search_config = AutoConfig.load_config(
             'osschat-search',
             llm_src=self.llm_src,
-            **self.rerank_config,
+            **{k: v for k, v in self.rerank_config.items() if k in TOWHEE_RERANK_KEYS},
             **self.chat_config[self.llm_src]
             )
         
@@ -157,10 +179,18 @@ class TowheePipelines(BasePipelines):
 
         index_params = self.milvus_index_params
         collection.create_index(field_name="embedding", index_params=index_params)
+
+        if self.use_scalar and not self.es_client.indices.exists(index=project):
+            # Sources are matched exactly by delete_source, map them as keywords before the insert pipeline
+            # indexes them by dynamic mapping, whose "doc.keyword" ignores values over 256 chars (e.g. long urls)
+            self.es_client.indices.create(index=project, mappings={'properties': {'doc': {'type': 'keyword'}}})
         return collection
 
     def drop(self, project):
         assert self.check(project), f'No project store: {project}'
+        self.flush_scheduler.discard(project)
+        with self._count_lock:
+            self._entity_counts.pop(project, None)
         # drop vector store
         collection = Collection(project)
         collection.drop()
@@ -171,6 +201,34 @@ class TowheePipelines(BasePipelines):
 
         assert not self.check(project), f'Failed to drop project store : {project}'
 
+    def delete_source(self, project, source):
+        '''Delete doc chunks of one source, the insert pipeline saves the source (file path or url) as text_id'''
+        collection = Collection(project)
+        # Milvus deletes by primary keys only, so look up the chunks first
+        res = collection.query(expr=f'text_id == {json.dumps(source, ensure_ascii=False)}', output_fields=['id'])
+        ids = [x['id'] for x in res]
+        if len(ids) > 0:
+            collection.delete(expr=f'id in {ids}')
+
+        if self.use_scalar:
+            # The insert pipeline indexes the source in the "doc" field
+            self.es_client.delete_by_query(
+                index=project, query={'term': {self._source_field(project, source): source}}, refresh=True)
+        self._update_count(project, -len(ids))
+        return len(ids)
+
+    def _source_field(self, project, source):
+        '''ES field matching sources exactly: "doc" mapped as keyword by create,
+        or the "doc.keyword" sub-field of indices mapped dynamically before.
+        '''
+        mappings = self.es_client.indices.get_mapping(index=project)[project]['mappings']
+        if mappings.get('properties', {}).get('doc', {}).get('type') == 'keyword':
+            return 'doc'
+        if len(source) > 256:
+            logger.warning('Source over 256 chars is not indexed by "doc.keyword" of %s, its chunks are kept in Elastic. '
+                           'Drop and insert the project again to map sources as keywords.', project)
+        return 'doc.keyword'
+
     def check(self, project):
         from pymilvus import utility
 
@@ -179,11 +237,43 @@ class TowheePipelines(BasePipelines):
             assert self.es_client.indices.exists(index=project) == status # check scalar store
         return status
     
-    def count_entities(self, project):
-        collection = Collection(project)
-        collection.flush()
-        milvus_count = collection.num_entities
+    def add_entities(self, project, num):
+        '''Record num entities inserted into project by the insert pipeline, to be flushed by the scheduler.'''
+        self._update_count(project, num)
+        self.flush_scheduler.add(project, num)
+
+    def count_entities(self, project, exact: bool = False):
+        '''Number of entities in project.
+        The count is read from Milvus once per project and then kept by inserts & deletes of this process.
+        With exact, it is read again and compared with the scalar store.
+        Live rows are counted by a count(*) query, so deleted rows not compacted yet are left out and no flush is needed.
+        '''
+        delta = [0]
+        with self._count_lock:
+            if not exact and project in self._entity_counts:
+                return self._entity_counts[project]
+            # Inserts & deletes finishing while the count is read are recorded, not lost
+            self._count_deltas.setdefault(project, []).append(delta)
+        try:
+            res = Collection(project).query(expr='', output_fields=['count(*)'], consistency_level='Strong')
+            milvus_count = res[0]['count(*)']
+        finally:
+            with self._count_lock:
+                self._count_deltas[project].remove(delta)
+                if not self._count_deltas[project]:
+                    del self._count_deltas[project]
         if self.use_scalar:
             es_count = self.es_client.count(index=project)['count']
-            assert es_count == milvus_count, 'Mismatched data count in Milvus vs Elastic.'
-        return milvus_count
\ No newline at end of file
+            if es_count != milvus_count:
+                logger.warning('Mismatched data count of %s: %s in Milvus vs %s in Elastic.',
+                               project, milvus_count, es_count)
+        with self._count_lock:
+            self._entity_counts[project] = max(0, milvus_count + delta[0])
+            return self._entity_counts[project]
+
+    def _update_count(self, project, num):
+        with self._count_lock:
+            if project in self._entity_counts:
+                self._entity_counts[project] = max(0, self._entity_counts[project] + num)
+            for delta in self._count_deltas.get(project, []):
+                delta[0] += num
@@ -0,0 +1,95 @@
+import time
+import atexit
+import logging
+import threading
+from typing import Callable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class FlushScheduler:
+    '''Flush Milvus collections in the background instead of after every insert.
+
+    Inserted rows are recorded per project. A worker thread flushes a project once max_rows rows are pending,
+    or once its oldest pending row has waited interval seconds, so frequent small inserts make fewer, larger segments.
+    Pending projects are flushed at exit.
+
+    Args:
+        flush_func (Callable): function flushing the collection of a project.
+        interval (float): maximum seconds between an insert and the flush of its rows.
+        max_rows (int): number of pending rows of a project which triggers a flush right away.
+    '''
+
+    def __init__(self, flush_func: Callable[[str], None], interval: float = 30, max_rows: int = 10000):
+        self.flush_func = flush_func
+        self.interval = interval
+        self.max_rows = max_rows
+        self.flushes = 0
+        # Pending rows and time of the first pending insert by project
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='milvus-flush', daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def add(self, project: str, rows: int):
+        '''Record rows inserted into project.'''
+        with self._cond:
+            pending = self._pending.setdefault(project, [0, time.monotonic()])
+            pending[0] += rows
+            if pending[0] >= self.max_rows:
+                self._cond.notify()
+
+    def pending(self, project: str) -> int:
+        '''Number of rows of project not flushed yet.'''
+        with self._cond:
+            return self._pending.get(project, [0])[0]
+
+    def discard(self, project: str):
+        '''Forget pending rows of project, e.g. when it is dropped.'''
+        with self._cond:
+            self._pending.pop(project, None)
+
+    def flush(self, project: Optional[str] = None):
+        '''Flush pending rows of project (of all projects if None) right away.'''
+        with self._cond:
+            projects = list(self._pending) if project is None else [project] if project in self._pending else []
+            for x in projects:
+                del self._pending[x]
+        self._flush(projects)
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._worker.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                due = [x for x, (rows, since) in self._pending.items()
+                       if rows >= self.max_rows or now - since >= self.interval]
+                for x in due:
+                    del self._pending[x]
+                if not due:
+                    # Sleep until the oldest pending project is due, or until an insert fills a batch
+                    wait = min([since + self.interval - now for _, since in self._pending.values()] + [self.interval])
+                    self._cond.wait(timeout=max(wait, 0.01))
+                    continue
+            self._flush(due)
+
+    def _flush(self, projects: list):
+        for project in projects:
+            try:
+                self.flush_func(project)
+                self.flushes += 1
+            except Exception as e:  # pylint: disable=W0718
+                logger.error('Failed to flush project %s:\n%s', project, e)